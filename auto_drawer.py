@@ -1,21 +1,177 @@
-import tkinter as tk
-from tkinter import ttk, messagebox, Toplevel, Canvas
-from PIL import Image, ImageTk, ImageGrab
+import time
+_module_start = time.perf_counter() # 用于统计命令行模式的启动耗时
+from PIL import Image
 import cv2
 import numpy as np
-import pyautogui
-from pynput import keyboard
 import threading
-import time
+import math
 import os
+import sys
+import hashlib
+import json
+import platform
+import bisect
+import queue
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# --- 延迟导入 ---
+# tkinter、pyautogui、pynput 只在使用界面或实际绘画时才导入，命令行批处理不需要图形环境，启动也更快
+tk = ttk = messagebox = filedialog = Toplevel = Canvas = None
+ImageTk = ImageGrab = None
+pyautogui = None
+keyboard = None
+
+def load_gui_modules():
+    global tk, ttk, messagebox, filedialog, Toplevel, Canvas, ImageTk, ImageGrab
+    if tk is None:
+        import tkinter as tk
+        from tkinter import ttk, messagebox, filedialog, Toplevel, Canvas
+        from PIL import ImageTk, ImageGrab
+
+def load_input_modules():
+    # 鼠标模拟与键盘监听，需要图形环境
+    global pyautogui, keyboard
+    if pyautogui is None:
+        import pyautogui
+        from pynput import keyboard
+
+def show_message(kind, title, message):
+    # kind 为 "info"/"warning"/"error"。界面已加载时弹出对话框，否则（命令行模式）打印到终端
+    if messagebox is not None:
+        getattr(messagebox, "show" + kind)(title, message)
+    else:
+        print(f"{title}: {message}", file=sys.stderr if kind == "error" else sys.stdout)
 
 # --- 全局变量 ---
 captured_pil_image = None # 捕获的 PIL 图像
-linework_pil_image = None # 线稿 PIL 图像
+captured_image_hash = None # 捕获图像的内容哈希
+captured_bbox = None # 截图的屏幕区域 (x1, y1, x2, y2)，实时跟随模式会反复截取该区域
+linework_edges = None # 线稿：Canny 输出的白线黑底 uint8 数组，反转颜色只在显示时应用
+linework_key = None # 当前线稿的来源标识 (截图哈希, 阈值1, 阈值2)
 drawing_thread = None # 绘画线程
 drawing_active = False # 绘画活动状态标志
+drawing_cancel_token = None # 当前绘画的取消令牌 (CancellationToken)，ESC 通过它通知绘画线程停止
 app_running = True  # 应用程序运行状态标志，用于优雅地关闭线程
 keyboard_listener_thread = None # 键盘监听线程
+drawing_checkpoint = None # 上一次中断的绘画进度 (DrawCheckpoint)，按 F6 从此处继续
+
+# --- 运行遥测 ---
+TELEMETRY_INTERVAL = 0.25 # 绘画进度推送到状态栏的最小间隔（秒）
+TRACE_DIR = os.path.join(os.path.expanduser("~"), ".auto_drawer", "traces")
+_recent_stage_spans = deque(maxlen=64) # 最近的截图/线稿/计划阶段耗时 (名称, 开始, 结束, 参数)
+
+def record_stage(name, start, end, **details):
+    # 记录一次流水线阶段的耗时（time.perf_counter 时间），绘画时会一并写入运行跟踪
+    _recent_stage_spans.append((name, start, end, threading.get_ident(), details))
+
+class DrawTelemetry:
+    # 记录一次绘画的阶段耗时与进度，按节流间隔回调 on_progress(snapshot)，并可导出 Chrome trace-event JSON
+    def __init__(self, total_strokes=0, total_points=0, on_progress=None, interval=TELEMETRY_INTERVAL,
+                 record_strokes=False):
+        self.total_strokes = total_strokes
+        self.total_points = total_points
+        self.on_progress = on_progress
+        self.interval = interval
+        self.record_strokes = record_strokes # 每条笔画记为一个跟踪事件，只在需要导出跟踪时打开
+        self.spans = list(_recent_stage_spans) # 绘画之前的截图、线稿、计划阶段
+        self.counters = []
+        self.strokes_done = 0
+        self.points_done = 0
+        self.t0 = time.perf_counter()
+        self.requested_at = self.t0 # 用户确认开始绘画的时刻，用于统计首笔延迟
+        self.injection_start = None
+        self.first_stroke_at = None
+        self._last_report = 0.0
+        self._last_points = 0
+        self._rate = None # 最近的点/秒（指数平滑）
+
+    def add_span(self, name, start, end, **details):
+        self.spans.append((name, start, end, threading.get_ident(), details))
+
+    def start_injection(self):
+        self.injection_start = self._last_report = time.perf_counter()
+
+    def stroke_begin(self):
+        now = time.perf_counter()
+        if self.first_stroke_at is None:
+            self.first_stroke_at = now
+            self.add_span("time_to_first_stroke", self.requested_at, now)
+        return now
+
+    @property
+    def first_stroke_latency(self):
+        return None if self.first_stroke_at is None else self.first_stroke_at - self.requested_at
+
+    def stroke_done(self, points, stroke_start=None):
+        now = time.perf_counter()
+        self.strokes_done += 1
+        self.points_done += points
+        if self.record_strokes and stroke_start is not None:
+            self.add_span("stroke", stroke_start, now, index=self.strokes_done - 1, points=points)
+        if now - self._last_report >= self.interval:
+            self._report(now)
+
+    def _report(self, now):
+        rate = (self.points_done - self._last_points) / max(now - self._last_report, 1e-6)
+        self._rate = rate if self._rate is None else 0.3 * rate + 0.7 * self._rate
+        self._last_report, self._last_points = now, self.points_done
+        snapshot = self.snapshot(now)
+        self.counters.append((now, snapshot["points_per_second"], snapshot["strokes_per_second"]))
+        if self.on_progress is not None:
+            self.on_progress(snapshot)
+
+    def snapshot(self, now=None):
+        now = time.perf_counter() if now is None else now
+        elapsed = now - (self.injection_start or self.t0)
+        points_rate = self._rate if self._rate is not None else (self.points_done / elapsed if elapsed > 0 else 0.0)
+        remaining = max(self.total_points - self.points_done, 0)
+        eta = remaining / points_rate if points_rate > 0 else None
+        return {
+            "elapsed": elapsed,
+            "strokes_done": self.strokes_done,
+            "points_done": self.points_done,
+            "total_strokes": self.total_strokes,
+            "total_points": self.total_points,
+            "progress": self.points_done / self.total_points if self.total_points else 0.0,
+            "points_per_second": points_rate,
+            "strokes_per_second": self.strokes_done / elapsed if elapsed > 0 else 0.0,
+            "eta": eta,
+        }
+
+    def stage_summary(self):
+        # {阶段名: 秒数}，同名阶段取最近一次（单条笔画不计入）
+        return {name: end - start for name, start, end, _, _ in self.spans if name != "stroke"}
+
+    def to_chrome_trace(self):
+        # 可在 chrome://tracing 或 Perfetto 中打开
+        base = min([self.t0] + [span[1] for span in self.spans])
+        pid = os.getpid()
+        events = []
+        for name, start, end, tid, details in self.spans:
+            events.append({"name": name, "cat": "stroke" if name == "stroke" else "stage", "ph": "X",
+                           "ts": (start - base) * 1e6, "dur": (end - start) * 1e6,
+                           "pid": pid, "tid": tid, "args": details})
+        for t, points_rate, strokes_rate in self.counters:
+            events.append({"name": "throughput", "ph": "C", "ts": (t - base) * 1e6, "pid": pid,
+                           "args": {"points/s": round(points_rate, 1), "strokes/s": round(strokes_rate, 2)}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_chrome_trace(self, path=None):
+        if path is None:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            path = os.path.join(TRACE_DIR, time.strftime("trace-%Y%m%d-%H%M%S.json"))
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f, ensure_ascii=False)
+        return path
+
+def format_progress(snapshot):
+    # 状态栏上的进度文字
+    eta = snapshot["eta"]
+    return (f"绘画中... {snapshot['progress'] * 100:.1f}% "
+            f"({snapshot['strokes_done']}/{snapshot['total_strokes']} 笔, {snapshot['points_done']}/{snapshot['total_points']} 点)，"
+            f"{snapshot['points_per_second']:.0f} 点/秒，{snapshot['strokes_per_second']:.1f} 笔/秒，"
+            f"剩余约 {format_duration(eta) if eta is not None else '-'}。按 ESC 停止。")
 
 # --- 截图功能 ---
 class ScreenshotSelector:
@@ -67,243 +223,2871 @@ class ScreenshotSelector:
         cur_y = self.canvas.canvasy(event.y)
         self.canvas.coords(self.rect, self.start_x, self.start_y, cur_x, cur_y)
 
-    def on_mouse_release(self, event):
-        end_x = self.canvas.canvasx(event.x)
-        end_y = self.canvas.canvasy(event.y)
-        self.selector_window.destroy()
+    def on_mouse_release(self, event):
+        end_x = self.canvas.canvasx(event.x)
+        end_y = self.canvas.canvasy(event.y)
+        self.selector_window.destroy()
+
+        x1, y1 = min(self.start_x, end_x), min(self.start_y, end_y)
+        x2, y2 = max(self.start_x, end_x), max(self.start_y, end_y)
+
+        if x2 - x1 > 0 and y2 - y1 > 0: # 确保是有效区域
+            bbox = (x1, y1, x2, y2)
+            # 短暂延迟以确保选择器窗口消失后再截图
+            self.parent.after(100, lambda: self.grab_screen(bbox))
+        else:
+            self.on_complete_callback(None)
+
+
+    def grab_screen(self, bbox):
+        global captured_bbox
+        try:
+            bbox = tuple(int(round(v)) for v in bbox)
+            captured_bbox = bbox
+            t0 = time.perf_counter()
+            capture = get_capture_backend()
+            img, gray = capture.grab_pil_and_gray(bbox)
+            record_stage("capture", t0, time.perf_counter(), width=img.width, height=img.height, backend=capture.name)
+            self.on_complete_callback(img, gray)
+        except Exception as e:
+            print(f"截图失败: {e}")
+            messagebox.showerror("截图错误", f"截图失败: {e}")
+            self.on_complete_callback(None)
+
+    def cancel_selection(self, event=None):
+        self.selector_window.destroy()
+        self.on_complete_callback(None)
+
+# --- 屏幕截图后端 ---
+# grab(bbox) 返回 (高, 宽, 4) 的 BGRA 数组，可能是后端内部缓冲区的视图，下一次截图时会被覆盖；
+# 需要保留结果时用 grab_gray 或 grab_pil，它们会写入新的（或调用方提供的）数组。
+class CaptureBackend:
+    name = "base"
+
+    def __init__(self):
+        self._lock = threading.Lock() # 截图连接不能被多个线程同时使用
+
+    def grab(self, bbox):
+        raise NotImplementedError
+
+    def grab_gray(self, bbox, out=None):
+        # out 为形状匹配的 uint8 数组时直接写入，重复截图时可复用
+        with self._lock:
+            return cv2.cvtColor(self.grab(bbox), cv2.COLOR_BGRA2GRAY, dst=out)
+
+    def grab_pil(self, bbox):
+        with self._lock:
+            frame = np.ascontiguousarray(self.grab(bbox))
+            height, width = frame.shape[:2]
+            return Image.frombuffer("RGB", (width, height), frame, "raw", "BGRX", 0, 1).copy()
+
+    def grab_pil_and_gray(self, bbox):
+        # 同一帧的 PIL 图像（用于显示）和灰度数组（线稿处理用），灰度直接由截图帧转换，不经过 PIL
+        with self._lock:
+            frame = np.ascontiguousarray(self.grab(bbox))
+            height, width = frame.shape[:2]
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGRA2GRAY)
+            return Image.frombuffer("RGB", (width, height), frame, "raw", "BGRX", 0, 1).copy(), gray
+
+    def close(self):
+        pass
+
+class ImageGrabCapture(CaptureBackend):
+    # 通用回退：Pillow 的 ImageGrab，每次都会生成新的 PIL 图像，颜色转换写入复用的缓冲区
+    name = "imagegrab"
+
+    def __init__(self):
+        super().__init__()
+        from PIL import ImageGrab as grabber
+        self._grabber = grabber
+        self._buffer = None
+
+    def grab(self, bbox):
+        image = self._grabber.grab(bbox=bbox, all_screens=True).convert("RGB")
+        rgb = np.asarray(image)
+        if self._buffer is None or self._buffer.shape[:2] != rgb.shape[:2]:
+            self._buffer = np.empty(rgb.shape[:2] + (4,), dtype=np.uint8)
+        return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGRA, dst=self._buffer)
+
+    def grab_pil(self, bbox):
+        with self._lock:
+            return self._grabber.grab(bbox=bbox, all_screens=True)
+
+    def grab_pil_and_gray(self, bbox):
+        image = self.grab_pil(bbox)
+        return image, to_gray_array(image)
+
+class MSSCapture(CaptureBackend):
+    # 使用 mss（可选依赖）。结果直接包装 mss 的原始 BGRA 数据，不经过 PIL
+    name = "mss"
+
+    def __init__(self):
+        super().__init__()
+        import mss
+        self._mss = mss.mss()
+
+    def grab(self, bbox):
+        left, top, right, bottom = bbox
+        shot = self._mss.grab({"left": left, "top": top, "width": right - left, "height": bottom - top})
+        return np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+
+    def close(self):
+        self._mss.close()
+
+class XShmCapture(CaptureBackend):
+    # Linux (X11) 下通过 MIT-SHM 扩展截图：X 服务器把像素直接写入共享内存，返回的数组是这块内存的视图。
+    # 区域尺寸不变时共享内存段在多次截图之间复用。通过 ctypes 调用 libX11/libXext，不需要额外的 Python 包。
+    name = "xshm"
+
+    def __init__(self, display_name=None):
+        super().__init__()
+        import ctypes
+        import ctypes.util
+        self._ct = ctypes
+        x11 = ctypes.CDLL(ctypes.util.find_library("X11") or "libX11.so.6")
+        xext = ctypes.CDLL(ctypes.util.find_library("Xext") or "libXext.so.6")
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+        class XShmSegmentInfo(ctypes.Structure):
+            _fields_ = [("shmseg", ctypes.c_ulong), ("shmid", ctypes.c_int),
+                        ("shmaddr", ctypes.c_void_p), ("readOnly", ctypes.c_int)]
+
+        class XImage(ctypes.Structure): # 只声明用到的前几个字段
+            _fields_ = [("width", ctypes.c_int), ("height", ctypes.c_int), ("xoffset", ctypes.c_int),
+                        ("format", ctypes.c_int), ("data", ctypes.c_void_p), ("byte_order", ctypes.c_int),
+                        ("bitmap_unit", ctypes.c_int), ("bitmap_bit_order", ctypes.c_int),
+                        ("bitmap_pad", ctypes.c_int), ("depth", ctypes.c_int),
+                        ("bytes_per_line", ctypes.c_int), ("bits_per_pixel", ctypes.c_int)]
+
+        self._XShmSegmentInfo = XShmSegmentInfo
+        x11.XOpenDisplay.restype = ctypes.c_void_p
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x11.XDefaultRootWindow.restype = ctypes.c_ulong
+        x11.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        x11.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        x11.XDefaultVisual.restype = ctypes.c_void_p
+        x11.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XFree.argtypes = [ctypes.c_void_p]
+        x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmCreateImage.restype = ctypes.POINTER(XImage)
+        xext.XShmCreateImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+                                         ctypes.c_char_p, ctypes.POINTER(XShmSegmentInfo), ctypes.c_uint, ctypes.c_uint]
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo)]
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(XImage),
+                                      ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+        self._x11, self._xext, self._libc = x11, xext, libc
+
+        self._display = x11.XOpenDisplay(display_name.encode() if display_name else None)
+        if not self._display:
+            raise RuntimeError("无法连接 X 服务器")
+        # 先检查扩展再安装错误处理函数：构造失败时不能让 libX11 留着指向已回收回调的进程级处理函数
+        if not xext.XShmQueryExtension(self._display):
+            x11.XCloseDisplay(self._display)
+            raise RuntimeError("X 服务器不支持 MIT-SHM")
+        # X 错误默认会直接结束进程：本连接上的错误记录下来由 grab 抛出异常，其他连接（如 Tk）交给原来的处理函数
+        handler_type = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
+        x11.XSetErrorHandler.restype = handler_type
+        x11.XSetErrorHandler.argtypes = [handler_type]
+        self._x_error = None
+        def on_x_error(display, event):
+            if display == self._display or not self._previous_handler:
+                self._x_error = True
+                return 0
+            return self._previous_handler(display, event)
+        self._error_handler = handler_type(on_x_error) # 保持引用，防止回调被回收
+        self._previous_handler = x11.XSetErrorHandler(self._error_handler)
+        try:
+            screen = x11.XDefaultScreen(self._display)
+            self._root = x11.XDefaultRootWindow(self._display)
+            self._visual = x11.XDefaultVisual(self._display, screen)
+            self._depth = x11.XDefaultDepth(self._display, screen)
+            self._screen_size = (x11.XDisplayWidth(self._display, screen), x11.XDisplayHeight(self._display, screen))
+        except BaseException:
+            x11.XCloseDisplay(self._display)
+            x11.XSetErrorHandler(self._previous_handler)
+            raise
+        self._image = None
+        self._shminfo = None
+        self._frame = None # 共享内存上的 BGRA 视图
+        self._padded = None # 区域超出屏幕时使用的缓冲区
+
+    @classmethod
+    def is_available(cls, display_name=None):
+        if not sys.platform.startswith("linux") or not (display_name or os.environ.get("DISPLAY")):
+            return False
+        try:
+            cls(display_name).close()
+            return True
+        except Exception:
+            return False
+
+    def _release_image(self):
+        if self._image is None:
+            return
+        self._xext.XShmDetach(self._display, self._ct.byref(self._shminfo))
+        self._x11.XSync(self._display, 0)
+        self._image.contents.data = None # 像素在共享内存中，由 shmdt 释放
+        self._x11.XFree(self._image)
+        self._libc.shmdt(self._shminfo.shmaddr)
+        self._image = self._shminfo = self._frame = None
+
+    def _ensure_image(self, width, height):
+        if self._image is not None and self._frame.shape[:2] == (height, width):
+            return # 尺寸不变，复用共享内存段
+        self._release_image()
+        ct = self._ct
+        shminfo = self._XShmSegmentInfo()
+        image = self._xext.XShmCreateImage(self._display, self._visual, self._depth, 2, None, # 2 = ZPixmap
+                                           ct.byref(shminfo), width, height)
+        if not image:
+            raise RuntimeError("XShmCreateImage 失败")
+        if image.contents.bits_per_pixel != 32:
+            self._x11.XFree(image)
+            raise RuntimeError(f"不支持 {image.contents.bits_per_pixel} 位色深")
+        size = image.contents.bytes_per_line * height
+        shminfo.shmid = self._libc.shmget(0, size, 0o1600) # IPC_PRIVATE, IPC_CREAT | 0600
+        if shminfo.shmid < 0:
+            self._x11.XFree(image)
+            raise OSError(ct.get_errno(), "shmget 失败")
+        address = self._libc.shmat(shminfo.shmid, None, 0)
+        if address in (None, ct.c_void_p(-1).value):
+            self._libc.shmctl(shminfo.shmid, 0, None)
+            self._x11.XFree(image)
+            raise OSError(ct.get_errno(), "shmat 失败")
+        shminfo.shmaddr = address
+        shminfo.readOnly = 0
+        image.contents.data = address
+        self._x_error = None
+        attached = self._xext.XShmAttach(self._display, ct.byref(shminfo))
+        self._x11.XSync(self._display, 0)
+        self._libc.shmctl(shminfo.shmid, 0, None) # IPC_RMID：双方都分离后自动释放
+        if not attached or self._x_error:
+            self._libc.shmdt(address)
+            image.contents.data = None
+            self._x11.XFree(image)
+            raise RuntimeError("XShmAttach 失败")
+        self._image, self._shminfo = image, shminfo
+        buffer = (ct.c_ubyte * size).from_address(address)
+        stride = image.contents.bytes_per_line
+        self._frame = np.frombuffer(buffer, dtype=np.uint8).reshape(height, stride // 4, 4)[:, :width]
+
+    def _grab_inside(self, left, top, width, height):
+        self._ensure_image(width, height)
+        self._x_error = None
+        ok = self._xext.XShmGetImage(self._display, self._root, self._image, left, top,
+                                      self._ct.c_ulong(-1).value) # AllPlanes
+        if not ok or self._x_error:
+            raise RuntimeError("XShmGetImage 失败")
+        return self._frame
+
+    def grab(self, bbox):
+        left, top, right, bottom = bbox
+        screen_w, screen_h = self._screen_size
+        if left >= 0 and top >= 0 and right <= screen_w and bottom <= screen_h:
+            return self._grab_inside(left, top, right - left, bottom - top)
+        # 区域超出屏幕：只截取重叠部分，其余补 0（此时需要一次复制）
+        shape = (bottom - top, right - left, 4)
+        if self._padded is None or self._padded.shape != shape:
+            self._padded = np.zeros(shape, dtype=np.uint8)
+        else:
+            self._padded.fill(0)
+        x0, y0 = max(left, 0), max(top, 0)
+        x1, y1 = min(right, screen_w), min(bottom, screen_h)
+        if x1 > x0 and y1 > y0:
+            self._padded[y0 - top:y1 - top, x0 - left:x1 - left] = self._grab_inside(x0, y0, x1 - x0, y1 - y0)
+        return self._padded
+
+    def close(self):
+        if self._display:
+            self._release_image()
+            self._x11.XCloseDisplay(self._display)
+            self._display = None
+            self._x11.XSetErrorHandler(self._previous_handler) # 回调随对象释放，必须先恢复
+
+CAPTURE_BACKENDS = {
+    "xshm": XShmCapture,
+    "mss": MSSCapture,
+    "imagegrab": ImageGrabCapture,
+}
+_capture_backend = None
+_capture_backend_lock = threading.Lock()
+
+def create_capture_backend(name="auto"):
+    # auto：依次尝试 xshm、mss，最后回退到 ImageGrab
+    if name != "auto":
+        if name not in CAPTURE_BACKENDS:
+            raise ValueError(f"未知的截图后端: {name}")
+        return CAPTURE_BACKENDS[name]()
+    for candidate in ("xshm", "mss"):
+        try:
+            return CAPTURE_BACKENDS[candidate]()
+        except Exception as e:
+            print(f"截图后端 {candidate} 不可用: {e}")
+    return ImageGrabCapture()
+
+def get_capture_backend():
+    # 程序内共享的截图后端，首次使用时创建
+    global _capture_backend
+    with _capture_backend_lock:
+        if _capture_backend is None:
+            _capture_backend = create_capture_backend()
+        return _capture_backend
+
+# --- 图像处理功能 ---
+PREVIEW_PROXY_MAX_SIDE = 800 # 实时预览时 Canny 使用的缩小图最长边（像素）
+
+def to_gray_array(image, out=None):
+    # PIL 图像、截图帧 (BGRA) 或 RGB/灰度数组 -> uint8 灰度数组；out 形状匹配时直接写入，不再分配
+    if isinstance(image, Image.Image):
+        if image.mode not in ("L", "RGB"):
+            image = image.convert("RGB")
+        image = np.asarray(image)
+    if image.ndim == 2:
+        if out is None:
+            return image.copy()
+        np.copyto(out, image)
+        return out
+    code = cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_RGB2GRAY
+    return cv2.cvtColor(image, code, dst=out)
+
+def prepare_linework_source(image, gray=None):
+    # 灰度化 + 高斯模糊。结果只取决于截图本身，调整阈值时可以反复使用。
+    # gray 为截图时已经转换好的灰度数组时直接在其上原地模糊，每张截图只占用这一份全尺寸灰度缓冲区
+    if gray is None:
+        gray = to_gray_array(image)
+    return cv2.GaussianBlur(gray, (5, 5), 0, dst=gray)
+
+def make_preview_proxy(blurred_image, max_side=PREVIEW_PROXY_MAX_SIDE):
+    # 生成用于实时预览的缩小图，图像本身不大时直接返回原图
+    height, width = blurred_image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return blurred_image
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(blurred_image, size, interpolation=cv2.INTER_AREA)
+
+def linework_from_blurred(blurred_image, canny_threshold1, canny_threshold2, out=None):
+    # Canny 边缘检测。线稿统一保存为“白线黑底”的 uint8 数组，笔画规划直接使用，反转颜色只在显示时应用；
+    # out 为形状匹配的数组时直接写入（实时预览反复计算时复用）
+    return cv2.Canny(blurred_image, canny_threshold1, canny_threshold2, edges=out)
+
+def linework_to_pil(linework, invert=False):
+    # 线稿数组 -> PIL 图像，用于显示或保存。不反转时与数组共享内存，反转时才复制
+    return Image.fromarray(cv2.bitwise_not(linework) if invert else linework)
+
+# --- 分块并行线稿 ---
+# 多显示器截图可能非常大，这里把图像切成带重叠边（halo）的小块并行做模糊和 Canny。
+# Canny 的滞后阈值会沿边缘跨块传播，所以每块先算出“弱边缘”(梯度 > 阈值1 的非极大值抑制结果)
+# 和“强边缘”(梯度 > 阈值2)，块内求连通域后再把跨越块边界的连通域合并，
+# 保留含强边缘的连通域。拼接结果与整图 Canny 完全一致，线条不会在块边界处断开。
+TILE_SIZE = 1024 # 分块边长（像素）
+TILE_HALO = 8 # 重叠边宽度：5x5 高斯模糊 2px + Sobel 1px + 非极大值抑制 1px，留出余量
+TILED_MIN_PIXELS = 4 * TILE_SIZE * TILE_SIZE # 超过该像素数时才值得分块
+
+def _tile_grid(height, width, tile_size):
+    ys = list(range(0, height, tile_size))
+    xs = list(range(0, width, tile_size))
+    return [[(y0, min(y0 + tile_size, height), x0, min(x0 + tile_size, width)) for x0 in xs] for y0 in ys]
+
+def _canny_tile(image, box, threshold_low, threshold_high, blur, halo):
+    # 第一阶段：块内模糊、Canny 与弱边缘连通域
+    t0 = time.perf_counter()
+    y0, y1, x0, x1 = box
+    height, width = image.shape[:2]
+    hy0, hy1 = max(0, y0 - halo), min(height, y1 + halo)
+    hx0, hx1 = max(0, x0 - halo), min(width, x1 + halo)
+    crop = image[hy0:hy1, hx0:hx1]
+    if blur:
+        crop = cv2.GaussianBlur(crop, (5, 5), 0)
+    inner = (slice(y0 - hy0, y1 - hy0), slice(x0 - hx0, x1 - hx0))
+    weak = np.ascontiguousarray(cv2.Canny(crop, threshold_low, threshold_low)[inner])
+    strong = cv2.Canny(crop, threshold_high, threshold_high)[inner]
+    count, labels = cv2.connectedComponents(weak, connectivity=8)
+    has_strong = np.zeros(count, dtype=bool)
+    has_strong[labels[strong > 0]] = True
+    has_strong[0] = False # 0 为背景
+    return labels, count, has_strong, time.perf_counter() - t0
+
+def _border_pairs(a, b):
+    # 两块相邻边上的标签（a、b 为一维数组，按位置对齐），返回 8 邻域相连的标签对
+    pairs = []
+    for shift in (-1, 0, 1):
+        if shift < 0:
+            u, v = a[1:], b[:-1]
+        elif shift > 0:
+            u, v = a[:-1], b[1:]
+        else:
+            u, v = a, b
+        mask = (u > 0) & (v > 0)
+        pairs.append(np.stack([u[mask], v[mask]], axis=1))
+    return np.concatenate(pairs)
+
+def _find_root(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def tiled_canny(image, canny_threshold1, canny_threshold2, blur=False, tile_size=TILE_SIZE, workers=None):
+    # 返回 (边缘图, 每块耗时列表)。image 为灰度图；blur=True 时在块内先做 5x5 高斯模糊。
+    # OpenCV 在计算时会释放 GIL，所以线程池就能利用多核，且不需要在进程间复制图像。
+    threshold_low, threshold_high = sorted((canny_threshold1, canny_threshold2))
+    height, width = image.shape[:2]
+    grid = _tile_grid(height, width, tile_size)
+    rows, cols = len(grid), len(grid[0])
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        futures = [[pool.submit(_canny_tile, image, box, threshold_low, threshold_high, blur, TILE_HALO)
+                    for box in row] for row in grid]
+        tiles = [[future.result() for future in row] for row in futures]
+
+        # 每块的局部标签映射到全局编号
+        offsets = np.zeros((rows, cols), dtype=np.int64)
+        total = 0
+        for r in range(rows):
+            for c in range(cols):
+                offsets[r, c] = total
+                total += tiles[r][c][1]
+        has_strong = np.concatenate([tiles[r][c][2] for r in range(rows) for c in range(cols)])
+
+        # 合并跨越块边界的连通域（只需检查边界上的像素）
+        pairs = []
+        for r in range(rows):
+            for c in range(cols):
+                labels = tiles[r][c][0]
+                if c + 1 < cols: # 右侧相邻块
+                    right = tiles[r][c + 1][0]
+                    pairs.append(_border_pairs(labels[:, -1], right[:, 0]) + (offsets[r, c], offsets[r, c + 1]))
+                if r + 1 < rows: # 下方相邻块
+                    below = tiles[r + 1][c][0]
+                    pairs.append(_border_pairs(labels[-1, :], below[0, :]) + (offsets[r, c], offsets[r + 1, c]))
+                    if c + 1 < cols and labels[-1, -1] and tiles[r + 1][c + 1][0][0, 0]: # 右下角对角相邻
+                        pairs.append(np.array([[labels[-1, -1] + offsets[r, c], tiles[r + 1][c + 1][0][0, 0] + offsets[r + 1, c + 1]]]))
+                    if c > 0 and labels[-1, 0] and tiles[r + 1][c - 1][0][0, -1]: # 左下角对角相邻
+                        pairs.append(np.array([[labels[-1, 0] + offsets[r, c], tiles[r + 1][c - 1][0][0, -1] + offsets[r + 1, c - 1]]]))
+        parent = np.arange(total, dtype=np.int64)
+        if pairs:
+            for u, v in np.unique(np.concatenate(pairs), axis=0).tolist():
+                ru, rv = _find_root(parent, u), _find_root(parent, v)
+                if ru != rv:
+                    parent[max(ru, rv)] = min(ru, rv)
+        while True: # 路径压缩，使每个标签直接指向根
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+        strong_root = np.zeros(total, dtype=bool)
+        strong_root[parent[has_strong]] = True
+        keep = strong_root[parent]
+
+        # 第二阶段：按全局结果输出每块的边缘
+        edges = np.empty((height, width), dtype=np.uint8)
+
+        def write_tile(r, c):
+            y0, y1, x0, x1 = grid[r][c]
+            labels, count = tiles[r][c][0], tiles[r][c][1]
+            lut = np.where(keep[offsets[r, c]:offsets[r, c] + count], np.uint8(255), np.uint8(0))
+            edges[y0:y1, x0:x1] = lut[labels]
+
+        list(pool.map(lambda rc: write_tile(*rc), [(r, c) for r in range(rows) for c in range(cols)]))
+
+    timings = [(grid[r][c], tiles[r][c][3]) for r in range(rows) for c in range(cols)]
+    return edges, timings
+
+def report_tile_timings(timings, total_seconds):
+    if not timings:
+        return
+    tile_ms = [seconds * 1000 for _, seconds in timings]
+    print(f"分块线稿: {len(timings)} 块, 总耗时 {total_seconds * 1000:.0f}ms, "
+          f"单块 最短 {min(tile_ms):.0f}ms / 平均 {sum(tile_ms) / len(tile_ms):.0f}ms / 最长 {max(tile_ms):.0f}ms, "
+          f"并行加速约 {sum(tile_ms) / 1000 / total_seconds:.1f}x")
+
+def convert_to_linework(pil_image, canny_threshold1, canny_threshold2, blurred_image=None, tiled=False):
+    # 返回白线黑底的线稿数组。tiled=True 时对足够大的图像使用分块并行处理（单核机器上分块没有收益）
+    if pil_image is None:
+        return None
+    try:
+        use_tiles = tiled and pil_image.width * pil_image.height >= TILED_MIN_PIXELS and (os.cpu_count() or 1) >= 2
+        if use_tiles:
+            t0 = time.perf_counter()
+            source = to_gray_array(pil_image) if blurred_image is None else blurred_image # 没有模糊图时在块内并行模糊
+            canny_edges, timings = tiled_canny(source, canny_threshold1, canny_threshold2, blur=blurred_image is None)
+            report_tile_timings(timings, time.perf_counter() - t0)
+            return canny_edges
+        if blurred_image is None:
+            blurred_image = prepare_linework_source(pil_image)
+        return linework_from_blurred(blurred_image, canny_threshold1, canny_threshold2)
+    except Exception as e:
+        print(f"图像处理失败: {e}")
+        show_message("error", "图像处理错误", f"图像处理失败: {e}")
+        return None
+
+# --- 折线简化 ---
+SIMPLIFY_MODES = {"像素跳跃": "skip", "误差容限": "tolerance"} # 界面名称 -> 内部模式
+
+def simplify_polyline(points, tolerance):
+    # Ramer–Douglas–Peucker 折线简化：保证简化后的折线与原始点的最大偏差不超过 tolerance 像素。
+    # 使用显式栈代替递归，每个区间内的点到线段距离用 NumPy 向量化计算。
+    n = len(points)
+    if n < 3 or tolerance <= 0:
+        return points
+    pts = points.astype(np.float64)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        lo, hi = stack.pop()
+        if hi - lo < 2:
+            continue
+        a, b = pts[lo], pts[hi]
+        seg = pts[lo + 1:hi] - a
+        ab = b - a
+        length_sq = ab @ ab
+        if length_sq > 0:
+            t = np.clip(seg @ ab / length_sq, 0.0, 1.0)
+            seg = seg - t[:, None] * ab # 到线段（而非直线）的距离，闭合轮廓首尾相邻时也成立
+        dist_sq = (seg * seg).sum(axis=1)
+        k = int(np.argmax(dist_sq))
+        if dist_sq[k] > tolerance * tolerance:
+            mid = lo + 1 + k
+            keep[mid] = True
+            stack.append((lo, mid))
+            stack.append((mid, hi))
+    return points[keep]
+
+def simplify_strokes(polylines, mode="skip", pixel_skip=1, tolerance=1.0):
+    # 对每条折线按指定模式简化，返回 (笔画列表, 简化前点数, 简化后点数)。少于两个点的笔画会被丢弃。
+    points_before = 0
+    strokes = []
+    step = max(1, int(pixel_skip))
+    for points in polylines:
+        points_before += len(points)
+        if mode == "tolerance":
+            points = simplify_polyline(points, tolerance)
+        else:
+            points = points[::step]
+        if len(points) >= 2: # 至少需要两个点才能绘制线段
+            strokes.append(points)
+    points_after = sum(len(p) for p in strokes)
+    return strokes, points_before, points_after
+
+# --- 笔画顺序优化 ---
+# 每条笔画是一个 (N, 2) 的点数组。笔画之间的抬笔移动（空走）会产生一次 moveTo
+# 以及 draw_delay 等待，这里通过调整笔画顺序（以及必要时反向绘制）来缩短空走距离。
+def pen_up_distance(strokes, start_point=(0, 0)):
+    # 计算从起点出发、按给定顺序绘制所有笔画时的抬笔移动总距离
+    if not strokes:
+        return 0.0
+    starts = np.array([s[0] for s in strokes], dtype=np.float64)
+    ends = np.array([s[-1] for s in strokes], dtype=np.float64)
+    prev = np.vstack([np.asarray(start_point, dtype=np.float64).reshape(1, 2), ends[:-1]])
+    return float(np.hypot(*(starts - prev).T).sum())
+
+class _EndpointGrid:
+    # 均匀网格空间索引：按所在格子存放笔画端点，用于快速查找最近的端点（支持删除已使用的笔画）。
+    # 端点编号 i < n 为第 i 条笔画的起点，i >= n 为第 i - n 条笔画的终点。
+    def __init__(self, starts, ends, strokes=None):
+        self.n = len(starts)
+        self.points = [tuple(p) for p in starts.tolist()] + [tuple(p) for p in ends.tolist()]
+        if strokes is None:
+            strokes = range(self.n)
+        strokes = list(strokes)
+        ids = np.asarray(strokes, dtype=np.int64)
+        sub = np.vstack([starts[ids], ends[ids]]) if len(ids) else np.zeros((1, 2))
+        self.min_x, self.min_y = sub.min(axis=0)
+        span = np.maximum(sub.max(axis=0) - sub.min(axis=0), 1.0)
+        self.cell = max(1.0, math.sqrt(float(span[0] * span[1]) / max(len(strokes), 1))) # 平均每格约两个端点
+        self.max_ring = int(max(span) / self.cell) + 2
+        self.buckets = {}
+        for stroke in strokes:
+            for i in (stroke, stroke + self.n):
+                self.buckets.setdefault(self._cell_of(*self.points[i]), []).append(i)
+        self.built_count = len(strokes)
+        self.alive = set(strokes)
+
+    def _cell_of(self, x, y):
+        return int((x - self.min_x) // self.cell), int((y - self.min_y) // self.cell)
+
+    def remove(self, stroke):
+        for i in (stroke, stroke + self.n):
+            self.buckets[self._cell_of(*self.points[i])].remove(i)
+        self.alive.discard(stroke)
+
+    def _ring(self, cx, cy, r):
+        if r == 0:
+            yield cx, cy
+            return
+        for dx in range(-r, r + 1):
+            yield cx + dx, cy - r
+            yield cx + dx, cy + r
+        for dy in range(-r + 1, r):
+            yield cx - r, cy + dy
+            yield cx + r, cy + dy
+
+    def _search(self, queries, exclude, k, allow_end=True):
+        # 从各查询点所在格子逐圈向外搜索，直到第 k 近的笔画不可能再被更近的端点取代
+        found = {}
+        cells = [self._cell_of(x, y) for x, y in queries]
+        limit = self.max_ring + max(max(abs(cx), abs(cy)) for cx, cy in cells)
+        buckets, points, n = self.buckets, self.points, self.n
+        for r in range(limit + 1):
+            for (qx, qy), (cx, cy) in zip(queries, cells):
+                for cell in self._ring(cx, cy, r):
+                    for i in buckets.get(cell, ()):
+                        if i >= n and not allow_end:
+                            continue
+                        owner = i - n if i >= n else i
+                        if owner == exclude:
+                            continue
+                        px, py = points[i]
+                        d = (px - qx) ** 2 + (py - qy) ** 2
+                        if d < found.get(owner, (math.inf,))[0]:
+                            found[owner] = (d, i >= n)
+            if len(found) >= k:
+                kth = sorted(v[0] for v in found.values())[k - 1]
+                if kth <= (r * self.cell) ** 2:
+                    break
+        return sorted(found.items(), key=lambda item: item[1][0])[:k]
+
+    def nearest(self, x, y, allow_end=True):
+        # 返回 (笔画索引, 是否从终点开始)
+        best = self._search([(x, y)], -1, 1, allow_end)
+        if not best:
+            return -1, False
+        stroke, (_, at_end) = best[0]
+        return stroke, at_end
+
+    def nearest_within(self, x, y, radius):
+        # 半径 radius 内最近的端点，返回 (笔画索引, 是否为终点)；没有时返回 (-1, False)
+        cx, cy = self._cell_of(x, y)
+        reach = int(radius // self.cell) + 1
+        best, best_d = (-1, False), radius * radius
+        for gx in range(cx - reach, cx + reach + 1):
+            for gy in range(cy - reach, cy + reach + 1):
+                for i in self.buckets.get((gx, gy), ()):
+                    px, py = self.points[i]
+                    d = (px - x) ** 2 + (py - y) ** 2
+                    if d <= best_d:
+                        best, best_d = ((i - self.n, True) if i >= self.n else (i, False)), d
+        return best
+
+    def k_nearest_strokes(self, stroke, k):
+        # 返回端点距离（任一端点到任一端点）最近的 k 条笔画
+        queries = [self.points[stroke], self.points[stroke + self.n]]
+        return [owner for owner, _ in self._search(queries, stroke, k)]
+
+def _iter_greedy_stroke_order(starts, ends, start_point, allow_reverse):
+    # 贪心最近邻：每次选择离当前笔尖最近的笔画端点，逐条产出 (笔画下标, 是否反向)
+    grid = _EndpointGrid(starts, ends)
+    cur_x, cur_y = float(start_point[0]), float(start_point[1])
+    for _ in range(len(starts)):
+        if len(grid.alive) > 64 and len(grid.alive) < grid.built_count // 4:
+            # 剩余端点变稀疏后按剩余笔画重建网格，避免搜索大量空格子
+            grid = _EndpointGrid(starts, ends, grid.alive)
+        idx, flip = grid.nearest(cur_x, cur_y, allow_reverse)
+        grid.remove(idx)
+        yield idx, flip
+        cur_x, cur_y = grid.points[idx] if flip else grid.points[idx + grid.n]
+
+def _greedy_stroke_order(starts, ends, start_point, allow_reverse):
+    order = []
+    flipped = []
+    for idx, flip in _iter_greedy_stroke_order(starts, ends, start_point, allow_reverse):
+        order.append(idx)
+        flipped.append(flip)
+    return order, flipped
+
+def _refine_stroke_order(starts, ends, order, flipped, start_point, allow_reverse, neighbours, time_limit):
+    # 基于近邻表的 2-opt 与 Or-opt 局部优化，超过时间预算即停止
+    S = [tuple(p) for p in starts.tolist()]
+    E = [tuple(p) for p in ends.tolist()]
+    origin = (float(start_point[0]), float(start_point[1]))
+    n = len(order)
+    hypot = math.hypot
+    deadline = time.perf_counter() + time_limit
+
+    def entry(p):
+        o = order[p]
+        return E[o] if flipped[p] else S[o]
+
+    def exit_(p):
+        if p < 0:
+            return origin
+        o = order[p]
+        return S[o] if flipped[p] else E[o]
+
+    def dist(a, b):
+        if a is None or b is None: # 路径末尾之后没有抬笔
+            return 0.0
+        return hypot(a[0] - b[0], a[1] - b[1])
+
+    def try_2opt(i, j):
+        # 反转位置 i..j 的笔画（同时反转每条笔画的方向）
+        a, b = exit_(i - 1), entry(i)
+        c = exit_(j)
+        d = entry(j + 1) if j + 1 < n else None
+        delta = dist(a, c) + dist(b, d) - dist(a, b) - dist(c, d)
+        if delta < -1e-9:
+            order[i:j + 1] = order[i:j + 1][::-1]
+            flipped[i:j + 1] = [not f for f in flipped[i:j + 1][::-1]]
+            for p in range(i, j + 1):
+                pos_of[order[p]] = p
+            return True
+        return False
+
+    def try_or_opt(i, seg_len, p):
+        # 将位置 i 起长度为 seg_len 的笔画段移到位置 p 之后（p 为 -1 表示最前面）
+        last = i + seg_len - 1
+        if last >= n or i <= p <= last or p == i - 1:
+            return False
+        prev_pt = exit_(i - 1)
+        next_pt = entry(last + 1) if last + 1 < n else None
+        s, e = entry(i), exit_(last)
+        removed = dist(prev_pt, s) + dist(e, next_pt) - (dist(prev_pt, next_pt) if next_pt else 0.0)
+        x = exit_(p)
+        y = entry(p + 1) if p + 1 < n else None
+        base = dist(x, y) if y else 0.0
+        add_fwd = dist(x, s) + dist(e, y) - base
+        add_rev = dist(x, e) + dist(s, y) - base if allow_reverse else math.inf
+        add = min(add_fwd, add_rev)
+        if add - removed >= -1e-9:
+            return False
+        seg_order = order[i:last + 1]
+        seg_flip = flipped[i:last + 1]
+        if add_rev < add_fwd:
+            seg_order = seg_order[::-1]
+            seg_flip = [not f for f in seg_flip[::-1]]
+        del order[i:last + 1]
+        del flipped[i:last + 1]
+        insert_at = p + 1 if p < i else p + 1 - seg_len
+        order[insert_at:insert_at] = seg_order
+        flipped[insert_at:insert_at] = seg_flip
+        for q in range(min(i, insert_at), n):
+            pos_of[order[q]] = q
+        return True
+
+    pos_of = [0] * n
+    for p, o in enumerate(order):
+        pos_of[o] = p
+
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for p in range(n):
+            if time.perf_counter() >= deadline:
+                break
+            for nb in neighbours(order[p]):
+                q = pos_of[nb]
+                if allow_reverse:
+                    if q > p + 1 and try_2opt(p + 1, q):
+                        improved = True
+                        break
+                    if q < p - 1 and try_2opt(q, p - 1):
+                        improved = True
+                        break
+                for seg_len in (1, 2, 3):
+                    # 把邻居所在的笔画段挪到当前笔画之后
+                    if try_or_opt(q, seg_len, p):
+                        improved = True
+                        break
+                else:
+                    continue
+                break
+    return order, flipped
+
+def optimize_stroke_order(strokes, start_point=(0, 0), allow_reverse=True, refine=True,
+                          time_limit=2.0, neighbour_count=8):
+    # 返回 (重新排序后的笔画列表, 统计信息)。start_point 为当前笔尖在图像坐标中的位置。
+    before = pen_up_distance(strokes, start_point)
+    stats = {"before": before, "greedy": before, "after": before}
+    if len(strokes) < 2:
+        return list(strokes), stats
+
+    starts = np.array([s[0] for s in strokes], dtype=np.float64)
+    ends = np.array([s[-1] for s in strokes], dtype=np.float64)
+    order, flipped = _greedy_stroke_order(starts, ends, start_point, allow_reverse)
+    ordered = [strokes[o][::-1] if f else strokes[o] for o, f in zip(order, flipped)]
+    stats["greedy"] = pen_up_distance(ordered, start_point)
+
+    if refine:
+        grid = _EndpointGrid(starts, ends)
+        k = min(neighbour_count, len(strokes) - 1)
+        cache = {}
+
+        def neighbours(stroke): # 近邻表按需计算，计算时间同样计入时间预算
+            if stroke not in cache:
+                cache[stroke] = grid.k_nearest_strokes(stroke, k)
+            return cache[stroke]
+
+        order, flipped = _refine_stroke_order(starts, ends, order, flipped, start_point,
+                                              allow_reverse, neighbours, time_limit)
+        ordered = [strokes[o][::-1] if f else strokes[o] for o, f in zip(order, flipped)]
+
+    stats["after"] = pen_up_distance(ordered, start_point)
+    if stats["after"] > before: # 极端情况下保持原顺序
+        stats["after"] = before
+        return list(strokes), stats
+    return ordered, stats
+
+# --- 笔画清理 ---
+# Canny 在照片上会产生大量只有几个像素的杂点，每个都要一次 moveTo/mouseDown/mouseUp 和一次 draw_delay；
+# 断开的线条则被拆成许多短笔画。规划前先去掉杂点，简化后再把端点相距很近的笔画首尾相接。
+def remove_specks(binary_image, min_size):
+    # 去除 8 连通域中外接矩形最长边或像素数小于 min_size 的杂点，返回 (新的二值数组, 去掉的连通域数)。
+    # 不修改传入的数组（线稿可能同时被其他规划线程使用）
+    count, labels, cc_stats, _ = cv2.connectedComponentsWithStats(binary_image, connectivity=8)
+    size = np.maximum(cc_stats[:, cv2.CC_STAT_WIDTH], cc_stats[:, cv2.CC_STAT_HEIGHT])
+    keep = (size >= min_size) & (cc_stats[:, cv2.CC_STAT_AREA] >= min_size)
+    keep[0] = False # 背景
+    lut = np.where(keep, 255, 0).astype(np.uint8)
+    return lut[labels], int(count - 1 - np.count_nonzero(keep))
+
+def join_strokes(strokes, max_gap):
+    # 把端点相距不超过 max_gap 像素的笔画首尾相接（必要时反向），用端点网格查找附近的端点。
+    # 返回 (新笔画列表, 连接次数)；每连接一次就少一条笔画、少一次抬笔
+    if max_gap <= 0 or len(strokes) < 2:
+        return strokes, 0
+    starts = np.array([s[0] for s in strokes], dtype=np.float64)
+    ends = np.array([s[-1] for s in strokes], dtype=np.float64)
+    grid = _EndpointGrid(starts, ends)
+    joined = []
+    joins = 0
+    for first in range(len(strokes)):
+        if first not in grid.alive:
+            continue
+        grid.remove(first)
+        chain = [strokes[first]]
+        for _ in range(2): # 先从终点向后延伸，再把整条链反向后从原来的起点延伸
+            tail = chain[-1][-1]
+            while grid.alive:
+                idx, at_end = grid.nearest_within(float(tail[0]), float(tail[1]), max_gap)
+                if idx < 0:
+                    break
+                grid.remove(idx)
+                piece = strokes[idx][::-1] if at_end else strokes[idx]
+                if (piece[0] == tail).all():
+                    piece = piece[1:] # 端点重合时不重复绘制同一个点
+                chain.append(piece)
+                tail = piece[-1]
+                joins += 1
+            chain = [piece[::-1] for piece in reversed(chain)]
+        joined.append(np.concatenate(chain) if len(chain) > 1 else chain[0])
+    return joined, joins
+
+def describe_cleanup(stats):
+    # 笔画清理结果的简短说明，没有启用清理时返回空字符串
+    if "specks_removed" not in stats:
+        return ""
+    joins = stats["strokes_joined"]
+    return f"去除 {stats['specks_removed']} 处杂点，连接 {joins} 处断线（少 {joins} 次抬笔）"
+
+# --- 笔画计划 ---
+# 线稿生成后立即把轮廓提取、简化和排序的结果编译成 StrokePlan 并缓存，
+# 按 F5（或在不同位置重复绘制）时直接复用，不必再从图像重新计算。
+STROKE_PLAN_CACHE_SIZE = 8 # LRU 缓存中保留的笔画计划数量
+_stroke_plan_cache = OrderedDict()
+_stroke_plan_cache_lock = threading.Lock()
+
+class StrokePlan:
+    # 所有笔画的点依次存放在一个 (M, 2) int32 数组中，第 i 条笔画为 points[offsets[i]:offsets[i + 1]]
+    def __init__(self, points, offsets, width=0, height=0, stats=None):
+        self.points = points
+        self.offsets = offsets
+        self.width = width
+        self.height = height
+        self.stats = stats or {}
+
+    @classmethod
+    def from_strokes(cls, strokes, width=0, height=0, stats=None):
+        lengths = np.fromiter((len(s) for s in strokes), dtype=np.int64, count=len(strokes))
+        offsets = np.zeros(len(strokes) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        if strokes:
+            points = np.ascontiguousarray(np.concatenate(strokes), dtype=np.int32)
+        else:
+            points = np.empty((0, 2), dtype=np.int32)
+        return cls(points, offsets, width, height, stats)
+
+    @property
+    def stroke_count(self):
+        return len(self.offsets) - 1
+
+    @property
+    def point_count(self):
+        return int(self.offsets[-1])
+
+    def __len__(self):
+        return self.stroke_count
+
+    def stroke(self, index): # 返回视图，不复制数据
+        return self.points[self.offsets[index]:self.offsets[index + 1]]
+
+    def __iter__(self):
+        for i in range(self.stroke_count):
+            yield self.stroke(i)
+
+    def pen_up_distance(self, start_point=(0, 0)):
+        if self.stroke_count == 0:
+            return 0.0
+        starts = self.points[self.offsets[:-1]].astype(np.float64)
+        ends = self.points[self.offsets[1:] - 1].astype(np.float64)
+        prev = np.vstack([np.asarray(start_point, dtype=np.float64).reshape(1, 2), ends[:-1]])
+        return float(np.hypot(*(starts - prev).T).sum())
+
+    def stroke_lengths(self):
+        # 每条笔画的折线长度（像素）
+        if self.stroke_count == 0:
+            return np.zeros(0)
+        seg = np.hypot(*np.diff(self.points.astype(np.float64), axis=0).T)
+        seg = np.append(seg, 0.0)
+        seg[self.offsets[1:] - 1] = 0.0 # 不计笔画之间的跳跃
+        # reduceat 遇到空笔画（起点相同或等于点数）会取错值或越界，只对非空笔画求和，空笔画长度为 0
+        nonempty = np.flatnonzero(np.diff(self.offsets) > 0)
+        lengths = np.zeros(self.stroke_count)
+        if len(nonempty):
+            lengths[nonempty] = np.add.reduceat(seg, self.offsets[nonempty])
+        return lengths
+
+    def subset(self, indices):
+        # 按给定顺序取出部分笔画，组成新的计划。彩色分层计划按升序取子集时保留分层（重新计算各层起点），
+        # 打乱顺序后分层不再成立，去掉分层信息
+        indices = list(indices)
+        stats = dict(self.stats, subset_of=self.stroke_count)
+        layers = stats.pop("color_layers", None)
+        if layers and all(a < b for a, b in zip(indices, indices[1:])):
+            kept = np.asarray(indices, dtype=np.int64)
+            stats["color_layers"] = []
+            for layer in layers:
+                start = int(np.searchsorted(kept, layer["start"]))
+                count = int(np.searchsorted(kept, layer["start"] + layer["strokes"])) - start
+                if count:
+                    stats["color_layers"].append(dict(layer, start=start, strokes=count))
+        return StrokePlan.from_strokes([self.stroke(i) for i in indices], self.width, self.height, stats)
+
+    def scaled(self, factor):
+        # 按比例缩放的新计划（坐标四舍五入到整数像素）。缩小后笔画内相邻的重复点被去掉，
+        # 每条笔画至少保留起点，笔画数与顺序不变，彩色分层信息照样有效
+        if factor == 1:
+            return self
+        points = np.round(self.points * float(factor)).astype(np.int32)
+        keep = np.ones(len(points), dtype=bool)
+        if len(points) > 1:
+            keep[1:] = np.any(points[1:] != points[:-1], axis=1)
+        keep[self.offsets[:-1]] = True
+        offsets = np.zeros_like(self.offsets)
+        np.cumsum(np.add.reduceat(keep, self.offsets[:-1]) if self.stroke_count else [], out=offsets[1:])
+        stats = dict(self.stats, scaled_by=float(factor))
+        for key in ("pen_up_before", "pen_up_after"):
+            if key in stats:
+                stats[key] = stats[key] * factor
+        width, height = max(1, round(self.width * factor)), max(1, round(self.height * factor))
+        return StrokePlan(np.ascontiguousarray(points[keep]), offsets, width, height, stats)
+
+    def describe(self):
+        return f"{self.stroke_count} 条笔画 / {self.point_count} 个点"
+
+    def render(self, line_width=1):
+        # 把计划画成白底黑线的 PIL 图像，用于预览实际会画出的内容；彩色分层计划按各层颜色绘制
+        layers = self.stats.get("color_layers")
+        if layers:
+            canvas = np.full((max(self.height, 1), max(self.width, 1), 3), 255, dtype=np.uint8)
+            for layer in layers:
+                strokes = [self.stroke(i).reshape(-1, 1, 2) for i in range(layer["start"], layer["start"] + layer["strokes"])]
+                cv2.polylines(canvas, strokes, False, tuple(layer["color"]), line_width)
+            return Image.fromarray(canvas)
+        canvas = np.full((max(self.height, 1), max(self.width, 1)), 255, dtype=np.uint8)
+        strokes = [stroke.reshape(-1, 1, 2) for stroke in self]
+        if strokes:
+            cv2.polylines(canvas, strokes, False, 0, line_width)
+        return Image.fromarray(canvas)
+
+def image_digest(image):
+    # 计算图像内容的哈希，用作笔画计划缓存的键；数组直接对其内存求哈希，不复制
+    if isinstance(image, np.ndarray):
+        digest = hashlib.blake2b(memoryview(np.ascontiguousarray(image)).cast("B"), digest_size=16)
+        digest.update(f"{image.dtype}{image.shape}".encode())
+        return digest.hexdigest()
+    digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+    digest.update(f"{image.mode}{image.size}".encode())
+    return digest.hexdigest()
+
+def extract_plan_strokes(linework_image, invert=False, simplify_mode="skip", pixel_skip=1, simplify_tolerance=1.0,
+                         trace_mode="contour", hatch_levels=0, hatch_spacing=6, hatch_angle=45, tone_image=None,
+                         speck_size=0, join_gap=0):
+    # 编译笔画计划的前半段：去除杂点 -> 提取轮廓或中心线 -> 简化 -> 连接断线，再加上色调排线（需要 tone_image）。
+    # 返回 (笔画列表, 统计)
+    specks = 0
+    if speck_size > 0:
+        linework_image, specks = remove_specks(linework_to_binary(linework_image, invert), speck_size)
+        invert = False
+    if trace_mode == "centerline":
+        contours = extract_centerline_polylines(linework_image, invert)
+    else:
+        contours = extract_contour_polylines(linework_image, invert)
+    strokes, points_before, points_after = simplify_strokes(contours, simplify_mode, pixel_skip, simplify_tolerance)
+    strokes, joins = join_strokes(strokes, join_gap)
+    if joins:
+        points_after = sum(len(s) for s in strokes)
+    stats = {"contours": len(contours), "points_before": points_before, "points_after": points_after}
+    if speck_size > 0 or join_gap > 0:
+        stats["specks_removed"] = specks
+        stats["strokes_joined"] = joins
+    if hatch_levels > 0 and tone_image is not None:
+        hatches = hatch_strokes(tone_image, hatch_levels, hatch_spacing, hatch_angle)
+        strokes.extend(hatches)
+        stats["hatch_strokes"] = len(hatches)
+        stats["points_before"] += 2 * len(hatches)
+        stats["points_after"] += 2 * len(hatches)
+    return strokes, stats
+
+def compile_stroke_plan(linework_image, invert=False, simplify_mode="skip", pixel_skip=1,
+                        simplify_tolerance=1.0, optimize_order=True, trace_mode="contour",
+                        hatch_levels=0, hatch_spacing=6, hatch_angle=45, tone_image=None, speck_size=0, join_gap=0):
+    # 从线稿图像编译笔画计划：清理 -> 提取轮廓或中心线 -> 简化 -> 排线填充 -> 优化顺序（起点为图像坐标 (0, 0)，即绘制时的鼠标位置）。
+    # hatch_levels > 0 时用 tone_image（与线稿同尺寸的灰度数组）的暗部生成排线；
+    # speck_size > 0 时去除小于该尺寸的杂点，join_gap > 0 时连接端点相距不超过该距离的笔画
+    t0 = time.perf_counter()
+    strokes, stats = extract_plan_strokes(linework_image, invert, simplify_mode, pixel_skip, simplify_tolerance,
+                                          trace_mode, hatch_levels, hatch_spacing, hatch_angle, tone_image,
+                                          speck_size, join_gap)
+    if optimize_order and len(strokes) > 1:
+        strokes, order_stats = optimize_stroke_order(strokes, start_point=(0, 0))
+        stats["pen_up_before"] = order_stats["before"]
+        stats["pen_up_after"] = order_stats["after"]
+    t1 = time.perf_counter()
+    stats["compile_seconds"] = t1 - t0
+    record_stage("planning", t0, t1, strokes=len(strokes), points=stats["points_after"], trace_mode=trace_mode)
+    width, height = linework_size(linework_image)
+    return StrokePlan.from_strokes(strokes, width, height, stats)
+
+def find_cached_stroke_plan(linework_key, plan_settings):
+    # 只查询缓存，未命中时返回 None
+    key = (linework_key, tuple(sorted(plan_settings.items())))
+    with _stroke_plan_cache_lock:
+        plan = _stroke_plan_cache.get(key)
+        if plan is not None:
+            _stroke_plan_cache.move_to_end(key)
+        return plan
+
+def get_stroke_plan(linework_image, linework_key, plan_settings, tone_image=None):
+    # 带 LRU 缓存的 compile_stroke_plan。linework_key 标识线稿来源（截图哈希 + Canny 阈值），
+    # plan_settings 为 compile_stroke_plan 的关键字参数；tone_image 由截图决定，不参与缓存键。
+    if linework_key is None:
+        linework_key = image_digest(linework_image)
+    plan = find_cached_stroke_plan(linework_key, plan_settings)
+    if plan is not None:
+        return plan
+    plan = compile_stroke_plan(linework_image, tone_image=tone_image, **plan_settings)
+    if plan_settings.get("hatch_levels") and tone_image is None:
+        return plan # 缺少灰度图时没有排线，不能以要求排线的参数缓存
+    store_cached_stroke_plan(linework_key, plan_settings, plan)
+    return plan
+
+def store_cached_stroke_plan(linework_key, plan_settings, plan):
+    key = (linework_key, tuple(sorted(plan_settings.items())))
+    with _stroke_plan_cache_lock:
+        _stroke_plan_cache[key] = plan
+        while len(_stroke_plan_cache) > STROKE_PLAN_CACHE_SIZE:
+            _stroke_plan_cache.popitem(last=False)
+
+# --- 笔画计划文件 ---
+# .adplan 文件布局（小端）:
+#   8 字节魔数 | uint32 版本 | uint32 头长度 | JSON 头（补齐到 8 字节）| 各数据段（均按 8 字节对齐）
+# 数据段位置记录在头的 "sections" 中:
+#   offsets: int64 (笔画数 + 1)，第 i 条笔画为第 offsets[i] 到 offsets[i + 1] 个点
+#   starts:  int32 (笔画数, 2)，每条笔画的起点
+#   deltas:  int16 (点数 - 笔画数, 2)，每条笔画其余各点相对前一点的位移；超出 int16 范围时整体改用 int32
+PLAN_FILE_MAGIC = b"ADPLAN\0\0"
+PLAN_FILE_VERSION = 1
+PLAN_FILE_EXTENSION = ".adplan"
+
+def _align8(n):
+    return (n + 7) & ~7
+
+def save_stroke_plan(plan, path, metadata=None):
+    # metadata 保存来源信息（截图哈希、阈值、计划参数等），载入后在 plan.metadata 中
+    lengths = np.diff(plan.offsets)
+    if np.any(lengths == 0): # 空笔画无法用起点 + 位移表示
+        # 经 subset 去掉，彩色分层的起点和笔画数随之重新计算；空笔画没有点，抬笔距离不变
+        plan = plan.subset(np.flatnonzero(lengths).tolist())
+        del plan.stats["subset_of"]
+        for key, value in (("strokes", plan.stroke_count), ("points_after", plan.point_count)):
+            if key in plan.stats:
+                plan.stats[key] = value
+    points = np.asarray(plan.points, dtype=np.int32)
+    offsets = np.asarray(plan.offsets, dtype="<i8")
+    starts = np.ascontiguousarray(points[offsets[:-1]], dtype="<i4")
+    deltas = np.delete(np.diff(points, axis=0), offsets[1:-1] - 1, axis=0) if len(points) else np.empty((0, 2), np.int32)
+    delta_dtype = "<i2" if deltas.size == 0 or np.abs(deltas).max() <= np.iinfo(np.int16).max else "<i4"
+    arrays = {"offsets": offsets, "starts": starts, "deltas": np.ascontiguousarray(deltas, dtype=delta_dtype)}
+
+    header = {
+        "stroke_count": plan.stroke_count, "point_count": plan.point_count,
+        "width": plan.width, "height": plan.height, "delta_dtype": delta_dtype,
+        "stats": plan.stats, "metadata": metadata or {}, "sections": {},
+    }
+    # 头里记录了各段的位置，而位置又取决于头的长度：先预留足够的空间再写
+    header_len = _align8(len(json.dumps(header, ensure_ascii=False).encode("utf-8")) + 256)
+    position = _align8(16 + header_len)
+    for name, array in arrays.items():
+        header["sections"][name] = [position, array.nbytes]
+        position = _align8(position + array.nbytes)
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8").ljust(header_len, b" ")
+
+    with open(path, "wb") as f:
+        f.write(PLAN_FILE_MAGIC)
+        f.write(np.array([PLAN_FILE_VERSION, header_len], dtype="<u4").tobytes())
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(header["sections"][name][0])
+            f.write(array.tobytes())
+    return path
+
+def load_stroke_plan(path):
+    # 只读取头部，数据段以内存映射方式打开，不会把点解码成 Python 列表
+    with open(path, "rb") as f:
+        if f.read(8) != PLAN_FILE_MAGIC:
+            raise ValueError(f"{path} 不是笔画计划文件")
+        version, header_len = np.frombuffer(f.read(8), dtype="<u4")
+        if version > PLAN_FILE_VERSION:
+            raise ValueError(f"不支持的笔画计划文件版本 {version}（当前支持 {PLAN_FILE_VERSION}）")
+        header = json.loads(f.read(int(header_len)).decode("utf-8"))
+    stroke_count, point_count = header["stroke_count"], header["point_count"]
+    shapes = {"offsets": ("<i8", (stroke_count + 1,)), "starts": ("<i4", (stroke_count, 2)),
+              "deltas": (header["delta_dtype"], (point_count - stroke_count, 2))}
+    arrays = {}
+    for name, (dtype, shape) in shapes.items():
+        offset, nbytes = header["sections"][name]
+        if nbytes == 0:
+            arrays[name] = np.zeros(shape, dtype=dtype)
+        else:
+            arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+    return MappedStrokePlan(arrays["starts"], arrays["deltas"], arrays["offsets"], header["width"],
+                            header["height"], header.get("stats"), header.get("metadata"))
+
+class MappedStrokePlan(StrokePlan):
+    # 从 .adplan 文件映射的计划。逐条笔画按需从位移解码；需要整个点数组时才一次性解码
+    def __init__(self, starts, deltas, offsets, width=0, height=0, stats=None, metadata=None):
+        self.starts = starts
+        self.deltas = deltas
+        self.offsets = offsets
+        self.width = width
+        self.height = height
+        self.stats = stats or {}
+        self.metadata = metadata or {}
+        self._points = None
+
+    @property
+    def points(self):
+        if self._points is None:
+            # 把每条笔画起点放进位移序列后整体累加，再减去每条笔画开始处的累计值
+            lengths = np.diff(self.offsets)
+            steps = np.zeros((self.point_count, 2), dtype=np.int64)
+            is_start = np.zeros(self.point_count, dtype=bool)
+            is_start[self.offsets[:-1]] = True
+            steps[~is_start] = self.deltas
+            total = np.cumsum(steps, axis=0)
+            base = np.repeat(total[self.offsets[:-1]] - self.starts, lengths, axis=0)
+            self._points = np.ascontiguousarray(total - base, dtype=np.int32)
+        return self._points
+
+    def stroke(self, index):
+        if self._points is not None:
+            return self._points[self.offsets[index]:self.offsets[index + 1]]
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        stroke = np.empty((end - start, 2), dtype=np.int32)
+        stroke[0] = self.starts[index]
+        np.cumsum(self.deltas[start - index:end - index - 1], axis=0, out=stroke[1:])
+        stroke[1:] += stroke[0]
+        return stroke
+
+# --- 耗时模型与时间预算 ---
+# 预计用时 ≈ 点数 × 每点耗时 + 笔画数 × 每笔耗时 + 抬笔距离 × 每像素耗时 + 笔画间延迟。
+# 系数因机器和输出后端而异，可通过“校准”实测后保存在用户目录中。
+COST_MODEL_PATH = os.path.join(os.path.expanduser("~"), ".auto_drawer", "cost_model.json")
+DEFAULT_COSTS = { # 后端 -> (每点秒数, 每笔秒数, 每像素抬笔秒数)，未校准时使用的粗略值
+    "pyautogui": (0.002, 0.01, 0.0),
+    "xtest": (0.0002, 0.002, 0.0),
+}
+BUDGET_TOLERANCES = (0.5, 1.0, 1.5, 2.0, 3.0, 4.0, 6.0, 8.0) # 按时间预算选择简化容差时依次尝试的值
+BUDGET_HATCH_SPACING_FACTORS = (1.5, 2, 3) # 简化到上限仍超出预算时，依次放大排线间距
+
+class DrawCostModel:
+    def __init__(self, backend="pyautogui", per_point=None, per_stroke=None, per_pen_up_px=None, calibrated=False):
+        defaults = DEFAULT_COSTS.get(backend, (0.0, 0.0, 0.0))
+        self.backend = backend
+        self.per_point = defaults[0] if per_point is None else per_point
+        self.per_stroke = defaults[1] if per_stroke is None else per_stroke
+        self.per_pen_up_px = defaults[2] if per_pen_up_px is None else per_pen_up_px
+        self.calibrated = calibrated
+
+    def estimate(self, point_count, stroke_count, pen_up, draw_delay_ms=0, pause=0.0):
+        # pause 为 pyautogui.PAUSE：每次 dragTo 一次，每条笔画另有 moveTo/mouseDown/mouseUp 三次
+        per_point = self.per_point + (pause if self.backend == "pyautogui" else 0.0)
+        per_stroke = self.per_stroke + (3 * pause if self.backend == "pyautogui" else 0.0) + draw_delay_ms / 1000.0
+        return point_count * per_point + stroke_count * per_stroke + pen_up * self.per_pen_up_px
+
+    def estimate_plan(self, plan, draw_delay_ms=0, pause=0.0):
+        pen_up = plan.stats.get("pen_up_after")
+        if pen_up is None or "subset_of" in plan.stats:
+            pen_up = plan.pen_up_distance()
+        return self.estimate(plan.point_count, plan.stroke_count, pen_up, draw_delay_ms, pause)
+
+    def to_dict(self):
+        return {"backend": self.backend, "per_point": self.per_point, "per_stroke": self.per_stroke,
+                "per_pen_up_px": self.per_pen_up_px, "calibrated": self.calibrated}
+
+def _cost_model_key(backend):
+    return f"{platform.node()}/{backend}"
+
+def load_cost_model(backend):
+    # 读取本机该后端的校准结果，没有时返回默认模型
+    try:
+        with open(COST_MODEL_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f).get(_cost_model_key(backend))
+        if data:
+            return DrawCostModel(backend, data["per_point"], data["per_stroke"], data["per_pen_up_px"], True)
+    except (OSError, ValueError, KeyError):
+        pass
+    return DrawCostModel(backend)
+
+def save_cost_model(model):
+    try:
+        with open(COST_MODEL_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = {}
+    data[_cost_model_key(model.backend)] = model.to_dict()
+    os.makedirs(os.path.dirname(COST_MODEL_PATH), exist_ok=True)
+    with open(COST_MODEL_PATH, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+def calibrate_cost_model(backend, start_x, start_y, size=200, should_continue=None):
+    # 用后端实际绘制几组测试图案（长笔画、密集短笔画、分散短笔画），最小二乘拟合三个系数
+    patterns = []
+    zigzag = np.array([[i % size, (i // size) * 4 + (i % 2)] for i in range(size * 2)], dtype=np.int32)
+    patterns.append([zigzag]) # 点多、笔画少
+    patterns.append([np.array([[x, 20], [x, 24]], dtype=np.int32) for x in range(0, size, 2)]) # 笔画多、抬笔距离短
+    patterns.append([np.array([[(k * 53) % size, 30 + (k * 97) % (size - 30)], [(k * 53) % size + 1, 30 + (k * 97) % (size - 30)]],
+                              dtype=np.int32) for k in range(size // 2)]) # 抬笔距离长
+    rows, times = [], []
+    backend.begin()
+    try:
+        for _ in range(2):
+            for strokes in patterns:
+                t0 = time.perf_counter()
+                execute_strokes(strokes, backend, start_x, start_y, 0, should_continue)
+                times.append(time.perf_counter() - t0)
+                rows.append([sum(len(s) for s in strokes), len(strokes), pen_up_distance(strokes)])
+    finally:
+        backend.end()
+    coef, *_ = np.linalg.lstsq(np.array(rows, dtype=np.float64), np.array(times), rcond=None)
+    coef = np.maximum(coef, 0.0)
+    return DrawCostModel(backend.name, float(coef[0]), float(coef[1]), float(coef[2]), calibrated=True)
+
+def drop_least_significant_strokes(plan, model, budget_seconds, draw_delay_ms=0, pause=0.0):
+    # 按笔画长度从长到短保留，直到预计用时达到预算；保留的笔画仍按原有（已优化的）顺序绘制
+    lengths = plan.stroke_lengths()
+    counts = np.diff(plan.offsets)
+    avg_pen_up = plan.pen_up_distance() / max(plan.stroke_count, 1)
+    cost = np.array([model.estimate(c, 1, avg_pen_up, draw_delay_ms, pause) for c in counts.tolist()])
+    by_importance = np.argsort(-lengths, kind="stable")
+    within = np.cumsum(cost[by_importance]) <= budget_seconds
+    keep = np.sort(by_importance[within])
+    return plan.subset(keep.tolist())
+
+def fit_plan_to_budget(linework_image, linework_key, base_settings, budget_seconds, model, draw_delay_ms=0, pause=0.0,
+                       tone_image=None):
+    # 在预算内尽量保留细节：先压缩笔画间延迟，再逐步增大简化容差，然后加大排线间距，最后丢弃最短的笔画。
+    # 返回 (计划, 笔画间延迟毫秒, 预计秒数, 说明)
+    plan = get_stroke_plan(linework_image, linework_key, base_settings, tone_image)
+    if model.estimate_plan(plan, draw_delay_ms, pause) <= budget_seconds:
+        return plan, draw_delay_ms, model.estimate_plan(plan, draw_delay_ms, pause), "原计划已满足预算"
+    note = "已取消笔画间延迟"
+    if model.estimate_plan(plan, 0, pause) > budget_seconds:
+        fitted = False
+        settings = base_settings
+        start = base_settings.get("simplify_tolerance", 1.0) if base_settings.get("simplify_mode") == "tolerance" else 0.0
+        for tolerance in BUDGET_TOLERANCES:
+            if tolerance <= start:
+                continue
+            settings = dict(base_settings, simplify_mode="tolerance", pixel_skip=1, simplify_tolerance=tolerance)
+            plan = get_stroke_plan(linework_image, linework_key, settings, tone_image)
+            note = f"简化容差 {tolerance:g}px"
+            if model.estimate_plan(plan, 0, pause) <= budget_seconds:
+                fitted = True
+                break
+        if not fitted and settings.get("hatch_levels") and tone_image is not None:
+            simplify_note = note
+            base_spacing = settings.get("hatch_spacing", 6)
+            for factor in BUDGET_HATCH_SPACING_FACTORS:
+                spacing = int(round(base_spacing * factor))
+                plan = get_stroke_plan(linework_image, linework_key, dict(settings, hatch_spacing=spacing), tone_image)
+                note = f"{simplify_note}，排线间距 {spacing}px"
+                if model.estimate_plan(plan, 0, pause) <= budget_seconds:
+                    fitted = True
+                    break
+        if not fitted:
+            before = plan.stroke_count
+            plan = drop_least_significant_strokes(plan, model, budget_seconds, 0, pause)
+            note += f"，丢弃 {before - plan.stroke_count} 条最短笔画"
+    # 剩余时间平均分配为笔画间延迟，但不超过用户设定值
+    slack = budget_seconds - model.estimate_plan(plan, 0, pause)
+    delay = min(draw_delay_ms, max(0.0, slack / max(plan.stroke_count, 1) * 1000.0))
+    return plan, delay, model.estimate_plan(plan, delay, pause), note
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}小时{seconds % 3600 // 60}分{seconds % 60}秒"
+    if seconds >= 60:
+        return f"{seconds // 60}分{seconds % 60}秒"
+    return f"{seconds}秒"
+
+# --- 绘画输出后端 ---
+# drawing_task 只生成笔画，具体如何“画出来”由后端决定：模拟鼠标、记录事件、导出 SVG 或什么都不做。
+# 这样无需真实桌面也能测量和测试整个绘画流程。
+class DrawingBackend:
+    name = "base"
+    draws_on_screen = False # 是否真的在屏幕上画出来（决定能否截图校验）
+
+    def begin(self): # 开始绘画前调用
+        pass
+
+    def end(self): # 绘画结束（包括中断和出错）后调用
+        pass
+
+    def move_to(self, x, y): # 抬笔移动
+        pass
+
+    def mouse_down(self):
+        pass
+
+    def drag_to(self, x, y): # 落笔拖动
+        pass
+
+    def mouse_up(self):
+        pass
+
+    def click(self, x, y): # 单击（例如点击调色板换色）
+        self.move_to(x, y)
+        self.mouse_down()
+        self.mouse_up()
+
+    def set_color(self, color): # 换色宏执行后调用，color 为 (R, G, B)；导出类后端据此记录线条颜色
+        pass
+
+    def wait(self, seconds): # 笔画之间的延迟
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def draw_stroke(self, points, offset_x, offset_y, should_continue):
+        # 绘制一条笔画，返回实际绘制的点数。子类可以重写以批量输出整条笔画。
+        coords = (points + (offset_x, offset_y)).tolist()
+        self.move_to(*coords[0])
+        self.mouse_down()
+        drawn = 1
+        try:
+            for x, y in coords[1:]:
+                if not should_continue(): # 如果在拖动过程中绘画被中断，则抬起鼠标按钮
+                    break
+                self.drag_to(x, y)
+                drawn += 1
+        finally:
+            self.mouse_up()
+        return drawn
+
+    def summary(self): # 绘画结束后显示给用户的附加信息
+        return ""
+
+class PyAutoGUIBackend(DrawingBackend):
+    # 原有行为：通过 pyautogui 模拟真实鼠标
+    name = "pyautogui"
+    draws_on_screen = True
+
+    def __init__(self, pause=0.0, restore_mouse=True):
+        load_input_modules()
+        self.pause = pause
+        self.restore_mouse = restore_mouse
+        self.original_pause = None
+        self.original_mouse_pos = None
+
+    def begin(self):
+        self.original_pause = pyautogui.PAUSE # 存储原始的 PAUSE 值
+        pyautogui.PAUSE = self.pause  # 使用从GUI控件获取的值
+        pyautogui.FAILSAFE = False # 禁用 pyautogui 的 failsafe 功能
+        self.original_mouse_pos = pyautogui.position() # 存储原始鼠标位置
+
+    def end(self):
+        pyautogui.FAILSAFE = True # 重新启用 failsafe
+        if self.original_pause is not None:
+            pyautogui.PAUSE = self.original_pause # 恢复原始的 PAUSE 值
+        if self.restore_mouse and self.original_mouse_pos is not None:
+            pyautogui.moveTo(self.original_mouse_pos[0], self.original_mouse_pos[1], duration=0.1) # 恢复鼠标位置
+
+    def move_to(self, x, y):
+        pyautogui.moveTo(x, y, duration=0)
+
+    def mouse_down(self):
+        pyautogui.mouseDown()
+
+    def drag_to(self, x, y):
+        pyautogui.dragTo(x, y, duration=0)
+
+    def mouse_up(self):
+        pyautogui.mouseUp()
+
+    def click(self, x, y):
+        pyautogui.click(x, y)
+
+class RecordingBackend(DrawingBackend):
+    # 在内存中记录事件列表 (时间戳, 事件类型, x, y)，不移动鼠标
+    name = "record"
+
+    def __init__(self, real_time=False):
+        self.real_time = real_time # 为 False 时不真正等待 draw_delay，便于快速测量
+        self.events = []
+        self.t0 = None
+
+    def _record(self, kind, x=None, y=None):
+        self.events.append((time.perf_counter() - self.t0, kind, x, y))
+
+    def begin(self):
+        self.events = []
+        self.t0 = time.perf_counter()
+
+    def move_to(self, x, y):
+        self._record("move", x, y)
+
+    def mouse_down(self):
+        self._record("down")
+
+    def drag_to(self, x, y):
+        self._record("drag", x, y)
+
+    def mouse_up(self):
+        self._record("up")
+
+    def click(self, x, y):
+        self._record("click", x, y)
+
+    def set_color(self, color):
+        self._record("color", tuple(color))
+
+    def wait(self, seconds):
+        self._record("wait", seconds)
+        if self.real_time:
+            super().wait(seconds)
+
+    def summary(self):
+        if not self.events:
+            return "未记录到事件。"
+        duration = self.events[-1][0]
+        drags = sum(1 for e in self.events if e[1] == "drag")
+        return f"记录了 {len(self.events)} 个事件 ({drags} 次拖动)，用时 {duration:.3f} 秒。"
+
+class SVGBackend(DrawingBackend):
+    # 把每条笔画导出为 SVG 折线，可交给其他软件使用
+    name = "svg"
+
+    def __init__(self, path="auto_drawer_output.svg", stroke_width=1):
+        self.path = path
+        self.stroke_width = stroke_width
+        self.polylines = []
+        self.colors = [] # 每条折线的颜色，彩色分层绘制时由 set_color 设置
+        self._color = "black"
+        self._current = None
+
+    def begin(self):
+        self.polylines = []
+        self.colors = []
+        self._color = "black"
+        self._current = None
+
+    def set_color(self, color):
+        self._color = "#%02x%02x%02x" % tuple(color)
+
+    def move_to(self, x, y):
+        self._current = [(x, y)]
+
+    def mouse_down(self):
+        if self._current is None:
+            self._current = []
+
+    def drag_to(self, x, y):
+        self._current.append((x, y))
+
+    def mouse_up(self):
+        if self._current and len(self._current) >= 2:
+            self.polylines.append(self._current)
+            self.colors.append(self._color)
+        self._current = None
+
+    def wait(self, seconds):
+        pass
+
+    def end(self):
+        if not self.polylines:
+            return
+        xs = [x for line in self.polylines for x, _ in line]
+        ys = [y for line in self.polylines for _, y in line]
+        min_x, min_y = min(xs), min(ys)
+        width, height = max(xs) - min_x + 1, max(ys) - min_y + 1
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+                    f'viewBox="{min_x} {min_y} {width} {height}">\n')
+            f.write(f'<g fill="none" stroke="black" stroke-width="{self.stroke_width}" '
+                    f'stroke-linecap="round" stroke-linejoin="round">\n')
+            for line, color in zip(self.polylines, self.colors):
+                points = " ".join(f"{x},{y}" for x, y in line)
+                stroke = f' stroke="{color}"' if color != "black" else ""
+                f.write(f'<polyline{stroke} points="{points}"/>\n')
+            f.write("</g>\n</svg>\n")
+        print(f"已导出 SVG: {os.path.abspath(self.path)}")
+
+    def summary(self):
+        return f"已导出 {len(self.polylines)} 条折线到 {os.path.abspath(self.path)}。"
+
+class NullBackend(DrawingBackend):
+    # 空输出：丢弃所有事件，用于测量规划本身的耗时
+    name = "null"
+
+    def wait(self, seconds):
+        pass
+
+    def draw_stroke(self, points, offset_x, offset_y, should_continue):
+        return len(points)
+
+class XTestBackend(DrawingBackend):
+    # Linux 下的高速注入：通过 python-xlib 的 XTest 扩展直接生成鼠标事件，
+    # 整条笔画的事件先写入缓冲区，每 batch_size 个事件刷新一次，避免 pyautogui 每次调用的开销和 PAUSE。
+    name = "xtest"
+    draws_on_screen = True
+
+    def __init__(self, max_events_per_second=5000, batch_size=64, display_name=None, restore_mouse=True):
+        self.max_events_per_second = max_events_per_second # 事件速率上限，<= 0 表示不限速
+        self.batch_size = max(1, int(batch_size))
+        self.display_name = display_name
+        self.restore_mouse = restore_mouse
+        self.display = None
+        self.original_mouse_pos = None
+        self.events_sent = 0
+        self._pending = 0
+        self._t0 = None
+        self._allowed_at = None # 节流用的虚拟时钟：已发送的事件按速率上限“应当”发完的时刻
+
+    @classmethod
+    def is_available(cls, display_name=None):
+        if not sys.platform.startswith("linux"):
+            return False
+        try:
+            from Xlib import display as xdisplay
+            d = xdisplay.Display(display_name)
+            try:
+                return d.has_extension("XTEST")
+            finally:
+                d.close()
+        except Exception:
+            return False
+
+    def begin(self):
+        from Xlib import X, display as xdisplay
+        from Xlib.ext import xtest
+        self._X = X
+        self._xtest = xtest
+        self.display = xdisplay.Display(self.display_name)
+        if not self.display.has_extension("XTEST"):
+            raise RuntimeError("X 服务器不支持 XTEST 扩展")
+        pointer = self.display.screen().root.query_pointer()
+        self.original_mouse_pos = (pointer.root_x, pointer.root_y) # 存储原始鼠标位置
+        self.events_sent = 0
+        self._pending = 0
+        self._t0 = time.perf_counter()
+        self._allowed_at = self._t0
+
+    def end(self):
+        if self.display is None:
+            return
+        try:
+            self._fake(self._X.ButtonRelease, 1) # 确保不会留下按下的鼠标键
+            if self.restore_mouse and self.original_mouse_pos is not None:
+                self._fake(self._X.MotionNotify, x=self.original_mouse_pos[0], y=self.original_mouse_pos[1])
+            self._flush()
+        finally:
+            self.display.close()
+            self.display = None
+
+    def _fake(self, event_type, detail=0, x=0, y=0):
+        self._xtest.fake_input(self.display, event_type, detail, x=int(x), y=int(y))
+        self.events_sent += 1
+        self._pending += 1
+
+    def _flush(self):
+        self.display.sync()
+        sent, self._pending = self._pending, 0
+        if self.max_events_per_second > 0:
+            # 令牌桶节流：空闲时间（笔画间延迟、换色、校验截图等）最多积攒一批事件的额度，
+            # 之后仍按速率上限发送，而不是把之前的空闲时间换成一长串全速事件
+            now = time.perf_counter()
+            burst = self.batch_size / self.max_events_per_second
+            self._allowed_at = max(self._allowed_at, now - burst) + sent / self.max_events_per_second
+            if self._allowed_at > now:
+                time.sleep(self._allowed_at - now)
+
+    def move_to(self, x, y):
+        self._fake(self._X.MotionNotify, x=x, y=y)
+        self._flush()
+
+    def mouse_down(self):
+        self._fake(self._X.ButtonPress, 1)
+        self._flush()
+
+    def drag_to(self, x, y):
+        self._fake(self._X.MotionNotify, x=x, y=y)
+        self._flush()
+
+    def mouse_up(self):
+        self._fake(self._X.ButtonRelease, 1)
+        self._flush()
+
+    def draw_stroke(self, points, offset_x, offset_y, should_continue):
+        X = self._X
+        coords = (points + (offset_x, offset_y)).tolist()
+        self._fake(X.MotionNotify, x=coords[0][0], y=coords[0][1])
+        self._fake(X.ButtonPress, 1)
+        self._flush() # 落笔前先让目标程序收到按下事件
+        drawn = 1
+        try:
+            for x, y in coords[1:]:
+                if self._pending == 0 and not should_continue(): # 每批检查一次是否需要停止
+                    break
+                self._fake(X.MotionNotify, x=x, y=y)
+                drawn += 1
+                if self._pending >= self.batch_size:
+                    self._flush()
+        finally:
+            self._fake(X.ButtonRelease, 1)
+            self._flush()
+        return drawn
+
+    def summary(self):
+        elapsed = time.perf_counter() - self._t0 if self._t0 else 0
+        rate = self.events_sent / elapsed if elapsed > 0 else 0
+        return f"XTest 共发送 {self.events_sent} 个事件，平均 {rate:.0f} 事件/秒。"
+
+DRAWING_BACKENDS = {
+    "pyautogui": PyAutoGUIBackend,
+    "record": RecordingBackend,
+    "svg": SVGBackend,
+    "null": NullBackend,
+    "xtest": XTestBackend,
+}
+
+BACKEND_DISPLAY_NAMES = { # 界面名称 -> 后端名称
+    "鼠标模拟": "pyautogui",
+    "高速注入 (XTest)": "xtest",
+    "记录事件": "record",
+    "导出 SVG": "svg",
+    "空输出 (测试)": "null",
+}
+
+def create_drawing_backend(name, **options):
+    if name not in DRAWING_BACKENDS:
+        raise ValueError(f"未知的绘画后端: {name}")
+    if name == "xtest":
+        pause = options.pop("pause", 0.0) # 只在回退到 pyautogui 时使用
+        if not XTestBackend.is_available(options.get("display_name")):
+            # 非 Linux/X11 或缺少 python-xlib 时回退到 pyautogui
+            print("XTest 不可用（需要 Linux X11 和 python-xlib），回退到 pyautogui。")
+            return PyAutoGUIBackend(pause=pause)
+    return DRAWING_BACKENDS[name](**options)
+
+# --- 中心线（骨架）提取 ---
+# 轮廓模式把每条 1-2px 宽的细线当作一个细长区域，沿其边界绕一圈（去一遍、回一遍）。
+# 中心线模式先把线稿细化为 1px 骨架，再把骨架像素当作图来追踪，每段线只画一次。
+TRACE_MODES = {"轮廓": "contour", "中心线": "centerline"} # 界面名称 -> 内部模式
+
+# 8 邻域方向 (dy, dx)，按位编号；反方向为 (bit + 4) % 8
+_NEIGHBOUR_DIRS = [(-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)]
+
+def thin_binary_image(binary_image):
+    # Zhang-Suen 细化，NumPy 向量化实现；有 opencv-contrib 时直接使用 cv2.ximgproc.thinning
+    if hasattr(cv2, "ximgproc"):
+        return cv2.ximgproc.thinning(binary_image)
+    img = np.pad((binary_image > 0).astype(np.uint8), 1)
+    while True:
+        changed = False
+        for step in (0, 1):
+            p2, p3, p4 = img[:-2, 1:-1], img[:-2, 2:], img[1:-1, 2:]
+            p5, p6, p7 = img[2:, 2:], img[2:, 1:-1], img[2:, :-2]
+            p8, p9 = img[1:-1, :-2], img[:-2, :-2]
+            ring = [p2, p3, p4, p5, p6, p7, p8, p9, p2]
+            neighbours = p2 + p3 + p4 + p5 + p6 + p7 + p8 + p9
+            transitions = sum(((ring[i] == 0) & (ring[i + 1] == 1)).astype(np.uint8) for i in range(8))
+            if step == 0:
+                cond = (p2 * p4 * p6 == 0) & (p4 * p6 * p8 == 0)
+            else:
+                cond = (p2 * p4 * p8 == 0) & (p2 * p6 * p8 == 0)
+            remove = (img[1:-1, 1:-1] == 1) & (neighbours >= 2) & (neighbours <= 6) & (transitions == 1) & cond
+            if remove.any():
+                img[1:-1, 1:-1][remove] = 0
+                changed = True
+        if not changed:
+            break
+    return img[1:-1, 1:-1] * np.uint8(255)
+
+def _compress_straight_runs(points):
+    # 去掉方向不变的中间点（等价于 CHAIN_APPROX_SIMPLE），保证与轮廓模式的点数可比
+    if len(points) < 3:
+        return points
+    steps = np.diff(points, axis=0)
+    turn = np.any(steps[1:] != steps[:-1], axis=1)
+    keep = np.concatenate([[True], turn, [True]])
+    return points[keep]
+
+def extract_centerline_polylines(image_to_draw, is_inverted):
+    # 从线稿图像中提取骨架折线，骨架上的每条边恰好被覆盖一次，返回 (N, 2) 点数组列表
+    skeleton = thin_binary_image(linework_to_binary(image_to_draw, is_inverted)) > 0
+    padded = np.pad(skeleton, 1)
+    height, width = padded.shape
+    core = padded[1:-1, 1:-1]
+
+    # 邻接关系：对角相邻只在两者没有共同的上下左右邻居时才算，避免阶梯处形成三角形小环
+    def shifted(dy, dx):
+        return padded[1 + dy:height - 1 + dy, 1 + dx:width - 1 + dx]
+    adjacency = np.zeros(core.shape, dtype=np.uint8)
+    for bit, (dy, dx) in enumerate(_NEIGHBOUR_DIRS):
+        linked = core & shifted(dy, dx)
+        if dy and dx:
+            linked &= ~shifted(dy, 0) & ~shifted(0, dx)
+        adjacency |= linked.astype(np.uint8) << bit
+
+    ys, xs = np.nonzero(core)
+    flat = ((ys + 1) * width + (xs + 1)).tolist()
+    links = dict(zip(flat, adjacency[ys, xs].tolist())) # 像素 -> 尚未走过的邻接方向位掩码
+    degree = {p: bin(m).count("1") for p, m in links.items()}
+    offsets = [dy * width + dx for dy, dx in _NEIGHBOUR_DIRS]
+
+    def take_edge(p):
+        # 取出 p 的一条未走过的边并把两端都标记为已走过，返回另一端像素
+        mask = links[p]
+        bit = (mask & -mask).bit_length() - 1
+        q = p + offsets[bit]
+        links[p] = mask & ~(1 << bit)
+        links[q] &= ~(1 << ((bit + 4) % 8))
+        return q
+
+    paths = []
+
+    def walk(start):
+        path = [start]
+        cur = take_edge(start)
+        path.append(cur)
+        while degree[cur] == 2 and links[cur] and cur != start:
+            cur = take_edge(cur)
+            path.append(cur)
+        paths.append(path)
+
+    # 先从端点出发，再从分叉点出发，最后剩下的都是闭合环
+    for p in [p for p, d in degree.items() if d == 1] + [p for p, d in degree.items() if d >= 3]:
+        while links[p]:
+            walk(p)
+    for p in flat:
+        while links[p]:
+            walk(p)
+
+    polylines = []
+    for path in paths:
+        arr = np.asarray(path, dtype=np.int64)
+        points = np.stack([arr % width - 1, arr // width - 1], axis=1).astype(np.int32)
+        polylines.append(_compress_straight_runs(points))
+    return polylines
+
+# --- 色调排线填充 ---
+# 线稿只有边缘，源图中的暗部会留白。把灰度量化为几个暗度层，每层用平行直线（排线）填充，
+# 越暗的区域叠加的层越多；每条排线只有两个端点，注入开销远小于逐点涂满
+HATCH_ANGLE_STEPS = (0, 90, 45, 135) # 第 k 层相对基准角度的偏转（度），层层交叉
+HATCH_MIN_LENGTH = 3 # 短于该长度（像素）的排线段丢弃
+
+def tone_level_masks(tone_image, levels):
+    # 第 k 层（从 0 开始）为灰度低于 255 * (levels - k) / (levels + 1) 的区域，开运算去掉零散噪点
+    kernel = np.ones((3, 3), np.uint8)
+    masks = []
+    for k in range(levels):
+        threshold = 255 * (levels - k) / (levels + 1)
+        mask = (tone_image < threshold).astype(np.uint8)
+        masks.append(cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel))
+    return masks
+
+def hatch_region(mask, angle, spacing, min_length=HATCH_MIN_LENGTH):
+    # 用与水平方向成 angle 度（逆时针）、间距 spacing 像素的平行线填充 mask 的非零区域，返回两点笔画列表。
+    # 把 mask 旋转到排线水平的方向，每隔 spacing 行取一条扫描线，找出连续落在区域内的片段，
+    # 再把片段端点变换回原图坐标；相邻扫描线方向交替，不优化顺序时也能来回往返
+    height, width = mask.shape
+    rotation = cv2.getRotationMatrix2D((width / 2, height / 2), -angle, 1.0)
+    cos, sin = abs(rotation[0, 0]), abs(rotation[0, 1])
+    out_width = int(math.ceil(width * cos + height * sin))
+    out_height = int(math.ceil(width * sin + height * cos))
+    rotation[0, 2] += out_width / 2 - width / 2
+    rotation[1, 2] += out_height / 2 - height / 2
+    rotated = cv2.warpAffine(mask, rotation, (out_width, out_height), flags=cv2.INTER_NEAREST, borderValue=0)
+
+    first_row = spacing // 2
+    rows = rotated[first_row::spacing] > 0
+    padded = np.zeros((rows.shape[0], rows.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = rows
+    edges = np.diff(padded, axis=1)
+    row_index, run_start = np.nonzero(edges == 1) # 每个片段恰有一个起点和一个终点，按行优先顺序一一对应
+    _, run_end = np.nonzero(edges == -1)
+    keep = run_end - run_start >= min_length
+    row_index, run_start, run_end = row_index[keep], run_start[keep], run_end[keep] - 1
+    if len(row_index) == 0:
+        return []
+    y = (row_index * spacing + first_row).astype(np.float64)
+    reverse = row_index % 2 == 1
+    x0 = np.where(reverse, run_end, run_start).astype(np.float64)
+    x1 = np.where(reverse, run_start, run_end).astype(np.float64)
+    ends = np.stack([np.stack([x0, y], axis=1), np.stack([x1, y], axis=1)], axis=1) # (n, 2, 2)
+    inverse = cv2.invertAffineTransform(rotation)
+    ends = ends @ inverse[:, :2].T + inverse[:, 2]
+    ends = np.clip(np.rint(ends), 0, (width - 1, height - 1)).astype(np.int32)
+    return list(ends)
+
+def hatch_strokes(tone_image, levels, spacing=6, angle=45, min_length=HATCH_MIN_LENGTH):
+    # 色调排线：tone_image 为与线稿同尺寸的灰度数组。spacing 与 angle 可以是单个值，
+    # 也可以是每层一个值的序列；angle 为单个值时各层按 HATCH_ANGLE_STEPS 依次偏转
+    strokes = []
+    for level, mask in enumerate(tone_level_masks(tone_image, levels)):
+        if isinstance(angle, (list, tuple)):
+            level_angle = angle[min(level, len(angle) - 1)]
+        else:
+            level_angle = angle + HATCH_ANGLE_STEPS[level % len(HATCH_ANGLE_STEPS)]
+        level_spacing = spacing[min(level, len(spacing) - 1)] if isinstance(spacing, (list, tuple)) else spacing
+        strokes.extend(hatch_region(mask, level_angle, max(1, int(level_spacing)), min_length))
+    return strokes
+
+# --- 彩色分层 ---
+# 把截图量化为 K 种颜色，每种颜色一层：该层的边界线（可选再加排线填充）单独清理、简化并优化顺序，
+# 各层从暗到亮依次拼接成一个计划。绘制时每层第一笔之前执行一次换色宏（依次点击调色板上的位置），
+# 换色次数等于层数，而不是每条笔画一次。
+COLOR_SAMPLE_SIDE = 256 # k-means 在缩小到该最长边的副本上运行
+COLOR_LUT_BITS = 5 # 全尺寸像素按每通道该位数查表分配到最近的颜色
+COLOR_SKIP_LIGHTNESS = 235 # 亮度不低于该值的颜色层视为纸张底色，不绘制
+COLOR_SWITCH_PAUSE = 0.3 # 每次点击调色板后等待目标软件响应的时间（秒）
+PALETTE_PATH = os.path.join(os.path.expanduser("~"), ".auto_drawer", "palette.json")
+
+def color_lightness(color):
+    r, g, b = (float(c) for c in color)
+    return 0.299 * r + 0.587 * g + 0.114 * b
+
+def quantize_colors(image, k, sample_side=COLOR_SAMPLE_SIDE):
+    # 返回 (每个像素所属颜色的标签数组 uint8, 调色板 (K, 3) RGB uint8)，颜色按亮度从暗到亮排列。
+    # k-means 只在缩小的副本上运行；全尺寸像素按截断后的 RGB 查表分配到最近的颜色，
+    # 查找表只有 2^(3×COLOR_LUT_BITS) 项，不需要计算 H×W×K 的距离
+    rgb = np.asarray(image.convert("RGB")) if isinstance(image, Image.Image) else image
+    height, width = rgb.shape[:2]
+    scale = min(1.0, sample_side / max(height, width))
+    if scale < 1.0:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        sample = cv2.resize(rgb, size, interpolation=cv2.INTER_AREA)
+    else:
+        sample = rgb
+    data = sample.reshape(-1, 3).astype(np.float32)
+    k = max(1, min(int(k), len(data)))
+    cv2.setRNGSeed(0) # 同一张截图每次得到相同的分层
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
+    _, _, centers = cv2.kmeans(data, k, None, criteria, 3, cv2.KMEANS_PP_CENTERS)
+    centers = centers[np.argsort([color_lightness(c) for c in centers], kind="stable")]
+    palette = np.clip(np.round(centers), 0, 255).astype(np.uint8)
+    shift = 8 - COLOR_LUT_BITS
+    levels = (np.arange(1 << COLOR_LUT_BITS, dtype=np.float32) + 0.5) * (1 << shift) # 每个区间的中心值
+    cells = np.stack(np.meshgrid(levels, levels, levels, indexing="ij"), axis=-1).reshape(-1, 1, 3)
+    lut = ((cells - centers) ** 2).sum(axis=2).argmin(axis=1).astype(np.uint8)
+    index = (rgb[:, :, 0] >> shift).astype(np.uint16) << (2 * COLOR_LUT_BITS)
+    index |= (rgb[:, :, 1] >> shift).astype(np.uint16) << COLOR_LUT_BITS
+    index |= rgb[:, :, 2] >> shift
+    return lut[index], palette
+
+def compile_color_plan(image, k, plan_settings, fill=False, skip_lightness=COLOR_SKIP_LIGHTNESS):
+    # 编译彩色分层计划。每层的笔画与主计划一样经过清理、简化和顺序优化（plan_settings 相同），
+    # fill=True 时另用排线（间距、角度取 plan_settings）填充该层区域。
+    # stats["color_layers"] 按绘制顺序记录每层的起始笔画、笔画数、颜色和调色板槽位（从暗到亮的序号）
+    t0 = time.perf_counter()
+    labels, palette = quantize_colors(image, k)
+    brighter = cv2.dilate(labels, np.ones((3, 3), np.uint8)) # 3x3 邻域内最亮的层
+    settings = dict(plan_settings, hatch_levels=1 if fill else 0)
+    strokes = []
+    layers = []
+    stats = {"contours": 0, "points_before": 0, "points_after": 0}
+    for index, color in enumerate(palette):
+        if color_lightness(color) >= skip_lightness:
+            continue
+        mask = labels == index
+        if not mask.any():
+            continue
+        # 只有与更亮的层相邻的像素算作边界，两种颜色之间的分界线只由较暗的一层画一次
+        edges = np.where(mask & (brighter > index), 255, 0).astype(np.uint8)
+        tone = np.where(mask, 0, 255).astype(np.uint8) if fill else None
+        layer_plan = compile_stroke_plan(edges, tone_image=tone, **settings)
+        if layer_plan.stroke_count == 0:
+            continue
+        layers.append({"start": len(strokes), "strokes": layer_plan.stroke_count,
+                       "color": [int(c) for c in color], "palette_slot": index})
+        strokes.extend(layer_plan)
+        for key in ("contours", "points_before", "points_after", "specks_removed", "strokes_joined"):
+            if key in layer_plan.stats:
+                stats[key] = stats.get(key, 0) + layer_plan.stats[key]
+    stats["color_layers"] = layers
+    stats["compile_seconds"] = time.perf_counter() - t0
+    height, width = labels.shape
+    return StrokePlan.from_strokes(strokes, width, height, stats)
+
+def get_color_plan(image, image_hash, k, fill, plan_settings):
+    # 带缓存的 compile_color_plan，与普通笔画计划共用同一个 LRU 缓存
+    key = (image_hash, "color", int(k), bool(fill))
+    plan = find_cached_stroke_plan(key, plan_settings)
+    if plan is None:
+        plan = compile_color_plan(image, k, plan_settings, fill)
+        store_cached_stroke_plan(key, plan_settings, plan)
+    return plan
+
+def parse_palette_macro(text):
+    # "x,y" 或 "x,y; x,y"（依次点击，例如先打开颜色面板再点颜色）-> [(x, y), ...]；空文本表示不换色
+    clicks = []
+    for part in text.replace("；", ";").split(";"):
+        part = part.strip()
+        if not part:
+            continue
+        x, y = part.replace("，", ",").split(",")
+        clicks.append((int(x), int(y)))
+    return clicks
+
+def format_palette_macro(clicks):
+    return "; ".join(f"{x},{y}" for x, y in clicks)
+
+def load_palette_macros():
+    # 每个调色板槽位（从暗到亮的颜色序号）一个换色宏
+    try:
+        with open(PALETTE_PATH, "r", encoding="utf-8") as f:
+            return [[(int(x), int(y)) for x, y in macro] for macro in json.load(f).get("macros", [])]
+    except (OSError, ValueError, TypeError):
+        return []
+
+def save_palette_macros(macros):
+    os.makedirs(os.path.dirname(PALETTE_PATH), exist_ok=True)
+    with open(PALETTE_PATH, "w", encoding="utf-8") as f:
+        json.dump({"macros": [[list(p) for p in macro] for macro in macros]}, f, ensure_ascii=False, indent=2)
+
+def palette_macro_for(layer, macros):
+    slot = layer.get("palette_slot", 0)
+    return macros[slot] if slot < len(macros) else []
+
+def color_switch_seconds(layers, macros, pause=COLOR_SWITCH_PAUSE):
+    # 换色宏的预计耗时：每次点击后等待 pause 秒
+    return sum(len(palette_macro_for(layer, macros)) for layer in layers) * pause
+
+def describe_color_layers(layers, macros):
+    text = f"彩色分层: {len(layers)} 层，换色 {len(layers)} 次。"
+    missing = [layer["palette_slot"] + 1 for layer in layers if not palette_macro_for(layer, macros)]
+    if missing:
+        text += f"\n第 {', '.join(map(str, missing))} 种颜色未设置调色板位置，这些层不会点击换色。"
+    return text
+
+class ColorSwitcher:
+    # 绘制彩色分层计划时，在每层第一条笔画之前执行该层的换色宏；从中间续画时先切换到当前层的颜色
+    def __init__(self, layers, macros=None, pause=COLOR_SWITCH_PAUSE):
+        self.layers = layers
+        self.starts = [layer["start"] for layer in layers]
+        self.macros = macros or []
+        self.pause = pause
+        self.current = None
+        self.switches = 0
+        self.seconds = 0.0
+
+    def before_stroke(self, backend, index):
+        layer_index = bisect.bisect_right(self.starts, index) - 1
+        if layer_index < 0 or layer_index == self.current:
+            return
+        self.current = layer_index
+        layer = self.layers[layer_index]
+        t0 = time.perf_counter()
+        for x, y in palette_macro_for(layer, self.macros):
+            backend.click(x, y)
+            backend.wait(self.pause)
+        backend.set_color(layer["color"])
+        self.switches += 1
+        self.seconds += time.perf_counter() - t0
+
+# --- 绘制结果校验 ---
+VERIFY_MARGIN = 16 # 截图区域四周多截的像素，用于对齐时容纳目标软件的偏移
+VERIFY_SETTLE_SECONDS = 0.5 # 绘制结束后等待目标软件处理完积压事件再截图
+VERIFY_DIFF_THRESHOLD = 40 # 前后截图灰度差超过该值视为画上了墨迹
+VERIFY_INK_RADIUS = 2 # 墨迹膨胀半径（像素），容忍笔刷粗细与抗锯齿造成的偏差
+VERIFY_MAX_PASSES = 2 # 最多补画几轮
+
+def capture_verify_region(plan, start_x, start_y, margin=VERIFY_MARGIN):
+    # 截取计划所在的屏幕区域（四周各多 margin 像素），返回新的灰度 numpy 数组
+    bbox = (start_x - margin, start_y - margin, start_x + plan.width + margin, start_y + plan.height + margin)
+    return get_capture_backend().grab_gray(bbox)
+
+def ink_mask(before, after):
+    # 绘制前后两张截图的差异即为新画上的墨迹，与画布原有内容和颜色无关
+    diff = cv2.absdiff(before, after)
+    mask = (diff > VERIFY_DIFF_THRESHOLD).astype(np.uint8)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * VERIFY_INK_RADIUS + 1, 2 * VERIFY_INK_RADIUS + 1))
+    return cv2.dilate(mask, kernel)
+
+def align_to_plan(plan, mask, margin=VERIFY_MARGIN):
+    # 用相位相关估计目标软件画出的线条相对计划的平移 (dx, dy)，超出 margin 或相关性太弱时视为没有偏移
+    expected = np.zeros(mask.shape, dtype=np.float32)
+    strokes = [(stroke + margin).reshape(-1, 1, 2) for stroke in plan]
+    if not strokes or not mask.any():
+        return 0, 0
+    cv2.polylines(expected, strokes, False, 1.0, 1)
+    a = cv2.GaussianBlur(expected, (0, 0), 2)
+    b = cv2.GaussianBlur(mask.astype(np.float32), (0, 0), 2)
+    (dx, dy), response = cv2.phaseCorrelate(a, b)
+    if response < 0.05 or abs(dx) > margin or abs(dy) > margin:
+        return 0, 0
+    return int(round(dx)), int(round(dy))
+
+def find_missing_segments(plan, mask, shift=(0, 0), margin=VERIFY_MARGIN):
+    # 检查每条笔画的各个点以及相邻两点的中点是否落在墨迹上，把连续缺失的部分（两端各多带一个点）作为需要补画的笔画
+    nonempty = np.flatnonzero(np.diff(plan.offsets) > 0) # 空笔画没有需要补画的点
+    if len(nonempty) == 0:
+        return []
+    starts = plan.offsets[nonempty]
+    points = np.asarray(plan.points, dtype=np.int64)
+    height, width = mask.shape
+    def inked(xy):
+        x = np.clip(xy[:, 0] + margin + shift[0], 0, width - 1)
+        y = np.clip(xy[:, 1] + margin + shift[1], 0, height - 1)
+        return mask[y, x] > 0
+    covered = inked(points)
+    # 点 i 与前一点之间的线段中点；每条笔画的第一个点没有前一点
+    midpoints = (points[1:] + points[:-1]) // 2
+    segment_ok = np.ones(len(points), dtype=bool)
+    segment_ok[1:] = inked(midpoints)
+    segment_ok[starts] = True
+    covered &= segment_ok
+
+    missing = []
+    for i in nonempty[~np.logical_and.reduceat(covered, starts)]: # 只看有缺失的笔画
+        stroke_covered = covered[plan.offsets[i]:plan.offsets[i + 1]]
+        stroke = plan.stroke(i)
+        # 找出连续缺失的区间 [start, end)
+        flags = np.concatenate(([False], ~stroke_covered, [False])).astype(np.int8)
+        edges = np.flatnonzero(np.diff(flags))
+        for start, end in zip(edges[::2], edges[1::2]):
+            segment = stroke[max(start - 1, 0):min(end + 1, len(stroke))]
+            if len(segment) >= 2 or len(stroke) == 1:
+                missing.append(np.ascontiguousarray(segment))
+    return missing
+
+def verify_and_redraw(plan, backend, start_x, start_y, before, draw_delay=0, should_continue=None,
+                      max_passes=VERIFY_MAX_PASSES):
+    # 截图比对并补画缺失的部分，返回每轮的统计 [{"shift", "segments", "points"}]
+    if should_continue is None:
+        should_continue = lambda: True
+    passes = []
+    for _ in range(max_passes):
+        if not should_continue():
+            break
+        time.sleep(VERIFY_SETTLE_SECONDS)
+        mask = ink_mask(before, capture_verify_region(plan, start_x, start_y))
+        shift = align_to_plan(plan, mask)
+        missing = find_missing_segments(plan, mask, shift)
+        info = {"shift": shift, "segments": len(missing), "points": int(sum(len(m) for m in missing))}
+        passes.append(info)
+        print(f"校验: 偏移 {shift}，发现 {info['segments']} 段缺失（{info['points']} 个点）。")
+        if not missing:
+            break
+        if len(missing) > 1:
+            missing, _ = optimize_stroke_order(missing, refine=False)
+        execute_strokes(missing, backend, start_x + shift[0], start_y + shift[1], draw_delay, should_continue)
+    return passes
+
+# --- 实时跟随模式 ---
+MIRROR_TILE_SIZE = 64 # 变化检测与局部 Canny 的块大小（像素）
+MIRROR_TILE_HALO = 8 # 块四周多取的像素，保证模糊和梯度在块边界正确
+MIRROR_INTERVAL = 0.5 # 两次截图之间的最短间隔（秒）
+MIRROR_CHANGE_THRESHOLD = 12 # 灰度变化超过该值的像素所在的块视为有变化
+MIRROR_MIN_POINTS = 4 # 少于该点数的新笔画视为噪声，暂不绘制
+MIRROR_DRAWN_WIDTH = 3 # 记录“已画”时线条的宽度，容忍前后帧边缘 1 像素的抖动
+
+class MirrorSession:
+    # 实时跟随：反复截取源区域，只在有变化的块内重新做 Canny，把还没画过的新边缘编成笔画计划。
+    # 源区域中被擦掉的线条无法从画布上擦除，只会停止再画。
+    def __init__(self, bbox, threshold1, threshold2, plan_settings, capture=None, tile_size=MIRROR_TILE_SIZE):
+        self.bbox = bbox
+        self.width, self.height = bbox[2] - bbox[0], bbox[3] - bbox[1]
+        self.threshold1, self.threshold2 = threshold1, threshold2
+        self.plan_settings = plan_settings
+        self.capture = capture or get_capture_backend()
+        self.tile_size = tile_size
+        self.tiles = _tile_grid(self.height, self.width, tile_size)
+        self._frames = [np.empty((self.height, self.width), dtype=np.uint8) for _ in range(2)] # 轮流使用的截图缓冲区
+        self._current = 0
+        self._has_previous = False
+        self.edges = np.zeros((self.height, self.width), dtype=np.uint8)
+        self.drawn = np.zeros((self.height, self.width), dtype=np.uint8)
+        self.pen = (0, 0) # 上一批笔画结束的位置，下一批从这里开始优化顺序
+        self.frame_count = 0
+        self.stroke_total = 0
+
+    def _dirty_tiles(self, frame, previous):
+        if previous is None:
+            return [box for row in self.tiles for box in row]
+        size = self.tile_size
+        rows, cols = len(self.tiles), len(self.tiles[0])
+        changed = np.zeros((rows * size, cols * size), dtype=bool)
+        changed[:self.height, :self.width] = cv2.absdiff(frame, previous) > MIRROR_CHANGE_THRESHOLD
+        dirty = changed.reshape(rows, size, cols, size).any(axis=(1, 3))
+        return [self.tiles[r][c] for r, c in zip(*np.nonzero(dirty))]
+
+    def _update_edges(self, frame, box):
+        y0, y1, x0, x1 = box
+        halo = MIRROR_TILE_HALO
+        hy0, hy1 = max(0, y0 - halo), min(self.height, y1 + halo)
+        hx0, hx1 = max(0, x0 - halo), min(self.width, x1 + halo)
+        crop = cv2.GaussianBlur(frame[hy0:hy1, hx0:hx1], (5, 5), 0)
+        edges = cv2.Canny(crop, self.threshold1, self.threshold2)
+        self.edges[y0:y1, x0:x1] = edges[y0 - hy0:y1 - hy0, x0 - hx0:x1 - hx0]
+
+    def step(self):
+        # 截图一次，返回本帧需要补画的新笔画 (StrokePlan，坐标相对源区域左上角) 和有变化的块数
+        frame = self.capture.grab_gray(self.bbox, self._frames[self._current])
+        previous = self._frames[1 - self._current] if self._has_previous else None
+        dirty = self._dirty_tiles(frame, previous)
+        self._current, self._has_previous = 1 - self._current, True
+        self.frame_count += 1
+        if not dirty:
+            return StrokePlan.from_strokes([], self.width, self.height), 0
+        for box in dirty:
+            self._update_edges(frame, box)
+
+        # 只在有变化的块的外接矩形内寻找还没画过的边缘
+        y0 = min(b[0] for b in dirty); y1 = max(b[1] for b in dirty)
+        x0 = min(b[2] for b in dirty); x1 = max(b[3] for b in dirty)
+        new_edges = cv2.bitwise_and(self.edges[y0:y1, x0:x1], cv2.bitwise_not(self.drawn[y0:y1, x0:x1]))
+        if not new_edges.any():
+            return StrokePlan.from_strokes([], self.width, self.height), len(dirty)
+        if self.plan_settings.get("trace_mode") == "centerline":
+            polylines = extract_centerline_polylines(new_edges, False)
+        else:
+            contours, _ = cv2.findContours(new_edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+            polylines = [contour.reshape(-1, 2) for contour in contours]
+        polylines = [(line + (x0, y0)).astype(np.int32) for line in polylines if len(line) >= MIRROR_MIN_POINTS]
+        for line in polylines: # 假定交给后端的笔画都会画出来
+            cv2.polylines(self.drawn, [line.reshape(-1, 1, 2)], False, 255, MIRROR_DRAWN_WIDTH)
+        strokes, _, _ = simplify_strokes(polylines, self.plan_settings.get("simplify_mode", "skip"),
+                                         self.plan_settings.get("pixel_skip", 1),
+                                         self.plan_settings.get("simplify_tolerance", 1.0))
+        if len(strokes) > 1 and self.plan_settings.get("optimize_order", True):
+            strokes, _ = optimize_stroke_order(strokes, start_point=self.pen, refine=False)
+        if strokes:
+            self.pen = tuple(int(v) for v in strokes[-1][-1])
+        self.stroke_total += len(strokes)
+        return StrokePlan.from_strokes(strokes, self.width, self.height), len(dirty)
+
+# --- 流式绘制流水线 ---
+# 规划线程（生产者）每排好一批笔画就放入有界队列，绘画线程（消费者）边取边画，不必等整张图规划完；
+# ESC 通过取消令牌通知注入循环，在当前拖动点（XTest 为当前一批事件）之后就抬笔停止
+STREAM_BATCH_STROKES = 32 # 规划线程每次放入队列的笔画数
+STREAM_QUEUE_BATCHES = 8 # 队列容量（批）；注入跟不上时规划线程在此等待，避免无限占用内存
+STREAM_POLL_SECONDS = 0.02 # 等待队列时检查取消的间隔（秒）
+
+class CancellationToken:
+    # 一次绘画的取消令牌。token() 返回是否应继续，可直接作为 should_continue 传给 execute_strokes；
+    # cancel() 可从任意线程调用，并记录取消时刻，用于统计从按下 ESC 到鼠标真正停下的延迟
+    def __init__(self):
+        self._event = threading.Event()
+        self.cancelled_at = None
+        self.reason = ""
+
+    def cancel(self, reason=""):
+        if not self._event.is_set():
+            self.cancelled_at = time.perf_counter()
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def __call__(self):
+        return not self._event.is_set()
+
+    def wait(self, seconds): # 可被取消打断的等待，返回是否已取消
+        return self._event.wait(seconds)
+
+def stop_drawing(reason="ESC"):
+    # 通知当前的绘画（包括实时跟随）停止：取消令牌负责打断注入循环，drawing_active 表示不再占用
+    global drawing_active
+    drawing_active = False
+    if drawing_cancel_token is not None:
+        drawing_cancel_token.cancel(reason)
+
+def drawing_busy():
+    # 是否仍有绘画线程在运行。ESC 后 drawing_active 立即变为 False，但线程要到抬笔、收尾后才退出；
+    # 在此之前不能开始新的绘画，否则两个线程会同时注入鼠标事件，旧线程收尾时还会覆盖新绘画的状态
+    return drawing_active or (drawing_thread is not None and drawing_thread.is_alive())
+
+def iter_stroke_batches(linework_image, invert=False, simplify_mode="skip", pixel_skip=1, simplify_tolerance=1.0,
+                        optimize_order=True, trace_mode="contour", hatch_levels=0, hatch_spacing=6, hatch_angle=45,
+                        tone_image=None, speck_size=0, join_gap=0, stats=None, batch_size=STREAM_BATCH_STROKES):
+    # compile_stroke_plan 的流式版本：提取并简化后，贪心排序每选出 batch_size 条笔画就产出一批。
+    # 局部搜索优化需要完整顺序，流式规划时跳过。stats 在产出第一批之前填好笔画数和点数
+    stats = stats if stats is not None else {}
+    strokes, plan_stats = extract_plan_strokes(linework_image, invert, simplify_mode, pixel_skip, simplify_tolerance,
+                                               trace_mode, hatch_levels, hatch_spacing, hatch_angle, tone_image,
+                                               speck_size, join_gap)
+    stats.update(plan_stats)
+    stats["strokes"] = len(strokes)
+    if not optimize_order or len(strokes) < 2:
+        for i in range(0, len(strokes), batch_size):
+            yield strokes[i:i + batch_size]
+        return
+    stats["pen_up_before"] = pen_up_distance(strokes)
+    starts = np.array([s[0] for s in strokes], dtype=np.float64)
+    ends = np.array([s[-1] for s in strokes], dtype=np.float64)
+    batch = []
+    for idx, flip in _iter_greedy_stroke_order(starts, ends, (0, 0), True):
+        batch.append(strokes[idx][::-1] if flip else strokes[idx])
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class StrokeStream:
+    # 在后台线程运行笔画生成器，按批放入有界队列。iter_strokes() 供绘画线程逐条取用；
+    # result() 等规划结束后返回完整的 StrokePlan（顺序与绘制顺序一致，供断点续画和校验使用）
+    def __init__(self, batches, width=0, height=0, stats=None, max_batches=STREAM_QUEUE_BATCHES):
+        self.width = width
+        self.height = height
+        self.stats = stats if stats is not None else {}
+        self.error = None
+        self.started_at = time.perf_counter()
+        self.first_batch_at = None
+        self.finished_at = None
+        self._batches = batches
+        self._queue = queue.Queue(maxsize=max_batches)
+        self._strokes = []
+        self._ready = threading.Event() # 第一批就绪（或规划结束），此时 stats 中已有总数
+        self._done = threading.Event()
+        self._detached = threading.Event() # 消费者不再取用：之后只完成规划，不再入队
+        self._abandoned = False # 放弃整个计划（例如取消了确认对话框），规划线程尽快退出
+        self._callbacks = [] # 规划结束后在规划线程中调用
+        self._callback_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_linework(cls, linework_image, plan_settings, tone_image=None):
+        stats = {}
+        width, height = linework_size(linework_image)
+        return cls(iter_stroke_batches(linework_image, tone_image=tone_image, stats=stats, **plan_settings),
+                   width, height, stats)
+
+    def _put(self, item):
+        while not self._detached.is_set():
+            try:
+                self._queue.put(item, timeout=STREAM_POLL_SECONDS)
+                return
+            except queue.Full:
+                continue
+
+    def _produce(self):
+        try:
+            for batch in self._batches:
+                if self._abandoned:
+                    return
+                self._strokes.extend(batch)
+                if self.first_batch_at is None:
+                    self.first_batch_at = time.perf_counter()
+                    self._ready.set()
+                self._put(batch)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished_at = time.perf_counter()
+            self.stats["compile_seconds"] = self.finished_at - self.started_at
+            record_stage("planning", self.started_at, self.finished_at, strokes=len(self._strokes), streamed=True)
+            with self._callback_lock:
+                self._done.set()
+                callbacks, self._callbacks = self._callbacks, []
+            self._ready.set()
+            self._put(None) # 结束标记
+            for callback in callbacks:
+                try:
+                    callback(self)
+                except Exception as e:
+                    print(f"规划结束回调出错: {e}")
+
+    def wait_ready(self, should_continue=None):
+        # 等到第一批笔画就绪、规划结束或被取消
+        while not self._ready.wait(STREAM_POLL_SECONDS):
+            if should_continue is not None and not should_continue():
+                return False
+        return True
+
+    def iter_strokes(self, should_continue=None):
+        # 逐条产出已规划的笔画；队列暂时为空时等待规划线程，等待期间同样响应取消
+        while True:
+            try:
+                batch = self._queue.get(timeout=STREAM_POLL_SECONDS)
+            except queue.Empty:
+                if should_continue is not None and not should_continue():
+                    return
+                continue
+            if batch is None:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield from batch
+
+    def detach(self):
+        self._detached.set()
+
+    def add_done_callback(self, callback):
+        # 规划结束后在规划线程中调用 callback(stream)；已经结束时立即在当前线程调用
+        with self._callback_lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def abandoned(self):
+        return self._abandoned
+
+    def abandon(self):
+        self._abandoned = True
+        self._detached.set()
 
-        x1, y1 = min(self.start_x, end_x), min(self.start_y, end_y)
-        x2, y2 = max(self.start_x, end_x), max(self.start_y, end_y)
+    @property
+    def planned_count(self):
+        return len(self._strokes)
 
-        if x2 - x1 > 0 and y2 - y1 > 0: # 确保是有效区域
-            bbox = (x1, y1, x2, y2)
-            # 短暂延迟以确保选择器窗口消失后再截图
-            self.parent.after(100, lambda: self.grab_screen(bbox))
-        else:
-            self.on_complete_callback(None)
+    def describe(self):
+        if self._done.is_set():
+            return f"已规划完成 {len(self._strokes)} 条笔画"
+        return f"正在后台规划（已排好 {len(self._strokes)} 条笔画），确认后边规划边绘制"
 
+    def result(self):
+        # 停止入队并等待规划结束；规划出错时抛出同一异常
+        self.detach()
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        stats = dict(self.stats)
+        if "pen_up_before" in stats:
+            stats["pen_up_after"] = pen_up_distance(self._strokes)
+        return StrokePlan.from_strokes(self._strokes, self.width, self.height, stats)
 
-    def grab_screen(self, bbox):
-        try:
-            img = ImageGrab.grab(bbox=bbox, all_screens=True)
-            self.on_complete_callback(img)
-        except Exception as e:
-            print(f"截图失败: {e}")
-            messagebox.showerror("截图错误", f"截图失败: {e}")
-            self.on_complete_callback(None)
+# --- 自动绘画功能 ---
+def linework_to_binary(image_to_draw, is_inverted):
+    # 把线稿转换为“白色线条、黑色背景”的二值数组。
+    # 线稿数组本身就是 Canny 输出的白线黑底 0/255 图像，直接使用，不复制；PIL 图像按原方式转换
+    if isinstance(image_to_draw, np.ndarray):
+        return cv2.bitwise_not(image_to_draw) if is_inverted else image_to_draw
 
-    def cancel_selection(self, event=None):
-        self.selector_window.destroy()
-        self.on_complete_callback(None)
+    # 将 PIL 图像转换为 OpenCV 格式
+    if image_to_draw.mode == 'L': # 灰度图
+        cv_image = np.array(image_to_draw)
+    elif image_to_draw.mode == '1': # 二值图
+        # findContours 最适合处理 8 位单通道图像。
+        cv_image = np.array(image_to_draw.convert('L'))
+    else: # 其他模式的备用方案，转换为灰度图
+        print(f"警告: 图像模式为 {image_to_draw.mode}, 将尝试转换为灰度图。")
+        cv_image = np.array(image_to_draw.convert('L'))
 
-# --- 图像处理功能 ---
-def convert_to_linework(pil_image, canny_threshold1, canny_threshold2, invert_colors=False):
-    if pil_image is None:
-        return None
-    try:
-        # 将 PIL 图像转换为 OpenCV 格式
-        open_cv_image = np.array(pil_image.convert('RGB'))
-        open_cv_image = cv2.cvtColor(open_cv_image, cv2.COLOR_RGB2BGR)
+    # findContours 期望白色对象在黑色背景上。
+    # 如果用户设置为“反转”（黑线白底），我们需要为 findContours 反转图像。
+    if is_inverted:
+        cv2.bitwise_not(cv_image, dst=cv_image)
 
-        # 灰度化
-        gray_image = cv2.cvtColor(open_cv_image, cv2.COLOR_BGR2GRAY)
+    # 对图像进行阈值处理以确保其为二值图像（对 findContours 很重要）
+    # 如果线条是白色 (255)，背景是黑色 (0)
+    cv2.threshold(cv_image, 127, 255, cv2.THRESH_BINARY, dst=cv_image)
+    return cv_image
 
-        # 高斯模糊
-        blurred_image = cv2.GaussianBlur(gray_image, (5, 5), 0)
+def linework_size(linework_image):
+    # (宽, 高)，线稿可以是数组或 PIL 图像
+    if isinstance(linework_image, np.ndarray):
+        return linework_image.shape[1], linework_image.shape[0]
+    return linework_image.size
 
-        # Canny 边缘检测
-        # 边缘是白色的，背景是黑色的
-        canny_edges = cv2.Canny(blurred_image, canny_threshold1, canny_threshold2)
+def extract_contour_polylines(image_to_draw, is_inverted):
+    # 从线稿图像中提取轮廓，返回 (N, 2) 点数组列表
+    binary_image = linework_to_binary(image_to_draw, is_inverted)
+    contours, hierarchy = cv2.findContours(binary_image, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    return [contour.reshape(-1, 2) for contour in contours] # 轮廓点是 [[x,y]]
 
-        if invert_colors:
-             # 反转颜色：黑线白底
-            canny_edges = cv2.bitwise_not(canny_edges)
+class DrawCheckpoint:
+    # 一次绘画的进度：计划、原始起点，以及下一条要画的笔画和其中已画完的点数。
+    # execute_strokes 边画边更新，中断（ESC 或出错）后可从同一位置继续
+    def __init__(self, plan, start_x, start_y, draw_delay=0, plan_settings=None):
+        self.plan = plan
+        self.start_x = start_x
+        self.start_y = start_y
+        self.draw_delay = draw_delay
+        self.plan_settings = plan_settings or {}
+        self.stroke_index = 0
+        self.point_offset = 0
+        self.reference_image = None # 绘制前截取的画布，用于绘制后校验
 
-        # 转换回 PIL 图像
-        linework_img = Image.fromarray(canny_edges)
-        return linework_img
-    except Exception as e:
-        print(f"图像处理失败: {e}")
-        messagebox.showerror("图像处理错误", f"图像处理失败: {e}")
-        return None
+    @property
+    def finished(self): # 边规划边绘制时，规划结束前 plan 为 None
+        return self.plan is not None and self.stroke_index >= self.plan.stroke_count
 
-# --- 自动绘画功能 ---
-def drawing_task(image_to_draw, start_x, start_y, draw_delay, pixel_skip, pyautogui_pause_val): # 添加新参数 pyautogui_pause_val
-    global drawing_active
-    if image_to_draw is None:
+    def remaining(self):
+        # (剩余笔画数, 剩余点数)
+        if self.finished:
+            return 0, 0
+        done_points = int(self.plan.offsets[self.stroke_index]) + self.point_offset
+        return self.plan.stroke_count - self.stroke_index, self.plan.point_count - done_points
+
+    def describe(self):
+        total = f"/{self.plan.stroke_count}" if self.plan is not None else "" # 边规划边绘制时规划可能尚未结束
+        return (f"第 {self.stroke_index + 1}{total} 条笔画"
+                + (f"的第 {self.point_offset} 个点" if self.point_offset else ""))
+
+def execute_strokes(strokes, backend, start_x, start_y, draw_delay=0, should_continue=None, telemetry=None,
+                    checkpoint=None, color_switcher=None):
+    # 把笔画依次交给后端绘制，返回 (完成的笔画数, 绘制的点数)。不依赖 GUI，可在代码中直接调用。
+    # 传入 telemetry (DrawTelemetry) 时逐笔记录进度；传入 checkpoint (DrawCheckpoint) 时从其位置开始并随时更新；
+    # 传入 color_switcher (ColorSwitcher) 时在彩色分层计划的每层开始前换色
+    if should_continue is None:
+        should_continue = lambda: True
+    # 从头开始时 strokes 可以是任意可迭代对象（例如 StrokeStream.iter_strokes() 边规划边产出的笔画）
+    if checkpoint is not None and (checkpoint.stroke_index or checkpoint.point_offset):
+        get_stroke = strokes.stroke if isinstance(strokes, StrokePlan) else strokes.__getitem__
+        first = checkpoint.stroke_index
+        items = ((index, get_stroke(index)) for index in range(first, len(strokes)))
+    else:
+        first = 0
+        items = enumerate(strokes)
+    strokes_done = 0
+    points_done = 0
+    for index, points in items:
+        if not should_continue():
+            break
+        skip = 0
+        if index == first and checkpoint is not None and checkpoint.point_offset > 0:
+            skip = checkpoint.point_offset - 1 # 从上次画到的最后一个点落笔，续上的线条保持连续
+            points = points[skip:]
+        if color_switcher is not None:
+            color_switcher.before_stroke(backend, index)
+        stroke_start = telemetry.stroke_begin() if telemetry is not None else None
+        drawn = backend.draw_stroke(points, start_x, start_y, should_continue)
+        points_done += drawn
+        if checkpoint is not None:
+            if drawn >= len(points):
+                checkpoint.stroke_index, checkpoint.point_offset = index + 1, 0
+            else:
+                checkpoint.point_offset = skip + drawn
+        if not should_continue(): # 在可能较长的拖动后再次检查
+            break
+        strokes_done += 1
+        if draw_delay > 0:
+            backend.wait(draw_delay / 1000.0) # 将毫秒转换为秒
+        if telemetry is not None:
+            telemetry.stroke_done(drawn, stroke_start)
+    return strokes_done, points_done
+
+def drawing_task(image_to_draw, start_x, start_y, draw_delay, plan_settings, backend=None, plan_key=None, stroke_plan=None,
+                 save_trace=False, checkpoint=None, verify=False, cancel_token=None, palette_macros=None):
+    # checkpoint 不为空时继续之前中断的绘画：使用其中的计划和原始起点，从记录的位置开始。
+    # stroke_plan 可以是 StrokeStream：规划线程仍在工作，已排好的笔画立即开始绘制。
+    # cancel_token (CancellationToken) 由 ESC 取消；未传入时新建一个。
+    # 彩色分层计划按 palette_macros（每个调色板槽位的点击位置列表）在每层开始前换色
+    global drawing_active, drawing_checkpoint, drawing_cancel_token
+    requested_at = time.perf_counter()
+    if cancel_token is None:
+        cancel_token = CancellationToken()
+    drawing_cancel_token = cancel_token
+    if checkpoint is not None:
+        stroke_plan, start_x, start_y = checkpoint.plan, checkpoint.start_x, checkpoint.start_y
+    if image_to_draw is None and stroke_plan is None:
         print("没有线稿图像可供绘制。")
         drawing_active = False
         return
 
-    original_pyautogui_pause = pyautogui.PAUSE # 存储原始的 PAUSE 值
-    pyautogui.PAUSE = pyautogui_pause_val  # 使用从GUI控件获取的值
+    if backend is None:
+        backend = PyAutoGUIBackend()
+    backend_started = False
+    stream = stroke_plan if isinstance(stroke_plan, StrokeStream) else None
+    plan_pending = False # 中途停止时完整计划由规划线程稍后交给断点
 
     try:
-        pyautogui.FAILSAFE = False # 禁用 pyautogui 的 failsafe 功能
-        original_mouse_pos = pyautogui.position() # 存储原始鼠标位置
-
-        # 将 PIL 图像转换为 OpenCV 格式
-        if image_to_draw.mode == 'L': # 灰度图
-            cv_image = np.array(image_to_draw)
-        elif image_to_draw.mode == '1': # 二值图
-            # findContours 最适合处理 8 位单通道图像。
-            cv_image = np.array(image_to_draw.convert('L'))
-        else: # 其他模式的备用方案，转换为灰度图
-            print(f"警告: 图像模式为 {image_to_draw.mode}, 将尝试转换为灰度图。")
-            cv_image = np.array(image_to_draw.convert('L'))
-
-        # 判断用户是否设置了反转线稿颜色（黑线白底）
-        is_inverted_user_setting = app.invert_var.get() if 'app' in globals() and hasattr(globals()['app'], 'invert_var') else False
-
-        # findContours 期望白色对象在黑色背景上。
-        # 如果用户设置为“反转”（黑线白底），我们需要为 findContours 反转图像。
-        if is_inverted_user_setting:
-            cv_image = cv2.bitwise_not(cv_image)
-        
-        # 对图像进行阈值处理以确保其为二值图像（对 findContours 很重要）
-        # Canny 的输出应该已经是大部分二值的，但这能确保这一点。
-        # 如果线条是白色 (255)，背景是黑色 (0)
-        _, binary_image = cv2.threshold(cv_image, 127, 255, cv2.THRESH_BINARY)
-
-        contours, hierarchy = cv2.findContours(binary_image, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        if stream is not None:
+            plan = stream
+            if not stream.wait_ready(cancel_token): # 通常在确认对话框显示期间已经就绪
+                stream.abandon()
+                print("第一批笔画规划完成前绘画已被取消。")
+                return
+        else:
+            # 通常在生成线稿时已经编译好并缓存，这里直接取用；按时间预算调整过的计划由调用方传入
+            plan = stroke_plan if stroke_plan is not None else get_stroke_plan(image_to_draw, plan_key, plan_settings)
+        stats = plan.stats
+        stroke_count = stats.get("strokes", 0) if stream is not None else plan.stroke_count
+        point_count = stats.get("points_after", 0) if stream is not None else plan.point_count
 
-        print(f"开始绘制... 绘制起点: ({start_x}, {start_y}), 找到 {len(contours)} 条轮廓。")
-        print(f"绘制逻辑: {'绘制黑色像素对应的轮廓 (用户已反转)' if is_inverted_user_setting else '绘制白色像素对应的轮廓 (标准)'}")
+        print(f"开始绘制... 绘制起点: ({start_x}, {start_y}), 找到 {stats.get('contours', stroke_count)} 条轮廓, "
+              f"输出后端: {backend.name}。")
+        cleanup_note = describe_cleanup(stats)
+        if cleanup_note:
+            print(f"笔画清理: {cleanup_note}。")
+        color_layers = stats.get("color_layers") if stream is None else None
+        color_switcher = ColorSwitcher(color_layers, palette_macros) if color_layers else None
+        if color_switcher is not None:
+            print(describe_color_layers(color_layers, color_switcher.macros))
         
-        if not contours:
+        if stroke_count == 0 and stream is not None and stream.error is not None:
+            stream.result() # 抛出规划线程中的异常
+        if stroke_count == 0:
             print("未找到可绘制的轮廓。")
-            messagebox.showinfo("提示", "未在线稿中找到可绘制的轮廓。")
+            show_message("info", "提示", "未在线稿中找到可绘制的轮廓。")
             drawing_active = False # 如果没有轮廓，确保停止绘画
             # ... (finally 块的其余部分将处理状态更新) ...
             return # 提前退出
 
-        for contour_idx, contour in enumerate(contours):
-            if not drawing_active:
-                break
-            
-            # 将 pixel_skip 应用于轮廓点
-            # 这意味着我们不会绘制轮廓上的每一个点，从而使其更快/更粗糙
-            simplified_contour_points = []
-            if pixel_skip <= 0: # 确保 pixel_skip 至少为 1
-                current_pixel_skip = 1
-            else:
-                current_pixel_skip = pixel_skip
-
-            for i in range(0, len(contour), current_pixel_skip):
-                simplified_contour_points.append(contour[i][0]) # 轮廓点是 [[x,y]]
-
-            if len(simplified_contour_points) < 2: # 至少需要两个点才能绘制线段
-                continue
-
-            # 移动到轮廓段的起点
-            first_point = simplified_contour_points[0]
-            pyautogui.moveTo(start_x + first_point[0], start_y + first_point[1], duration=0)
-            pyautogui.mouseDown()
-
-            # 沿着轮廓段的后续点拖动
-            for i in range(1, len(simplified_contour_points)):
-                if not drawing_active:
-                    # 如果在拖动过程中绘画被中断，则抬起鼠标按钮
-                    pyautogui.mouseUp()
-                    break 
-                point = simplified_contour_points[i]
-                pyautogui.dragTo(start_x + point[0], start_y + point[1], duration=0)
-            
-            if not drawing_active and i < len(simplified_contour_points) -1 : # 检查是否在内部循环中发生中断
-                 pass # mouseUp 已经被调用
-            else: # 正常完成段或在内部循环之前中断
-                pyautogui.mouseUp()
-
+        print(f"笔画计划: {stroke_count} 条笔画，{point_count} 个点 (简化前 {stats.get('points_before', point_count)} 个点)"
+              + ("，边规划边绘制。" if stream is not None else "。"))
+        if "pen_up_after" in stats:
+            order_msg = f"抬笔移动距离 {stats['pen_up_before']:.0f}px -> {stats['pen_up_after']:.0f}px"
+            print(f"笔画顺序优化: {order_msg}")
+            if 'app' in globals() and hasattr(globals()['app'], 'update_status'):
+                app.update_status(f"绘画中... {plan.describe()}，{order_msg}。按 ESC 停止。")
 
-            if not drawing_active: # 在可能较长的拖动后再次检查
-                break
+        on_progress = None
+        if 'app' in globals() and hasattr(globals()['app'], 'update_status'):
+            # 进度从绘画线程经 root.after 交给主线程更新，频率由 TELEMETRY_INTERVAL 限制
+            on_progress = lambda snapshot: app.root.after(0, app.update_status, format_progress(snapshot))
+        if checkpoint is None:
+            checkpoint = DrawCheckpoint(None if stream is not None else plan, start_x, start_y, draw_delay, plan_settings)
+        else:
+            print(f"从{checkpoint.describe()}继续，原始起点 ({start_x}, {start_y})。")
+        drawing_checkpoint = checkpoint # 出错时同样保留进度
+        if stream is not None:
+            remaining_strokes, remaining_points = stroke_count, point_count
+        else:
+            remaining_strokes, remaining_points = checkpoint.remaining()
+        telemetry = DrawTelemetry(remaining_strokes, remaining_points, on_progress, record_strokes=save_trace)
+        telemetry.requested_at = requested_at
 
-            if draw_delay > 0:
-                time.sleep(draw_delay / 1000.0) # 将毫秒转换为秒
-            
-            # 可选：更频繁地更新状态
-            # if 'app' in globals() and hasattr(globals()['app'], 'update_status'):
-            #    app.update_status(f"绘画中... 轮廓 {contour_idx + 1}/{len(contours)}")
+        verify = verify and backend.draws_on_screen and color_switcher is None # 补画无法按层换色
+        if verify and checkpoint.reference_image is None:
+            t0 = time.perf_counter()
+            checkpoint.reference_image = capture_verify_region(plan, start_x, start_y) # 绘制前的画布
+            telemetry.add_span("verify_capture", t0, time.perf_counter())
 
+        backend.begin()
+        backend_started = True
+        telemetry.start_injection()
+        strokes = stream.iter_strokes(cancel_token) if stream is not None else plan
+        strokes_done, points_done = execute_strokes(strokes, backend, start_x, start_y, draw_delay,
+                                                    cancel_token, telemetry, checkpoint, color_switcher)
+        stopped_at = time.perf_counter()
+        stop_latency = stopped_at - cancel_token.cancelled_at if cancel_token.cancelled else None
+        if stop_latency is not None:
+            telemetry.add_span("stop", cancel_token.cancelled_at, stopped_at, reason=cancel_token.reason)
+        if stream is not None and stream.done:
+            plan = stream.result()
+            checkpoint.plan = plan
+            telemetry.add_span("planning", stream.started_at, stream.finished_at, streamed=True,
+                               first_batch=(stream.first_batch_at or stream.finished_at) - stream.started_at)
+        elif stream is not None:
+            # 中途停止：规划线程继续把计划排完（大图可能还要十几秒），排完后再把完整计划交给断点供 F6 续画。
+            # 绘画线程不等待，停止后立即收尾退出
+            stream.detach()
+            plan_pending = True
+            stream.add_done_callback(lambda s, cp=checkpoint: _finish_stream_checkpoint(s, cp))
+        verify_note = ""
+        if verify and checkpoint.finished and cancel_token():
+            # 仍在 begin/end 之间，补画沿用同一后端设置
+            if on_progress is not None:
+                app.root.after(0, app.update_status, "正在校验绘制结果... 按 ESC 停止。")
+            t0 = time.perf_counter()
+            passes = verify_and_redraw(plan, backend, start_x, start_y, checkpoint.reference_image, draw_delay,
+                                       cancel_token)
+            telemetry.add_span("verify", t0, time.perf_counter(), passes=passes)
+            verify_note = (f"校验 {len(passes)} 轮，补画 {sum(p['segments'] for p in passes)} 段缺失笔画"
+                           f"（{sum(p['points'] for p in passes)} 个点）。")
+            print(verify_note)
+        backend_started = False
+        backend.end()
+        snapshot = telemetry.snapshot()
+        telemetry.add_span("injection", telemetry.injection_start, time.perf_counter(),
+                           backend=backend.name, strokes=strokes_done, points=points_done)
+        stage_text = "，".join(f"{name} {seconds:.2f}s" for name, seconds in telemetry.stage_summary().items())
+        print(f"阶段耗时: {stage_text}")
+        print(f"绘制 {strokes_done} 条笔画 / {points_done} 个点，用时 {format_duration(snapshot['elapsed'])}，"
+              f"平均 {points_done / max(snapshot['elapsed'], 1e-6):.0f} 点/秒。")
+        latency_parts = []
+        if telemetry.first_stroke_latency is not None:
+            latency_parts.append(f"首笔延迟 {telemetry.first_stroke_latency * 1000:.0f}ms")
+        if stop_latency is not None:
+            latency_parts.append(f"停止延迟 {stop_latency * 1000:.0f}ms")
+        latency_note = "，".join(latency_parts)
+        if latency_note:
+            print(latency_note)
 
-        if drawing_active: # 绘画自然完成
-            messagebox.showinfo("完成", "绘画已完成！")
+        color_note = ""
+        if color_switcher is not None:
+            color_note = f"换色 {color_switcher.switches} 次，用时 {color_switcher.seconds:.1f} 秒。"
+            print(color_note)
+        extra = "\n".join(text for text in (backend.summary(), verify_note, color_note, latency_note) if text)
+        if save_trace:
+            try:
+                trace_path = telemetry.save_chrome_trace()
+                print(f"运行跟踪已保存: {trace_path}")
+                extra = (extra + "\n" if extra else "") + f"运行跟踪已保存到 {trace_path}"
+            except OSError as e:
+                print(f"保存运行跟踪失败: {e}")
+        if checkpoint.finished: # 绘画自然完成
+            drawing_checkpoint = None
+            show_message("info", "完成", "绘画已完成！" + (f"\n{extra}" if extra else ""))
         else: # 绘画被用户停止
-            messagebox.showinfo("停止", "绘画已停止。")
+            show_message("info", "停止", f"绘画已停止于{checkpoint.describe()}"
+                                          + (f"（{latency_note}）" if latency_note else "") + "。\n"
+                                          f"按 F6 在原位置 ({start_x}, {start_y}) 继续，按 F5 重新开始。")
 
     except Exception as e:
         print(f"绘画过程中发生错误: {e}")
-        messagebox.showerror("绘画错误", f"绘画过程中发生错误: {e}")
+        show_message("error", "绘画错误", f"绘画过程中发生错误: {e}")
     finally:
         drawing_active = False
-        pyautogui.FAILSAFE = True # 重新启用 failsafe
-        pyautogui.PAUSE = original_pyautogui_pause # 恢复原始的 PAUSE 值
-        if 'original_mouse_pos' in locals():
-             pyautogui.moveTo(original_mouse_pos[0], original_mouse_pos[1], duration=0.1) # 恢复鼠标位置
+        if drawing_cancel_token is cancel_token:
+            drawing_cancel_token = None
+        if stream is not None and checkpoint is not None and checkpoint.plan is None and not plan_pending:
+            # 规划出错或在规划结束前出错：没有完整计划就无法续画
+            stream.abandon()
+            drawing_checkpoint = None
+        if backend_started:
+            try:
+                backend.end()
+            except Exception as e:
+                print(f"结束绘画后端时出错: {e}")
         if 'app' in globals() and hasattr(globals()['app'], 'update_status'):
-            app.update_status("空闲。将鼠标移至绘画区域，按F5开始。")
+            if drawing_checkpoint is not None:
+                app.update_status(f"已停止于{drawing_checkpoint.describe()}。按 F6 继续，或将鼠标移至绘画区域按 F5 重新开始。")
+            else:
+                app.update_status("空闲。将鼠标移至绘画区域，按F5开始。")
+
+
+def _finish_stream_checkpoint(stream, checkpoint):
+    # 在规划线程中调用：把边规划边绘制中途停止时尚未排完的完整计划交给断点
+    global drawing_checkpoint
+    if stream.abandoned:
+        return
+    try:
+        checkpoint.plan = stream.result()
+    except Exception as e:
+        print(f"后台规划出错，无法从断点继续: {e}")
+        if drawing_checkpoint is checkpoint:
+            drawing_checkpoint = None
 
+# --- 绘制队列 ---
+# 多个计划各自指定屏幕起点和缩放比例后排队，确认一次即依次连续绘制，中间不需要人工操作。
+# 暂停（或 ESC）时当前任务记下断点，继续时从断点接着画，再画其余任务
+JOB_PENDING = "等待"
+JOB_RUNNING = "绘制中"
+JOB_PAUSED = "已暂停"
+JOB_DONE = "完成"
+JOB_FAILED = "失败"
+
+class DrawJob:
+    def __init__(self, plan, origin_x, origin_y, scale=1.0, name="", draw_delay=0):
+        self.plan = plan
+        self.origin_x = int(origin_x)
+        self.origin_y = int(origin_y)
+        self.scale = float(scale)
+        self.name = name or plan.describe()
+        self.draw_delay = draw_delay
+        self.status = JOB_PENDING
+        self.checkpoint = None # 开始绘制后创建，暂停后从这里继续
+        self.error = ""
+        self.seconds = 0.0 # 实际绘制用时
+        self._scaled = None
+
+    def set_placement(self, origin_x, origin_y, scale):
+        # 只能在开始绘制之前修改，否则断点的坐标不再对应画布上已画的部分
+        if self.checkpoint is not None:
+            raise ValueError("任务已经开始绘制，不能再修改起点和缩放")
+        self.origin_x, self.origin_y = int(origin_x), int(origin_y)
+        if float(scale) != self.scale:
+            self.scale = float(scale)
+            self._scaled = None
+
+    def scaled_plan(self):
+        if self._scaled is None:
+            self._scaled = self.plan.scaled(self.scale)
+        return self._scaled
+
+    def bounds(self):
+        # 在屏幕上占据的区域 (x1, y1, x2, y2)
+        plan = self.scaled_plan()
+        return self.origin_x, self.origin_y, self.origin_x + plan.width, self.origin_y + plan.height
+
+    def estimate(self, model, pause=0.0, palette_macros=None):
+        # 剩余部分的预计秒数（暂停过的任务按剩余比例估计）
+        plan = self.scaled_plan()
+        if self.status == JOB_DONE:
+            return 0.0
+        seconds = model.estimate_plan(plan, self.draw_delay, pause)
+        layers = plan.stats.get("color_layers")
+        if layers:
+            seconds += color_switch_seconds(layers, palette_macros or [])
+        if self.checkpoint is not None and plan.point_count:
+            seconds *= self.checkpoint.remaining()[1] / plan.point_count
+        return seconds
+
+    def describe_progress(self):
+        if self.status == JOB_PAUSED and self.checkpoint is not None:
+            return f"{JOB_PAUSED}（{self.checkpoint.describe()}）"
+        if self.status == JOB_FAILED:
+            return f"{JOB_FAILED}: {self.error}"
+        if self.status == JOB_DONE:
+            return f"{JOB_DONE}（{format_duration(self.seconds)}）"
+        return self.status
+
+class DrawQueue:
+    # 任务列表可在主线程编辑；run() 在绘画线程中依次绘制所有未完成的任务
+    def __init__(self):
+        self.jobs = []
+        self.running = False
+
+    def add(self, job):
+        self.jobs.append(job)
+        return job
+
+    def remove(self, index):
+        if self.jobs[index].status == JOB_RUNNING:
+            raise ValueError("不能移除正在绘制的任务")
+        del self.jobs[index]
+
+    def move(self, index, delta):
+        target = index + delta
+        if 0 <= target < len(self.jobs):
+            self.jobs[index], self.jobs[target] = self.jobs[target], self.jobs[index]
+            return target
+        return index
+
+    def clear_finished(self):
+        self.jobs = [job for job in self.jobs if job.status != JOB_DONE]
+
+    def pending(self):
+        # 未完成的任务：等待中、已暂停，以及出错后待重试的任务
+        return [job for job in self.jobs if job.status in (JOB_PENDING, JOB_PAUSED, JOB_FAILED)]
+
+    def estimate_total(self, model, pause=0.0, palette_macros=None):
+        return sum(job.estimate(model, pause, palette_macros) for job in self.pending())
+
+    def overlaps(self):
+        # 画布区域相互重叠的任务对 (i, j)，用于开始前提醒
+        pairs = []
+        boxes = [job.bounds() for job in self.jobs]
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    pairs.append((i, j))
+        return pairs
+
+    def run(self, backend, cancel_token, palette_macros=None, on_update=None, on_progress=None):
+        # 依次绘制所有未完成的任务，整个队列只调用一次 backend.begin()/end()。每画完一个任务再取下一个，
+        # 绘制期间加入或调整顺序的任务同样生效。取消时当前任务标记为已暂停并保留断点，
+        # 返回 (完成的任务数, 是否全部完成)。on_update(job) 在任务状态变化时调用；on_progress(job, snapshot) 转发绘制进度
+        self.running = True
+        done = 0
+        attempted = set()
+        backend.begin()
+        try:
+            while cancel_token():
+                job = next((job for job in self.pending() if id(job) not in attempted), None)
+                if job is None:
+                    break
+                attempted.add(id(job))
+                plan = job.scaled_plan()
+                if job.checkpoint is None:
+                    job.checkpoint = DrawCheckpoint(plan, job.origin_x, job.origin_y, job.draw_delay)
+                job.status, job.error = JOB_RUNNING, ""
+                if on_update is not None:
+                    on_update(job)
+                layers = plan.stats.get("color_layers")
+                color_switcher = ColorSwitcher(layers, palette_macros) if layers else None
+                remaining_strokes, remaining_points = job.checkpoint.remaining()
+                telemetry = DrawTelemetry(remaining_strokes, remaining_points,
+                                          (lambda snapshot, job=job: on_progress(job, snapshot)) if on_progress else None)
+                telemetry.start_injection()
+                t0 = time.perf_counter()
+                try:
+                    execute_strokes(plan, backend, job.origin_x, job.origin_y, job.draw_delay, cancel_token,
+                                    telemetry, job.checkpoint, color_switcher)
+                except Exception as e:
+                    # 出错后停止整个队列：画布状态不确定，继续画后面的任务可能画错位置
+                    job.status, job.error = JOB_FAILED, str(e)
+                    print(f"绘制队列任务 {job.name} 出错: {e}")
+                    if on_update is not None:
+                        on_update(job)
+                    break
+                finally:
+                    job.seconds += time.perf_counter() - t0
+                if job.checkpoint.finished:
+                    job.status = JOB_DONE
+                    done += 1
+                else:
+                    job.status = JOB_PAUSED
+                if on_update is not None:
+                    on_update(job)
+        finally:
+            self.running = False
+            backend.end()
+        return done, not self.pending()
 
 # --- 键盘监听器 ---
 def on_press(key):
-    global drawing_active, drawing_thread, linework_pil_image, app
+    global drawing_active, drawing_thread, drawing_cancel_token, linework_edges, linework_key, app
     if not app_running: # 如果应用程序正在关闭，则停止监听器
         return False
 
     try:
+        # F5/F6 转交主线程处理（笔画计划在后台线程准备），监听回调立即返回，准备期间仍能响应 ESC
         if key == keyboard.Key.f5:
-            if not drawing_active:
-                if linework_pil_image is None:
-                    messagebox.showwarning("提示", "请先截取并生成线稿图像。")
-                    return
-
-                start_x, start_y = pyautogui.position()
-                msg = (f"将在当前鼠标位置 ({start_x}, {start_y}) 开始绘画。\n"
-                       "请确保目标窗口已准备好接收鼠标点击。\n"
-                       "按 ESC 键中途停止。")
-
-                # 强制主窗口置顶，以确保弹窗在其之上且最前
-                # 保存主窗口原始的置顶状态
-                try:
-                    original_topmost_status = app.root.attributes('-topmost')
-                    app.root.attributes('-topmost', True)
-                except tk.TclError: # 如果根窗口被销毁或未完全初始化，可能会发生这种情况
-                    original_topmost_status = False # 默认为 False
-
-                user_confirmed = messagebox.askokcancel("确认开始绘画", msg)
+            app.root.after(0, app.start_drawing_action)
 
-                # 恢复主窗口原始的置顶状态
-                try:
-                    app.root.attributes('-topmost', original_topmost_status)
-                except tk.TclError:
-                    pass # 如果窗口不再存在，则忽略
-
-                if user_confirmed:
-                    drawing_active = True
-                    app.update_status(f"绘画中... 按 ESC 停止。")
-                    
-                    draw_delay_val = app.draw_delay_scale.get() if hasattr(app, 'draw_delay_scale') else 10
-                    # 在此处将 pixel_skip_val 转换为 int
-                    pixel_skip_val = int(app.pixel_skip_scale.get()) if hasattr(app, 'pixel_skip_scale') else 1
-                    # 获取 pyautogui_pause 的值
-                    pyautogui_pause_val = app.pyautogui_pause_scale.get() if hasattr(app, 'pyautogui_pause_scale') else 0.0
-
-                    drawing_thread = threading.Thread(target=drawing_task, 
-                                                      args=(linework_pil_image, start_x, start_y, draw_delay_val, pixel_skip_val, pyautogui_pause_val), # 添加新参数
-                                                      daemon=True)
-                    drawing_thread.start()
-            else:
-                print("绘画已在进行中。")
+        elif key == keyboard.Key.f6:
+            app.root.after(0, app.resume_drawing_action)
 
         elif key == keyboard.Key.esc:
             if drawing_active:
                 print("ESC按下，停止绘画...")
-                drawing_active = False # 通知绘画线程停止
+                stop_drawing("ESC") # 通知绘画线程停止
                 if drawing_thread and drawing_thread.is_alive():
-                     # 线程将通过检查 drawing_active 自行停止
+                     # 注入循环在当前拖动点之后检查取消令牌并抬笔
                      app.update_status("正在停止绘画...")
                 else: # 如果线程以某种方式完成或未运行
                     app.update_status("空闲。将鼠标移至绘画区域，按F5开始。")
+            elif app.cancel_drawing_preparation():
+                print("ESC按下，取消准备中的绘画。")
+                app.root.after(0, app.update_status, "正在取消...")
             else: # 如果在未绘画时按下 ESC，则可能关闭弹出窗口或应用程序
                 if hasattr(app, 'selector') and app.selector and app.selector.selector_window.winfo_exists():
                     app.selector.cancel_selection()
@@ -314,18 +3098,85 @@ def on_press(key):
 
 def start_keyboard_listener():
     global keyboard_listener_thread
+    load_input_modules()
     # 以非阻塞方式设置监听器
     listener = keyboard.Listener(on_press=on_press)
     listener.start()
     return listener
 
 
+# --- 预览缓存 ---
+PREVIEW_RESIZE_DELAY_MS = 100 # 预览标签尺寸变化后延迟重绘，拖动窗口边框时只重绘一次
+
+class PreviewCache:
+    # 一个预览标签的缓存：当前图像的降采样金字塔和复用的 PhotoImage。
+    # 交互更新（拖动滑块）用双线性插值，最终显示用 LANCZOS；尺寸不变时原地 paste，不重新分配 PhotoImage。
+    def __init__(self):
+        self.source = None
+        self.levels = []
+        self.photo = None
+        self.rendered_size = None
+        self.rendered_interactive = False
+        self.rendered_invert = False
+        self.resize_job = None
+
+    def set_source(self, image):
+        # image 可以是 PIL 图像或线稿数组；数组用 Image.fromarray 包装，与数组共享内存
+        if image is not self.source:
+            self.source = image
+            if image is None:
+                self.levels = []
+            else:
+                self.levels = [Image.fromarray(image) if isinstance(image, np.ndarray) else image]
+            self.rendered_size = None
+
+    def clear(self):
+        self.set_source(None)
+        self.photo = None
+
+    def fit_size(self, max_width, max_height):
+        width, height = self.levels[0].size
+        scale = min(max_width / width, max_height / height, 1.0)
+        return max(1, int(width * scale)), max(1, int(height * scale))
+
+    def _level_for(self, size):
+        # 金字塔中不小于目标尺寸的最小一级；下一级用 reduce(2)（2x2 平均）按需生成
+        for level in self.levels:
+            if level.width // 2 < size[0] or level.height // 2 < size[1]:
+                return level
+        level = self.levels[-1]
+        while level.width // 2 >= size[0] and level.height // 2 >= size[1]:
+            level = level.reduce(2)
+            self.levels.append(level)
+        return level
+
+    def render(self, max_width, max_height, interactive=False, invert=False):
+        # 返回用于显示的 PhotoImage；尺寸、质量和反转都没有变化时直接返回已有的。
+        # 反转在缩放后的小图上进行，不复制全尺寸线稿
+        size = self.fit_size(max_width, max_height)
+        if (self.photo is not None and size == self.rendered_size and invert == self.rendered_invert
+                and (interactive or not self.rendered_interactive)):
+            return self.photo
+        level = self._level_for(size)
+        if level.size != size:
+            level = level.resize(size, Image.Resampling.BILINEAR if interactive else Image.Resampling.LANCZOS)
+        if invert:
+            level = level.point(lambda v: 255 - v)
+        if self.photo is not None and (self.photo.width(), self.photo.height()) == size:
+            self.photo.paste(level)
+        else:
+            self.photo = ImageTk.PhotoImage(image=level)
+        self.rendered_size = size
+        self.rendered_interactive = interactive
+        self.rendered_invert = invert
+        return self.photo
+
 # --- GUI 类 ---
 class AutoDrawerApp:
     def __init__(self, root_window):
         self.root = root_window
         self.root.title("秋收冬藏") # 应用程序标题
-        self.root.geometry("650x750") # 窗口大小
+        self.root.geometry("700x900") # 窗口大小
         self.root.protocol("WM_DELETE_WINDOW", self.on_close) # 设置关闭窗口时的回调
 
         self.selector = None # 用于截图选择器窗口实例
@@ -354,6 +3205,43 @@ class AutoDrawerApp:
 
         self.process_button = ttk.Button(controls_frame, text="2. 生成线稿", command=self.process_image_button_action, state=tk.DISABLED)
         self.process_button.pack(fill=tk.X, pady=5)
+
+        self.mirror_button = ttk.Button(controls_frame, text="实时跟随模式", command=self.start_mirror_action, state=tk.DISABLED)
+        self.mirror_button.pack(fill=tk.X, pady=5)
+
+        plan_file_frame = ttk.Frame(controls_frame) # 保存/载入笔画计划
+        plan_file_frame.pack(fill=tk.X, pady=5)
+        self.save_plan_button = ttk.Button(plan_file_frame, text="保存笔画计划", command=self.save_plan_action)
+        self.save_plan_button.pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(0, 5))
+        self.load_plan_button = ttk.Button(plan_file_frame, text="载入笔画计划", command=self.load_plan_action)
+        self.load_plan_button.pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(0, 5))
+        self.queue_button = ttk.Button(plan_file_frame, text="绘制队列...", command=self.open_queue_window)
+        self.queue_button.pack(side=tk.LEFT, expand=True, fill=tk.X)
+        self.loaded_plan = None # 从文件载入的计划；设置后按 F5 绘制它而不是当前线稿
+        self.loaded_plan_name = ""
+        self.draw_queue = DrawQueue() # 排队依次绘制的任务
+        self._prepare_token = None # F5 后正在后台准备笔画计划时的取消令牌
+        self.queue_window = None
+
+        color_frame = ttk.Frame(controls_frame) # 彩色分层模式：按颜色分层绘制，每层换色一次
+        color_frame.pack(fill=tk.X, pady=5)
+        self.color_mode_var = tk.BooleanVar(value=False)
+        self.color_mode_check = ttk.Checkbutton(color_frame, text="彩色分层模式", variable=self.color_mode_var,
+                                                command=self.schedule_color_compile)
+        self.color_mode_check.pack(side=tk.LEFT)
+        ttk.Label(color_frame, text="颜色数:").pack(side=tk.LEFT, padx=(10, 0))
+        self.color_count_var = tk.IntVar(value=4)
+        self.color_count_spinbox = ttk.Spinbox(color_frame, from_=2, to=8, width=3, textvariable=self.color_count_var,
+                                               command=self.schedule_color_compile)
+        self.color_count_spinbox.pack(side=tk.LEFT)
+        self.color_fill_var = tk.BooleanVar(value=False) # 用排线填充色块，否则只画各色块的边界
+        self.color_fill_check = ttk.Checkbutton(color_frame, text="填充色块", variable=self.color_fill_var,
+                                                command=self.schedule_color_compile)
+        self.color_fill_check.pack(side=tk.LEFT, padx=(10, 0))
+        self.palette_button = ttk.Button(color_frame, text="调色板...", command=self.edit_palette_action)
+        self.palette_button.pack(side=tk.RIGHT)
+        self.palette_macros = load_palette_macros() # 每个颜色槽位（从暗到亮）的换色点击位置
+        self._color_compile_job = None
         
         # 创建一个新的框架来容纳参数区域，使它们在同一行显示
         parameter_row_frame = ttk.Frame(controls_frame)
@@ -369,7 +3257,7 @@ class AutoDrawerApp:
         self.canny_thresh1_scale.set(50)
         self.canny_thresh1_scale.grid(row=0, column=1, padx=5, pady=5)
         self.canny_thresh1_val_label = ttk.Label(param_frame, text="50")
-        self.canny_thresh1_scale.config(command=lambda v: self.canny_thresh1_val_label.config(text=f"{float(v):.0f}"))
+        self.canny_thresh1_scale.config(command=lambda v: (self.canny_thresh1_val_label.config(text=f"{float(v):.0f}"), self.schedule_live_preview()))
         self.canny_thresh1_val_label.grid(row=0, column=2, padx=5, pady=5)
 
 
@@ -378,13 +3266,81 @@ class AutoDrawerApp:
         self.canny_thresh2_scale.set(150)
         self.canny_thresh2_scale.grid(row=1, column=1, padx=5, pady=5)
         self.canny_thresh2_val_label = ttk.Label(param_frame, text="150")
-        self.canny_thresh2_scale.config(command=lambda v: self.canny_thresh2_val_label.config(text=f"{float(v):.0f}"))
+        self.canny_thresh2_scale.config(command=lambda v: (self.canny_thresh2_val_label.config(text=f"{float(v):.0f}"), self.schedule_live_preview()))
         self.canny_thresh2_val_label.grid(row=1, column=2, padx=5, pady=5)
 
+        # 拖动阈值滑块时实时预览（缩小图），松开后再生成全分辨率线稿
+        for scale in (self.canny_thresh1_scale, self.canny_thresh2_scale):
+            scale.bind("<ButtonRelease-1>", self.on_threshold_released)
+            scale.bind("<KeyRelease>", self.on_threshold_released)
+        self._linework_source = None # (截图哈希, 模糊后的灰度图, 预览用缩小图)
+        self._linework_source_lock = threading.Lock()
+        self._captured_gray = None # (截图哈希, 截图时直接转换的灰度数组)，预处理时原地模糊
+        self._preview_buffers = [None, None] # 实时预览 Canny 输出的两块复用缓冲区（交替写入，显示中的那块不会被覆盖）
+        self._preview_buffer_index = 0
+        self._live_preview_job = None # 防抖用的 after 任务
+        self._linework_generation = 0 # 每次发起线稿计算时递增，用于丢弃过期结果
+
         self.invert_var = tk.BooleanVar(value=False) # 是否反转颜色变量
         self.invert_checkbox = ttk.Checkbutton(param_frame, text="反转颜色 (黑线白底)", variable=self.invert_var, command=self.on_invert_toggle)
         self.invert_checkbox.grid(row=2, column=0, columnspan=3, pady=5, sticky="w")
 
+        self.tiled_var = tk.BooleanVar(value=True) # 大图分块并行生成线稿
+        self.tiled_checkbox = ttk.Checkbutton(param_frame, text="大图分块并行处理", variable=self.tiled_var)
+        self.tiled_checkbox.grid(row=3, column=0, columnspan=3, pady=5, sticky="w")
+
+        # 提取方式：轮廓（沿细线两侧各画一遍）或中心线（每条线只画一次）
+        ttk.Label(param_frame, text="提取方式:").grid(row=4, column=0, padx=5, pady=5, sticky="w")
+        self.trace_mode_var = tk.StringVar(value="轮廓")
+        self.trace_mode_combo = ttk.Combobox(param_frame, textvariable=self.trace_mode_var,
+                                             values=list(TRACE_MODES.keys()), state="readonly", width=12)
+        self.trace_mode_combo.grid(row=4, column=1, padx=5, pady=5, sticky="w")
+        self.trace_mode_combo.bind("<<ComboboxSelected>>", lambda e: self.schedule_plan_compile())
+        self.trace_compare_label = ttk.Label(param_frame, text="") # 两种提取方式的笔画数/点数对比
+        self.trace_compare_label.grid(row=5, column=0, columnspan=3, padx=5, pady=5, sticky="w")
+
+        # 色调排线：把截图暗部按层数用平行直线填充，0 表示只画线稿
+        ttk.Label(param_frame, text="排线层数:").grid(row=6, column=0, padx=5, pady=5, sticky="w")
+        self.hatch_levels_scale = ttk.Scale(param_frame, from_=0, to=4, orient=tk.HORIZONTAL, length=150)
+        self.hatch_levels_scale.set(0)
+        self.hatch_levels_scale.grid(row=6, column=1, padx=5, pady=5)
+        self.hatch_levels_val_label = ttk.Label(param_frame, text="0")
+        self.hatch_levels_scale.config(command=lambda v: (self.hatch_levels_val_label.config(text=f"{float(v):.0f}"), self.schedule_plan_compile()))
+        self.hatch_levels_val_label.grid(row=6, column=2, padx=5, pady=5)
+
+        ttk.Label(param_frame, text="排线间距 (px):").grid(row=7, column=0, padx=5, pady=5, sticky="w")
+        self.hatch_spacing_scale = ttk.Scale(param_frame, from_=2, to=20, orient=tk.HORIZONTAL, length=150)
+        self.hatch_spacing_scale.set(6)
+        self.hatch_spacing_scale.grid(row=7, column=1, padx=5, pady=5)
+        self.hatch_spacing_val_label = ttk.Label(param_frame, text="6")
+        self.hatch_spacing_scale.config(command=lambda v: (self.hatch_spacing_val_label.config(text=f"{float(v):.0f}"), self.schedule_plan_compile()))
+        self.hatch_spacing_val_label.grid(row=7, column=2, padx=5, pady=5)
+
+        ttk.Label(param_frame, text="排线角度 (°):").grid(row=8, column=0, padx=5, pady=5, sticky="w")
+        self.hatch_angle_scale = ttk.Scale(param_frame, from_=0, to=180, orient=tk.HORIZONTAL, length=150)
+        self.hatch_angle_scale.set(45)
+        self.hatch_angle_scale.grid(row=8, column=1, padx=5, pady=5)
+        self.hatch_angle_val_label = ttk.Label(param_frame, text="45")
+        self.hatch_angle_scale.config(command=lambda v: (self.hatch_angle_val_label.config(text=f"{float(v):.0f}"), self.schedule_plan_compile()))
+        self.hatch_angle_val_label.grid(row=8, column=2, padx=5, pady=5)
+
+        # 笔画清理：去掉 Canny 噪声产生的小杂点，并把端点相距很近的断线连成一笔，0 表示不处理
+        ttk.Label(param_frame, text="去除杂点 (px):").grid(row=9, column=0, padx=5, pady=5, sticky="w")
+        self.speck_size_scale = ttk.Scale(param_frame, from_=0, to=20, orient=tk.HORIZONTAL, length=150)
+        self.speck_size_scale.set(4)
+        self.speck_size_scale.grid(row=9, column=1, padx=5, pady=5)
+        self.speck_size_val_label = ttk.Label(param_frame, text="4")
+        self.speck_size_scale.config(command=lambda v: (self.speck_size_val_label.config(text=f"{float(v):.0f}"), self.schedule_plan_compile()))
+        self.speck_size_val_label.grid(row=9, column=2, padx=5, pady=5)
+
+        ttk.Label(param_frame, text="连接断线 (px):").grid(row=10, column=0, padx=5, pady=5, sticky="w")
+        self.join_gap_scale = ttk.Scale(param_frame, from_=0, to=10, orient=tk.HORIZONTAL, length=150)
+        self.join_gap_scale.set(2)
+        self.join_gap_scale.grid(row=10, column=1, padx=5, pady=5)
+        self.join_gap_val_label = ttk.Label(param_frame, text="2")
+        self.join_gap_scale.config(command=lambda v: (self.join_gap_val_label.config(text=f"{float(v):.0f}"), self.schedule_plan_compile()))
+        self.join_gap_val_label.grid(row=10, column=2, padx=5, pady=5)
+
         # 绘画参数
         draw_param_frame = ttk.LabelFrame(parameter_row_frame, text="绘画参数") # 修改父框架
         # 修改 pack 选项以水平排列
@@ -403,19 +3359,77 @@ class AutoDrawerApp:
         self.pixel_skip_scale.set(1) # 默认为 1 (不跳过)
         self.pixel_skip_scale.grid(row=1, column=1, padx=5, pady=5)
         self.pixel_skip_val_label = ttk.Label(draw_param_frame, text="1")
-        self.pixel_skip_scale.config(command=lambda v: self.pixel_skip_val_label.config(text=f"{float(v):.0f}"))
+        self.pixel_skip_scale.config(command=lambda v: (self.pixel_skip_val_label.config(text=f"{float(v):.0f}"), self.schedule_plan_compile()))
         self.pixel_skip_val_label.grid(row=1, column=2, padx=5, pady=5)
 
+        # 简化方式：固定像素跳跃，或按最大偏差（误差容限）简化
+        ttk.Label(draw_param_frame, text="简化方式:").grid(row=2, column=0, padx=5, pady=5, sticky="w")
+        self.simplify_mode_var = tk.StringVar(value="像素跳跃")
+        self.simplify_mode_combo = ttk.Combobox(draw_param_frame, textvariable=self.simplify_mode_var,
+                                                values=list(SIMPLIFY_MODES.keys()), state="readonly", width=12)
+        self.simplify_mode_combo.grid(row=2, column=1, padx=5, pady=5, sticky="w")
+        self.simplify_mode_combo.bind("<<ComboboxSelected>>", lambda e: self.schedule_plan_compile())
+
+        ttk.Label(draw_param_frame, text="最大偏差 (px):").grid(row=3, column=0, padx=5, pady=5, sticky="w")
+        self.simplify_tolerance_scale = ttk.Scale(draw_param_frame, from_=0.1, to=5.0, orient=tk.HORIZONTAL, length=150)
+        self.simplify_tolerance_scale.set(1.0) # 默认 1 像素偏差
+        self.simplify_tolerance_scale.grid(row=3, column=1, padx=5, pady=5)
+        self.simplify_tolerance_val_label = ttk.Label(draw_param_frame, text="1.0")
+        self.simplify_tolerance_scale.config(command=lambda v: (self.simplify_tolerance_val_label.config(text=f"{float(v):.1f}"), self.schedule_plan_compile()))
+        self.simplify_tolerance_val_label.grid(row=3, column=2, padx=5, pady=5)
 
         # 新增 PyAutoGUI PAUSE 控件
-        ttk.Label(draw_param_frame, text="移动间隔(s):").grid(row=2, column=0, padx=5, pady=5, sticky="w")
+        ttk.Label(draw_param_frame, text="移动间隔(s):").grid(row=4, column=0, padx=5, pady=5, sticky="w")
         self.pyautogui_pause_scale = ttk.Scale(draw_param_frame, from_=0.0, to=0.1, orient=tk.HORIZONTAL, length=150)
         self.pyautogui_pause_scale.set(0.0) # 默认值为 0.0
-        self.pyautogui_pause_scale.grid(row=2, column=1, padx=5, pady=5)
+        self.pyautogui_pause_scale.grid(row=4, column=1, padx=5, pady=5)
         self.pyautogui_pause_val_label = ttk.Label(draw_param_frame, text="0.000")
         # 更新标签显示，并格式化为三位小数
         self.pyautogui_pause_scale.config(command=lambda v: self.pyautogui_pause_val_label.config(text=f"{float(v):.3f}"))
-        self.pyautogui_pause_val_label.grid(row=2, column=2, padx=5, pady=5)
+        self.pyautogui_pause_val_label.grid(row=4, column=2, padx=5, pady=5)
+
+        self.optimize_order_var = tk.BooleanVar(value=True) # 是否优化笔画顺序以减少抬笔移动
+        self.optimize_order_checkbox = ttk.Checkbutton(draw_param_frame, text="优化笔画顺序 (减少空走)", variable=self.optimize_order_var,
+                                                       command=self.schedule_plan_compile)
+        self.optimize_order_checkbox.grid(row=5, column=0, columnspan=3, pady=5, sticky="w")
+
+        # 输出方式：模拟鼠标，或记录事件/导出 SVG/空输出（无需真实桌面）
+        ttk.Label(draw_param_frame, text="输出方式:").grid(row=6, column=0, padx=5, pady=5, sticky="w")
+        self.backend_var = tk.StringVar(value="鼠标模拟")
+        self.backend_combo = ttk.Combobox(draw_param_frame, textvariable=self.backend_var,
+                                          values=list(BACKEND_DISPLAY_NAMES.keys()), state="readonly", width=12)
+        self.backend_combo.grid(row=6, column=1, padx=5, pady=5, sticky="w")
+        self.backend_combo.bind("<<ComboboxSelected>>", self.on_backend_selected)
+        self.svg_output_path = "auto_drawer_output.svg" # 导出 SVG 时的文件路径
+
+        # 高速注入 (XTest) 的事件速率上限
+        ttk.Label(draw_param_frame, text="事件/秒上限:").grid(row=7, column=0, padx=5, pady=5, sticky="w")
+        self.max_event_rate_scale = ttk.Scale(draw_param_frame, from_=500, to=20000, orient=tk.HORIZONTAL, length=150)
+        self.max_event_rate_scale.set(5000)
+        self.max_event_rate_scale.grid(row=7, column=1, padx=5, pady=5)
+        self.max_event_rate_val_label = ttk.Label(draw_param_frame, text="5000")
+        self.max_event_rate_scale.config(command=lambda v: self.max_event_rate_val_label.config(text=f"{float(v):.0f}"))
+        self.max_event_rate_val_label.grid(row=7, column=2, padx=5, pady=5)
+
+        self.point_stats_label = ttk.Label(draw_param_frame, text="点数: -") # 简化前/后的点数
+        self.point_stats_label.grid(row=8, column=0, columnspan=3, padx=5, pady=5, sticky="w")
+
+        # 目标时长：大于 0 时自动选择简化程度、丢弃次要笔画并调整延迟，使预计用时不超过该值
+        ttk.Label(draw_param_frame, text="目标时长 (秒):").grid(row=9, column=0, padx=5, pady=5, sticky="w")
+        self.target_duration_var = tk.StringVar(value="0")
+        self.target_duration_entry = ttk.Entry(draw_param_frame, textvariable=self.target_duration_var, width=10)
+        self.target_duration_entry.grid(row=9, column=1, padx=5, pady=5, sticky="w")
+        self.calibrate_button = ttk.Button(draw_param_frame, text="校准", command=self.calibrate_cost_model_action)
+        self.calibrate_button.grid(row=9, column=2, padx=5, pady=5)
+
+        self.save_trace_var = tk.BooleanVar(value=False)
+        self.save_trace_check = ttk.Checkbutton(draw_param_frame, text="保存运行跟踪 (Chrome trace)", variable=self.save_trace_var)
+        self.save_trace_check.grid(row=10, column=0, columnspan=3, padx=5, pady=5, sticky="w")
+
+        self.verify_var = tk.BooleanVar(value=False) # 绘制后截图比对，只补画缺失的笔画
+        self.verify_check = ttk.Checkbutton(draw_param_frame, text="绘制后校验并补画缺失笔画", variable=self.verify_var)
+        self.verify_check.grid(row=11, column=0, columnspan=3, padx=5, pady=5, sticky="w")
+        self._plan_compile_job = None # 绘画参数变化后延迟重新编译笔画计划的 after 任务
 
         self.help_button = ttk.Button(controls_frame, text="帮助/说明", command=self.show_help)
         self.help_button.pack(fill=tk.X, pady=(20,5))
@@ -439,9 +3453,784 @@ class AutoDrawerApp:
         self.status_bar.config(text=message)
         self.root.update_idletasks() # 立即更新界面
 
+    def update_point_stats(self, points_before, points_after, note=""):
+        ratio = points_after / points_before * 100 if points_before else 0
+        self.point_stats_label.config(text=f"点数: {points_before} -> {points_after} ({ratio:.0f}%)"
+                                           + (f"\n{note}" if note else ""))
+
+    def get_backend_name(self):
+        return BACKEND_DISPLAY_NAMES.get(self.backend_var.get(), "pyautogui")
+
+    def get_target_duration(self):
+        try:
+            return max(0.0, float(self.target_duration_var.get()))
+        except ValueError:
+            return 0.0
+
+    def get_drawing_options(self):
+        # 在主线程读取开始绘画所需的界面参数和当前线稿，交给后台的 prepare_drawing_plan 使用
+        return {"draw_delay": self.draw_delay_scale.get(), "pause": self.pyautogui_pause_scale.get(),
+                "backend": self.get_backend_name(), "budget": self.get_target_duration(),
+                "loaded_plan": self.loaded_plan, "color_settings": self.get_color_settings(),
+                "palette_macros": self.palette_macros, "linework": linework_edges, "linework_key": linework_key}
+
+    def prepare_drawing_plan(self, plan_settings, options):
+        # 返回 (计划, 笔画间延迟毫秒, 预计秒数, 时间预算说明)；设置了目标时长时按预算调整计划。
+        # 计划还没编译好时返回已在后台开始规划的 StrokeStream，预计秒数为 None。
+        # 按预算调整可能要多次编译整张图，在后台线程中调用；options 来自 get_drawing_options()
+        draw_delay = options["draw_delay"]
+        pause = options["pause"]
+        model = load_cost_model(options["backend"])
+        budget = options["budget"]
+        linework, key = options["linework"], options["linework_key"]
+        if options["loaded_plan"] is not None: # 载入的计划无法重新简化，超出预算时只能丢弃笔画
+            plan = options["loaded_plan"]
+            if budget > 0 and model.estimate_plan(plan, 0, pause) > budget:
+                fitted = drop_least_significant_strokes(plan, model, budget, 0, pause)
+                note = f"丢弃 {plan.stroke_count - fitted.stroke_count} 条最短笔画"
+                return fitted, 0, model.estimate_plan(fitted, 0, pause), note
+            if budget > 0 and model.estimate_plan(plan, draw_delay, pause) > budget:
+                return plan, 0, model.estimate_plan(plan, 0, pause), "已取消笔画间延迟"
+            return plan, draw_delay, model.estimate_plan(plan, draw_delay, pause), ""
+        color_settings = options["color_settings"]
+        if color_settings is not None: # 彩色分层计划按层拼接，超出预算时同样只丢弃笔画
+            plan = get_color_plan(captured_pil_image, captured_image_hash, *color_settings, plan_settings)
+            switch_seconds = color_switch_seconds(plan.stats["color_layers"], options["palette_macros"])
+            if budget > 0 and model.estimate_plan(plan, draw_delay, pause) + switch_seconds > budget:
+                fitted = drop_least_significant_strokes(plan, model, max(0.0, budget - switch_seconds), 0, pause)
+                note = f"丢弃 {plan.stroke_count - fitted.stroke_count} 条最短笔画"
+                return fitted, 0, model.estimate_plan(fitted, 0, pause) + switch_seconds, note
+            return plan, draw_delay, model.estimate_plan(plan, draw_delay, pause) + switch_seconds, ""
+        if budget > 0:
+            return fit_plan_to_budget(linework, key, plan_settings, budget, model, draw_delay, pause,
+                                      self.get_tone_image(key))
+        plan = find_cached_stroke_plan(key, plan_settings)
+        if plan is None: # 不等整张图规划完，边规划边绘制
+            stream = StrokeStream.from_linework(linework, plan_settings, self.get_tone_image(key))
+            return stream, draw_delay, None, ""
+        return plan, draw_delay, model.estimate_plan(plan, draw_delay, pause), ""
+
+    def start_drawing_action(self):
+        # F5：在后台准备笔画计划（按目标时长调整可能要多次编译整张图，彩色分层要做 k-means），
+        # 准备好后再在主线程显示确认框。键盘监听回调只负责转发，不在其中做耗时的工作
+        if drawing_busy() or self._prepare_token is not None:
+            print("绘画已在进行中。" if drawing_busy() else "正在准备笔画计划。")
+            return
+        if linework_edges is None and self.loaded_plan is None and self.get_color_settings() is None:
+            messagebox.showwarning("提示", "请先截取并生成线稿图像，或载入笔画计划。")
+            return
+        start_x, start_y = pyautogui.position()
+        plan_settings = self.get_plan_settings()
+        options = self.get_drawing_options()
+        token = CancellationToken()
+        self._prepare_token = token
+        self.update_status("正在准备笔画计划... 按 ESC 取消。")
+        threading.Thread(target=self._prepare_drawing_thread, args=(token, start_x, start_y, plan_settings, options),
+                         daemon=True).start()
+
+    def _prepare_drawing_thread(self, token, start_x, start_y, plan_settings, options):
+        try:
+            prepared = self.prepare_drawing_plan(plan_settings, options)
+        except Exception as e:
+            print(f"准备笔画计划失败: {e}")
+            self.root.after(0, lambda: messagebox.showerror("绘画错误", f"准备笔画计划失败: {e}"))
+            prepared = None
+        self.root.after(0, self._confirm_drawing, token, start_x, start_y, plan_settings, options, prepared)
+
+    def cancel_drawing_preparation(self):
+        # ESC：放弃正在准备的绘画，准备完成后不再弹出确认框。返回是否有正在准备的绘画
+        token = self._prepare_token
+        if token is None:
+            return False
+        token.cancel("ESC")
+        return True
+
+    def _confirm_drawing(self, token, start_x, start_y, plan_settings, options, prepared):
+        global drawing_active, drawing_thread, drawing_cancel_token
+        if self._prepare_token is token:
+            self._prepare_token = None
+        if prepared is None:
+            self.update_status("空闲。将鼠标移至绘画区域，按F5开始。")
+            return
+        plan, draw_delay_val, estimate, budget_note = prepared
+        if token.cancelled or drawing_busy():
+            if isinstance(plan, StrokeStream):
+                plan.abandon()
+            self.update_status("已取消。将鼠标移至绘画区域，按F5开始。")
+            return
+        if estimate is None: # 计划还没编译好，规划线程已在后台开始
+            plan_msg = f"笔画计划: {plan.describe()}。\n"
+        else:
+            plan_msg = f"笔画计划: {plan.describe()}，预计用时 {format_duration(estimate)}。\n"
+        if budget_note:
+            plan_msg += f"按目标时长调整: {budget_note}，笔画间延迟 {draw_delay_val:.0f}ms。\n"
+        if isinstance(plan, StrokePlan) and plan.stats.get("color_layers"):
+            plan_msg += describe_color_layers(plan.stats["color_layers"], options["palette_macros"]) + "\n"
+        msg = (f"将在当前鼠标位置 ({start_x}, {start_y}) 开始绘画。\n"
+               f"{plan_msg}"
+               "请确保目标窗口已准备好接收鼠标点击。\n"
+               "按 ESC 键中途停止。")
+
+        # 强制主窗口置顶，以确保弹窗在其之上且最前
+        # 保存主窗口原始的置顶状态
+        try:
+            original_topmost_status = self.root.attributes('-topmost')
+            self.root.attributes('-topmost', True)
+        except tk.TclError: # 如果根窗口被销毁或未完全初始化，可能会发生这种情况
+            original_topmost_status = False # 默认为 False
+
+        user_confirmed = messagebox.askokcancel("确认开始绘画", msg)
+
+        # 恢复主窗口原始的置顶状态
+        try:
+            self.root.attributes('-topmost', original_topmost_status)
+        except tk.TclError:
+            pass # 如果窗口不再存在，则忽略
+
+        if not user_confirmed or drawing_busy():
+            if isinstance(plan, StrokeStream):
+                plan.abandon()
+            self.update_status("空闲。将鼠标移至绘画区域，按F5开始。")
+            return
+        drawing_active = True
+        drawing_cancel_token = CancellationToken()
+        self.update_status(f"绘画中... 按 ESC 停止。")
+        drawing_thread = threading.Thread(target=drawing_task,
+                                          args=(options["linework"], start_x, start_y, draw_delay_val, plan_settings,
+                                                self.create_backend(), options["linework_key"], plan,
+                                                self.save_trace_var.get(), None, self.verify_var.get(),
+                                                drawing_cancel_token, options["palette_macros"]),
+                                          daemon=True)
+        drawing_thread.start()
+
+    def resume_drawing_action(self):
+        # F6：从上次中断的位置继续
+        global drawing_active, drawing_thread, drawing_cancel_token
+        if drawing_busy() or self._prepare_token is not None:
+            print("绘画已在进行中。")
+            return
+        checkpoint = drawing_checkpoint
+        if checkpoint is None:
+            messagebox.showinfo("提示", "没有可以继续的绘画。")
+            return
+        if checkpoint.plan is None: # 边规划边绘制中途停止，规划线程还没排完
+            messagebox.showinfo("提示", "笔画计划仍在后台规划，请稍后再按 F6 继续。")
+            return
+        remaining_strokes, remaining_points = checkpoint.remaining()
+        msg = (f"将从{checkpoint.describe()}继续绘画，\n"
+               f"起点仍为原来的 ({checkpoint.start_x}, {checkpoint.start_y})，"
+               f"剩余 {remaining_strokes} 条笔画 / {remaining_points} 个点。\n"
+               "请确保目标窗口和画布没有移动。按 ESC 键中途停止。")
+        if not messagebox.askokcancel("继续绘画", msg) or drawing_busy():
+            return
+        drawing_active = True
+        drawing_cancel_token = CancellationToken()
+        self.update_status("继续绘画中... 按 ESC 停止。")
+        drawing_thread = threading.Thread(target=drawing_task,
+                                          args=(None, checkpoint.start_x, checkpoint.start_y,
+                                                checkpoint.draw_delay, checkpoint.plan_settings, self.create_backend(),
+                                                None, checkpoint.plan, self.save_trace_var.get(), checkpoint,
+                                                self.verify_var.get(), drawing_cancel_token, self.palette_macros),
+                                          daemon=True)
+        drawing_thread.start()
+
+    def save_plan_action(self):
+        # 保存当前线稿按当前参数编译的笔画计划
+        if linework_edges is None and self.loaded_plan is None and self.get_color_settings() is None:
+            messagebox.showwarning("提示", "请先生成线稿或载入笔画计划。")
+            return
+        path = filedialog.asksaveasfilename(title="保存笔画计划", defaultextension=PLAN_FILE_EXTENSION,
+                                            filetypes=[("笔画计划", "*" + PLAN_FILE_EXTENSION)])
+        if not path:
+            return
+        self.update_status("正在保存笔画计划...")
+        threading.Thread(target=self._save_plan_thread, args=(path, self.get_plan_settings(), self.get_color_settings()),
+                         daemon=True).start()
+
+    def _save_plan_thread(self, path, plan_settings, color_settings=None):
+        try:
+            if self.loaded_plan is not None:
+                plan, metadata = self.loaded_plan, self.loaded_plan.metadata
+            elif color_settings is not None: # 分层信息保存在 stats 中，载入后仍按层换色
+                plan = get_color_plan(captured_pil_image, captured_image_hash, *color_settings, plan_settings)
+                metadata = {"source_hash": captured_image_hash, "colors": color_settings[0],
+                            "color_fill": color_settings[1], "plan_settings": plan_settings,
+                            "saved_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+            else:
+                plan = get_stroke_plan(linework_edges, linework_key, plan_settings, self.get_tone_image(linework_key))
+                metadata = {"source_hash": linework_key[0], "threshold1": linework_key[1],
+                            "threshold2": linework_key[2], "plan_settings": plan_settings,
+                            "saved_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+            save_stroke_plan(plan, path, metadata)
+            self.root.after(0, self.update_status, f"笔画计划已保存: {path}（{plan.describe()}）")
+        except Exception as e:
+            print(f"保存笔画计划失败: {e}")
+            self.root.after(0, lambda: messagebox.showerror("保存失败", f"保存笔画计划失败: {e}"))
+
+    def load_plan_action(self):
+        path = filedialog.askopenfilename(title="载入笔画计划",
+                                          filetypes=[("笔画计划", "*" + PLAN_FILE_EXTENSION), ("所有文件", "*.*")])
+        if not path:
+            return
+        try:
+            self.loaded_plan = load_stroke_plan(path)
+        except (OSError, ValueError, KeyError) as e:
+            messagebox.showerror("载入失败", f"无法载入笔画计划: {e}")
+            return
+        self.loaded_plan_name = os.path.basename(path)
+        self.display_image(self.loaded_plan.render(), self.linework_image_label, "笔画计划")
+        self.show_plan_stats(self.loaded_plan)
+        self.update_status(f"已载入笔画计划 {os.path.basename(path)}（{self.loaded_plan.describe()}）。"
+                           "将鼠标移至绘画区域，按F5开始绘画。")
+
+    def open_queue_window(self):
+        # 绘制队列窗口：为每个计划指定屏幕起点和缩放比例，确认一次后依次绘制全部任务
+        if self.queue_window is not None and self.queue_window.winfo_exists():
+            self.queue_window.lift()
+            return
+        window = Toplevel(self.root)
+        window.title("绘制队列")
+        window.transient(self.root)
+        self.queue_window = window
+
+        columns = ("name", "origin", "scale", "strokes", "estimate", "status")
+        headings = ("名称", "起点", "缩放", "笔画", "预计", "状态")
+        widths = (160, 90, 50, 110, 70, 180)
+        self.queue_tree = ttk.Treeview(window, columns=columns, show="headings", height=8, selectmode="browse")
+        for column, heading, width in zip(columns, headings, widths):
+            self.queue_tree.heading(column, text=heading)
+            self.queue_tree.column(column, width=width, anchor=tk.W)
+        self.queue_tree.grid(row=0, column=0, columnspan=6, padx=5, pady=5, sticky="nsew")
+        self.queue_tree.bind("<<TreeviewSelect>>", self._on_queue_select)
+        window.columnconfigure(5, weight=1)
+        window.rowconfigure(0, weight=1)
+
+        # 新任务（或选中任务）的放置位置
+        ttk.Label(window, text="起点 X:").grid(row=1, column=0, padx=5, pady=2, sticky="w")
+        self.queue_x_var = tk.StringVar(value="0")
+        ttk.Entry(window, textvariable=self.queue_x_var, width=7).grid(row=1, column=1, padx=5, pady=2, sticky="w")
+        ttk.Label(window, text="Y:").grid(row=1, column=2, padx=5, pady=2, sticky="w")
+        self.queue_y_var = tk.StringVar(value="0")
+        ttk.Entry(window, textvariable=self.queue_y_var, width=7).grid(row=1, column=3, padx=5, pady=2, sticky="w")
+        ttk.Label(window, text="缩放:").grid(row=1, column=4, padx=5, pady=2, sticky="w")
+        self.queue_scale_var = tk.StringVar(value="1.0")
+        ttk.Entry(window, textvariable=self.queue_scale_var, width=7).grid(row=1, column=5, padx=5, pady=2, sticky="w")
+
+        placement_frame = ttk.Frame(window)
+        placement_frame.grid(row=2, column=0, columnspan=6, padx=5, pady=2, sticky="ew")
+        ttk.Button(placement_frame, text="拾取起点", command=self._pick_queue_origin).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(placement_frame, text="应用到选中任务", command=self.queue_apply_placement).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(placement_frame, text="加入当前计划", command=self.queue_add_current).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(placement_frame, text="从文件添加...", command=self.queue_add_files).pack(side=tk.LEFT)
+
+        edit_frame = ttk.Frame(window)
+        edit_frame.grid(row=3, column=0, columnspan=6, padx=5, pady=2, sticky="ew")
+        ttk.Button(edit_frame, text="上移", command=lambda: self.queue_move(-1)).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(edit_frame, text="下移", command=lambda: self.queue_move(1)).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(edit_frame, text="移除", command=self.queue_remove).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(edit_frame, text="清除已完成", command=self.queue_clear_finished).pack(side=tk.LEFT)
+
+        run_frame = ttk.Frame(window)
+        run_frame.grid(row=4, column=0, columnspan=6, padx=5, pady=5, sticky="ew")
+        self.queue_start_button = ttk.Button(run_frame, text="开始/继续队列", command=self.start_queue_action)
+        self.queue_start_button.pack(side=tk.LEFT, padx=(0, 5))
+        self.queue_pause_button = ttk.Button(run_frame, text="暂停队列", command=self.pause_queue_action)
+        self.queue_pause_button.pack(side=tk.LEFT, padx=(0, 5))
+        self.queue_total_label = ttk.Label(run_frame, text="")
+        self.queue_total_label.pack(side=tk.LEFT)
+        self.refresh_queue_view()
+
+    def refresh_queue_view(self):
+        if self.queue_window is None or not self.queue_window.winfo_exists():
+            return
+        selected = self.queue_tree.selection()
+        self.queue_tree.delete(*self.queue_tree.get_children())
+        model = load_cost_model(self.get_backend_name())
+        pause = self.pyautogui_pause_scale.get()
+        for index, job in enumerate(self.draw_queue.jobs):
+            plan = job.scaled_plan()
+            self.queue_tree.insert("", tk.END, iid=str(index), values=(
+                job.name, f"({job.origin_x}, {job.origin_y})", f"{job.scale:g}",
+                f"{plan.stroke_count} 笔/{plan.point_count} 点",
+                format_duration(job.estimate(model, pause, self.palette_macros)), job.describe_progress()))
+        for iid in selected:
+            if self.queue_tree.exists(iid):
+                self.queue_tree.selection_set(iid)
+        pending = self.draw_queue.pending()
+        self.queue_total_label.config(text=f"共 {len(self.draw_queue.jobs)} 个任务，未完成 {len(pending)} 个，"
+                                           f"预计 {format_duration(self.draw_queue.estimate_total(model, pause, self.palette_macros))}")
+        running = self.draw_queue.running
+        self.queue_start_button.config(state=tk.DISABLED if running or not pending else tk.NORMAL)
+        self.queue_pause_button.config(state=tk.NORMAL if running else tk.DISABLED)
+
+    def _selected_queue_index(self):
+        selection = self.queue_tree.selection()
+        return int(selection[0]) if selection else None
+
+    def _on_queue_select(self, event=None):
+        index = self._selected_queue_index()
+        if index is None or index >= len(self.draw_queue.jobs):
+            return
+        job = self.draw_queue.jobs[index]
+        self.queue_x_var.set(str(job.origin_x))
+        self.queue_y_var.set(str(job.origin_y))
+        self.queue_scale_var.set(f"{job.scale:g}")
+
+    def get_queue_placement(self):
+        # 读取起点和缩放输入框，格式错误时提示并返回 None
+        try:
+            x, y, scale = int(self.queue_x_var.get()), int(self.queue_y_var.get()), float(self.queue_scale_var.get())
+        except ValueError:
+            messagebox.showerror("绘制队列", "起点必须是整数坐标，缩放必须是数字。", parent=self.queue_window)
+            return None
+        if not 0.05 <= scale <= 20:
+            messagebox.showerror("绘制队列", "缩放比例应在 0.05 到 20 之间。", parent=self.queue_window)
+            return None
+        return x, y, scale
+
+    def _pick_queue_origin(self):
+        self.update_status("3 秒后记录鼠标位置作为起点，请把鼠标移到目标画布上...")
+
+        def pick():
+            x, y = pyautogui.position()
+            self.queue_x_var.set(str(x))
+            self.queue_y_var.set(str(y))
+            self.update_status(f"已记录起点 ({x}, {y})。")
+        self.queue_window.after(3000, pick)
+
+    def queue_apply_placement(self):
+        index = self._selected_queue_index()
+        placement = self.get_queue_placement()
+        if index is None or placement is None:
+            return
+        try:
+            self.draw_queue.jobs[index].set_placement(*placement)
+        except ValueError as e:
+            messagebox.showwarning("绘制队列", str(e), parent=self.queue_window)
+        self.refresh_queue_view()
+
+    def queue_add_current(self):
+        # 把当前的计划（载入的计划、彩色分层计划或当前线稿的计划）加入队列；编译在后台进行
+        placement = self.get_queue_placement()
+        if placement is None:
+            return
+        color_settings = self.get_color_settings()
+        if linework_edges is None and self.loaded_plan is None and color_settings is None:
+            messagebox.showwarning("绘制队列", "请先生成线稿或载入笔画计划。", parent=self.queue_window)
+            return
+        self.update_status("正在准备加入队列的笔画计划...")
+        threading.Thread(target=self._queue_add_current_thread,
+                         args=(placement, self.get_plan_settings(), color_settings, self.draw_delay_scale.get()),
+                         daemon=True).start()
+
+    def _queue_add_current_thread(self, placement, plan_settings, color_settings, draw_delay):
+        try:
+            if self.loaded_plan is not None:
+                plan, name = self.loaded_plan, self.loaded_plan_name or "载入的计划"
+            elif color_settings is not None:
+                plan = get_color_plan(captured_pil_image, captured_image_hash, *color_settings, plan_settings)
+                name = f"彩色分层 {color_settings[0]} 色"
+            else:
+                plan = get_stroke_plan(linework_edges, linework_key, plan_settings, self.get_tone_image(linework_key))
+                name = "当前线稿"
+        except Exception as e:
+            print(f"准备队列任务失败: {e}")
+            self.root.after(0, self.update_status, f"准备队列任务失败: {e}")
+            return
+        self.root.after(0, self._queue_add_job, DrawJob(plan, *placement, name=name, draw_delay=draw_delay))
+
+    def _queue_add_job(self, job):
+        self.draw_queue.add(job)
+        self.refresh_queue_view()
+        self.update_status(f"已加入队列: {job.name}，起点 ({job.origin_x}, {job.origin_y})，缩放 {job.scale:g}。")
+
+    def queue_add_files(self):
+        placement = self.get_queue_placement()
+        if placement is None:
+            return
+        paths = filedialog.askopenfilenames(title="添加笔画计划到队列", parent=self.queue_window,
+                                            filetypes=[("笔画计划", "*" + PLAN_FILE_EXTENSION), ("所有文件", "*.*")])
+        for path in paths:
+            try:
+                plan = load_stroke_plan(path)
+            except (OSError, ValueError, KeyError) as e:
+                messagebox.showerror("载入失败", f"无法载入 {path}: {e}", parent=self.queue_window)
+                continue
+            self.draw_queue.add(DrawJob(plan, *placement, name=os.path.basename(path),
+                                        draw_delay=self.draw_delay_scale.get()))
+        self.refresh_queue_view()
+
+    def queue_move(self, delta):
+        index = self._selected_queue_index()
+        if index is None:
+            return
+        target = self.draw_queue.move(index, delta)
+        self.refresh_queue_view()
+        self.queue_tree.selection_set(str(target))
+
+    def queue_remove(self):
+        index = self._selected_queue_index()
+        if index is None:
+            return
+        try:
+            self.draw_queue.remove(index)
+        except ValueError as e:
+            messagebox.showwarning("绘制队列", str(e), parent=self.queue_window)
+        self.refresh_queue_view()
+
+    def queue_clear_finished(self):
+        if not self.draw_queue.running:
+            self.draw_queue.clear_finished()
+        self.refresh_queue_view()
+
+    def start_queue_action(self):
+        # 列出全部未完成任务和预计总用时，确认一次后依次绘制
+        global drawing_active, drawing_thread, drawing_cancel_token
+        if drawing_busy() or self.draw_queue.running or self._prepare_token is not None:
+            return
+        pending = self.draw_queue.pending()
+        if not pending:
+            return
+        model = load_cost_model(self.get_backend_name())
+        pause = self.pyautogui_pause_scale.get()
+        lines = [f"{i + 1}. {job.name} -> ({job.origin_x}, {job.origin_y}) ×{job.scale:g}，{job.describe_progress()}，"
+                 f"约 {format_duration(job.estimate(model, pause, self.palette_macros))}"
+                 for i, job in enumerate(pending[:10])]
+        if len(pending) > 10:
+            lines.append(f"……另有 {len(pending) - 10} 个任务")
+        msg = (f"将依次绘制 {len(pending)} 个任务，预计共 "
+               f"{format_duration(self.draw_queue.estimate_total(model, pause, self.palette_macros))}：\n"
+               + "\n".join(lines))
+        warnings = []
+        overlaps = self.draw_queue.overlaps()
+        if overlaps:
+            warnings.append("画布区域重叠的任务: " + "，".join(f"{i + 1} 与 {j + 1}" for i, j in overlaps[:5]))
+        screen_width, screen_height = pyautogui.size()
+        outside = [str(i + 1) for i, job in enumerate(self.draw_queue.jobs)
+                   if job in pending and (job.bounds()[2] > screen_width or job.bounds()[3] > screen_height)]
+        if outside:
+            warnings.append(f"超出屏幕范围的任务: {'，'.join(outside)}")
+        if warnings:
+            msg += "\n\n注意: " + "；".join(warnings)
+        msg += "\n\n开始后请不要操作鼠标。按 ESC 或“暂停队列”暂停，之后可从断点继续。"
+        if not messagebox.askokcancel("开始绘制队列", msg, parent=self.queue_window):
+            return
+        drawing_active = True
+        drawing_cancel_token = CancellationToken()
+        drawing_thread = threading.Thread(target=self._queue_thread,
+                                          args=(self.create_backend(), drawing_cancel_token), daemon=True)
+        drawing_thread.start()
+        self.refresh_queue_view()
+
+    def _queue_thread(self, backend, token):
+        global drawing_active, drawing_cancel_token
+        total = len(self.draw_queue.pending())
+        t0 = time.perf_counter()
+        self.root.after(0, self.update_status, "绘制队列中... 按 ESC 暂停。")
+
+        def on_progress(job, snapshot):
+            position = self.draw_queue.jobs.index(job) + 1 if job in self.draw_queue.jobs else "?"
+            self.root.after(0, self.update_status, f"队列任务 {position}（{job.name}）: {format_progress(snapshot)}")
+
+        try:
+            done, finished = self.draw_queue.run(backend, token, self.palette_macros,
+                                                 lambda job: self.root.after(0, self.refresh_queue_view), on_progress)
+            elapsed = format_duration(time.perf_counter() - t0)
+            if finished:
+                message = f"绘制队列已完成：{done} 个任务，用时 {elapsed}。"
+            else:
+                message = f"绘制队列已暂停：本次完成 {done}/{total} 个任务，用时 {elapsed}。点击“开始/继续队列”从断点继续。"
+            print(message)
+            self.root.after(0, self.update_status, message)
+            if finished:
+                show_message("info", "绘制队列", message + ("\n" + backend.summary() if backend.summary() else ""))
+        except Exception as e:
+            print(f"绘制队列出错: {e}")
+            show_message("error", "绘制队列错误", f"绘制队列出错: {e}")
+        finally:
+            drawing_active = False
+            if drawing_cancel_token is token:
+                drawing_cancel_token = None
+            self.root.after(0, self.refresh_queue_view)
+
+    def pause_queue_action(self):
+        # 与 ESC 相同：当前拖动点画完后抬笔，任务记下断点
+        if self.draw_queue.running:
+            stop_drawing("暂停")
+
+    def calibrate_cost_model_action(self):
+        # 用当前输出后端实测绘制速度，保存为本机的耗时模型
+        if drawing_busy():
+            return
+        if not messagebox.askokcancel("校准耗时模型",
+                                      "将在 3 秒后于鼠标当前位置绘制约 200x200 像素的测试图案。\n"
+                                      "请先把鼠标移到目标软件的空白画布上。"):
+            return
+        self.update_status("3 秒后开始校准，请把鼠标移到空白画布上...")
+        self.root.after(3000, lambda: threading.Thread(target=self._calibrate_thread, daemon=True).start())
+
+    def _calibrate_thread(self):
+        try:
+            start_x, start_y = pyautogui.position()
+            model = calibrate_cost_model(self.create_backend(), start_x, start_y, should_continue=lambda: app_running)
+            save_cost_model(model)
+            msg = (f"后端 {model.backend}: 每点 {model.per_point * 1000:.3f}ms，每笔 {model.per_stroke * 1000:.2f}ms，"
+                   f"抬笔每像素 {model.per_pen_up_px * 1000:.4f}ms")
+            print(f"耗时模型校准完成: {msg}")
+            self.root.after(0, self.update_status, f"校准完成。{msg}")
+        except Exception as e:
+            print(f"校准失败: {e}")
+            self.root.after(0, self.update_status, f"校准失败: {e}")
+
+    def start_mirror_action(self):
+        # 实时跟随：反复截取上次截图的区域，只把新出现的线条画到鼠标所在位置
+        if drawing_busy() or captured_bbox is None:
+            return
+        if not messagebox.askokcancel("实时跟随模式",
+                                      "将每隔约半秒重新截取上次选择的区域，只绘制新出现的线条。\n"
+                                      "点击确定后 3 秒内把鼠标移到目标画布的起点；按 ESC 停止。\n"
+                                      "画布不能与截图区域重叠。"):
+            return
+        self.update_status("3 秒后开始实时跟随，请把鼠标移到画布起点...")
+        self.root.after(3000, self._start_mirror)
+
+    def _start_mirror(self):
+        global drawing_active, drawing_thread, drawing_cancel_token
+        if drawing_busy():
+            return
+        start_x, start_y = pyautogui.position()
+        x1, y1, x2, y2 = captured_bbox
+        width, height = x2 - x1, y2 - y1
+        if start_x < x2 and start_x + width > x1 and start_y < y2 and start_y + height > y1:
+            messagebox.showwarning("实时跟随模式", "画布区域与截图区域重叠，画上的线条会被再次截取。请换一个位置。")
+            self.update_status("已取消实时跟随。")
+            return
+        session = MirrorSession(captured_bbox, self.canny_thresh1_scale.get(), self.canny_thresh2_scale.get(),
+                                self.get_plan_settings())
+        drawing_active = True
+        drawing_cancel_token = CancellationToken()
+        drawing_thread = threading.Thread(target=self._mirror_thread,
+                                          args=(session, self.create_backend(), start_x, start_y, drawing_cancel_token),
+                                          daemon=True)
+        drawing_thread.start()
+
+    def _mirror_thread(self, session, backend, start_x, start_y, token):
+        global drawing_active
+        try:
+            backend.begin() # 出错时同样要复位 drawing_active，否则 F5 会一直提示“正在绘制”
+            while token() and app_running:
+                t0 = time.perf_counter()
+                plan, dirty = session.step()
+                if plan.stroke_count:
+                    execute_strokes(plan, backend, start_x, start_y, 0, token)
+                self.root.after(0, self.update_status,
+                                f"实时跟随中... 第 {session.frame_count} 帧，变化 {dirty} 块，新笔画 {plan.stroke_count}，"
+                                f"累计 {session.stroke_total} 条。按 ESC 停止。")
+                token.wait(max(0.0, MIRROR_INTERVAL - (time.perf_counter() - t0)))
+        except Exception as e:
+            print(f"实时跟随出错: {e}")
+            self.root.after(0, lambda: messagebox.showerror("实时跟随错误", f"实时跟随出错: {e}"))
+        finally:
+            drawing_active = False
+            try:
+                backend.end()
+            except Exception as e:
+                print(f"结束绘画后端时出错: {e}")
+            self.root.after(0, self.update_status, f"实时跟随已停止，共绘制 {session.stroke_total} 条笔画。")
+
+    def get_plan_settings(self):
+        # 读取影响笔画计划的界面参数；与当前简化方式无关的参数取默认值，以提高缓存命中率
+        mode = SIMPLIFY_MODES.get(self.simplify_mode_var.get(), "skip")
+        hatch_levels = int(round(self.hatch_levels_scale.get()))
+        return {
+            "simplify_mode": mode,
+            "pixel_skip": max(1, int(self.pixel_skip_scale.get())) if mode == "skip" else 1,
+            "simplify_tolerance": round(self.simplify_tolerance_scale.get(), 1) if mode == "tolerance" else 1.0,
+            "optimize_order": bool(self.optimize_order_var.get()),
+            "trace_mode": TRACE_MODES.get(self.trace_mode_var.get(), "contour"),
+            "hatch_levels": hatch_levels,
+            "hatch_spacing": max(2, int(self.hatch_spacing_scale.get())) if hatch_levels else 6,
+            "hatch_angle": int(self.hatch_angle_scale.get()) if hatch_levels else 45,
+            "speck_size": int(round(self.speck_size_scale.get())),
+            "join_gap": int(round(self.join_gap_scale.get())),
+        }
+
+    def get_color_settings(self):
+        # 彩色分层模式下返回 (颜色数, 是否填充)，否则返回 None
+        if not self.color_mode_var.get() or captured_pil_image is None:
+            return None
+        try:
+            k = min(8, max(2, int(self.color_count_var.get())))
+        except (tk.TclError, ValueError):
+            k = 4
+        return k, bool(self.color_fill_var.get())
+
+    def schedule_color_compile(self):
+        # 彩色分层参数变化后延迟在后台编译分层计划，并把按层着色的预览显示在线稿预览区
+        if self._color_compile_job is not None:
+            self.root.after_cancel(self._color_compile_job)
+            self._color_compile_job = None
+        if self.get_color_settings() is None:
+            if linework_edges is not None:
+                self.display_image(linework_edges, self.linework_image_label, "线稿", invert=self.invert_var.get())
+            return
+        self._color_compile_job = self.root.after(300, self._start_color_compile)
+
+    def _start_color_compile(self):
+        self._color_compile_job = None
+        color_settings = self.get_color_settings()
+        if color_settings is None:
+            return
+        self.update_status("正在编译彩色分层计划...")
+        threading.Thread(target=self._compile_color_thread,
+                         args=(captured_pil_image, captured_image_hash, color_settings, self.get_plan_settings()),
+                         daemon=True).start()
+
+    def _compile_color_thread(self, image, image_hash, color_settings, settings):
+        try:
+            plan = get_color_plan(image, image_hash, *color_settings, settings)
+        except Exception as e:
+            print(f"编译彩色分层计划失败: {e}")
+            plan = None
+        self.root.after(0, self._update_gui_after_color_compile, image_hash, color_settings, plan)
+
+    def _update_gui_after_color_compile(self, image_hash, color_settings, plan):
+        if plan is None or image_hash != captured_image_hash or color_settings != self.get_color_settings():
+            return # 截图或参数已经改变，结果已过期
+        self.display_image(plan.render(), self.linework_image_label, "彩色分层")
+        self.show_plan_stats(plan)
+        self.update_status(f"彩色分层计划已就绪: {plan.describe()}。"
+                           + describe_color_layers(plan.stats["color_layers"], self.palette_macros).replace("\n", " "))
+
+    def edit_palette_action(self):
+        # 为每个颜色槽位设置换色宏：一个或多个依次点击的屏幕坐标（如先打开颜色面板再点颜色）
+        color_settings = self.get_color_settings()
+        k = color_settings[0] if color_settings else max(4, len(self.palette_macros))
+        swatches = {}
+        if color_settings is not None:
+            plan = find_cached_stroke_plan((captured_image_hash, "color", *color_settings), self.get_plan_settings())
+            if plan is not None:
+                swatches = {layer["palette_slot"]: layer["color"] for layer in plan.stats["color_layers"]}
+        window = Toplevel(self.root)
+        window.title("调色板换色宏")
+        window.transient(self.root)
+        ttk.Label(window, text="颜色按从暗到亮排列。每格填写依次点击的屏幕坐标，如 “1200,80” 或 “40,300; 1200,80”。\n"
+                               "点击“拾取”后 3 秒内把鼠标移到目标软件的颜色上，将追加该位置。留空表示不换色。",
+                  justify=tk.LEFT).grid(row=0, column=0, columnspan=4, padx=5, pady=5, sticky="w")
+        entries = []
+        for slot in range(k):
+            ttk.Label(window, text=f"颜色 {slot + 1}").grid(row=slot + 1, column=0, padx=5, pady=2, sticky="w")
+            swatch = tk.Label(window, width=3, relief=tk.SOLID, borderwidth=1)
+            if slot in swatches:
+                swatch.config(bg="#%02x%02x%02x" % tuple(swatches[slot]))
+            swatch.grid(row=slot + 1, column=1, padx=5, pady=2)
+            var = tk.StringVar(value=format_palette_macro(self.palette_macros[slot]) if slot < len(self.palette_macros) else "")
+            ttk.Entry(window, textvariable=var, width=30).grid(row=slot + 1, column=2, padx=5, pady=2)
+            ttk.Button(window, text="拾取", command=lambda v=var: self._pick_palette_position(window, v)).grid(
+                row=slot + 1, column=3, padx=5, pady=2)
+            entries.append(var)
+
+        def save():
+            try:
+                macros = [parse_palette_macro(var.get()) for var in entries]
+            except ValueError:
+                messagebox.showerror("调色板", "坐标格式应为 “x,y”，多个位置用分号分隔。", parent=window)
+                return
+            macros += self.palette_macros[len(macros):] # 保留超出当前颜色数的槽位
+            self.palette_macros = macros
+            try:
+                save_palette_macros(macros)
+            except OSError as e:
+                messagebox.showerror("调色板", f"保存失败: {e}", parent=window)
+                return
+            window.destroy()
+            self.update_status(f"调色板换色宏已保存到 {PALETTE_PATH}。")
+
+        ttk.Button(window, text="保存", command=save).grid(row=k + 1, column=2, columnspan=2, padx=5, pady=5, sticky="e")
+
+    def _pick_palette_position(self, window, var):
+        self.update_status("3 秒后记录鼠标位置，请把鼠标移到目标软件的颜色上...")
+
+        def pick():
+            x, y = pyautogui.position()
+            var.set("; ".join(part for part in (var.get().strip(), f"{x},{y}") if part))
+            self.update_status(f"已记录位置 ({x}, {y})。")
+        window.after(3000, pick)
+
+    def get_tone_image(self, key):
+        # 排线填充使用的灰度图：与线稿来自同一张截图的模糊灰度图（调整阈值时复用，不重复计算）
+        if key is None or captured_pil_image is None or key[0] != captured_image_hash:
+            return None
+        source = self.get_linework_source(captured_pil_image, captured_image_hash)
+        return source[1] if source else None
+
+    def schedule_plan_compile(self):
+        # 绘画参数变化后稍等片刻再在后台编译笔画计划，避免拖动滑块时重复计算
+        if self.get_color_settings() is not None:
+            self.schedule_color_compile()
+            return
+        if linework_edges is None:
+            return
+        if self._plan_compile_job is not None:
+            self.root.after_cancel(self._plan_compile_job)
+        self._plan_compile_job = self.root.after(300, self._start_plan_compile)
+
+    def _start_plan_compile(self):
+        self._plan_compile_job = None
+        if linework_edges is None:
+            return
+        settings = self.get_plan_settings()
+        cached_plan = find_cached_stroke_plan(linework_key, settings)
+        if cached_plan is not None:
+            self.show_plan_stats(cached_plan)
+            threading.Thread(target=self._compile_trace_comparison,
+                             args=(linework_edges, linework_key, settings, cached_plan), daemon=True).start()
+            return
+        self.update_status("正在编译笔画计划...")
+        threading.Thread(target=self._compile_plan_thread, args=(linework_edges, linework_key, settings), daemon=True).start()
+
+    def _compile_plan_thread(self, linework_image, key, settings):
+        try:
+            plan = get_stroke_plan(linework_image, key, settings, self.get_tone_image(key))
+        except Exception as e:
+            print(f"编译笔画计划失败: {e}")
+            plan = None
+        self.root.after(0, self._update_gui_after_plan_compile, key, plan)
+        self._compile_trace_comparison(linework_image, key, settings, plan)
+
+    def _compile_trace_comparison(self, linework_image, key, settings, plan):
+        # 在后台再编译另一种提取方式的计划，用于并排比较笔画数和点数（结果同样进入缓存）
+        if plan is None:
+            return
+        other_mode = "centerline" if settings.get("trace_mode") == "contour" else "contour"
+        try:
+            other = get_stroke_plan(linework_image, key, dict(settings, trace_mode=other_mode), self.get_tone_image(key))
+        except Exception as e:
+            print(f"编译对比笔画计划失败: {e}")
+            return
+        plans = {settings.get("trace_mode"): plan, other_mode: other}
+        self.root.after(0, self._show_trace_comparison, key, plans)
+
+    def _show_trace_comparison(self, key, plans):
+        if key != linework_key:
+            return
+        names = {mode: name for name, mode in TRACE_MODES.items()}
+        self.trace_compare_label.config(text=" | ".join(
+            f"{names[mode]}: {plans[mode].stroke_count}笔/{plans[mode].point_count}点" for mode in ("contour", "centerline")))
+
+    def _update_gui_after_plan_compile(self, key, plan):
+        if plan is None or key != linework_key: # 线稿已经更新，结果已过期
+            return
+        self.show_plan_stats(plan)
+        self.update_status(f"笔画计划已就绪: {plan.describe()}。将鼠标移至绘画区域，按F5开始绘画。")
+
+    def show_plan_stats(self, plan):
+        self.update_point_stats(plan.stats.get("points_before", plan.point_count), plan.point_count,
+                                describe_cleanup(plan.stats))
+
 
     def select_capture_area(self):
-        global captured_pil_image, linework_pil_image
+        global captured_pil_image, linework_edges
         self.update_status("进入截图模式... 请拖动鼠标选择区域。")
         # 截图时隐藏主窗口
         self.root.withdraw() 
@@ -451,17 +4240,26 @@ class AutoDrawerApp:
     def _create_selector(self):
         self.selector = ScreenshotSelector(self.root, self.on_screenshot_complete)
 
-    def on_screenshot_complete(self, image):
-        global captured_pil_image, linework_pil_image
+    def on_screenshot_complete(self, image, gray=None):
+        global captured_pil_image, captured_image_hash, linework_edges, linework_key
         self.root.deiconify() # 重新显示主窗口
         self.selector = None # 清除选择器实例
 
         if image:
             captured_pil_image = image
-            linework_pil_image = None # 清除旧的线稿
+            # 在模糊（原地修改灰度数组）之前计算哈希
+            captured_image_hash = image_digest(gray if gray is not None else image)
+            self._captured_gray = (captured_image_hash, gray) if gray is not None else None
+            linework_edges = None # 清除旧的线稿
+            self.loaded_plan = None
+            linework_key = None
             self.display_image(captured_pil_image, self.original_image_label, "原始截图")
             self.display_image(None, self.linework_image_label, "线稿预览") # 清除线稿预览
             self.process_button.config(state=tk.NORMAL) # 启用处理按钮
+            self.mirror_button.config(state=tk.NORMAL if captured_bbox else tk.DISABLED)
+            # 提前在后台完成灰度化和模糊，拖动阈值滑块时即可立即预览
+            threading.Thread(target=self.get_linework_source, args=(image, captured_image_hash), daemon=True).start()
+            self.schedule_color_compile()
             self.update_status("截图完成。点击“生成线稿”进行处理。")
         else:
             self.update_status("截图已取消或失败。")
@@ -471,68 +4269,201 @@ class AutoDrawerApp:
 
 
     def process_image_button_action(self):
-        global linework_pil_image, captured_pil_image
+        global linework_edges, captured_pil_image
         if captured_pil_image:
             self.update_status("正在生成线稿...")
             canny1 = self.canny_thresh1_scale.get()
             canny2 = self.canny_thresh2_scale.get()
-            invert = self.invert_var.get()
+            key = (captured_image_hash, round(canny1), round(canny2))
+            plan_settings = self.get_plan_settings()
+            self._cancel_live_preview()
+            self._linework_generation += 1
+            self.loaded_plan = None
             
             # 在单独的线程中运行图像处理以避免 GUI 冻结
-            thread = threading.Thread(target=self._process_image_thread, args=(captured_pil_image, canny1, canny2, invert), daemon=True)
+            thread = threading.Thread(target=self._process_image_thread,
+                                      args=(captured_pil_image, canny1, canny2, key, plan_settings,
+                                            self._linework_generation, self.tiled_var.get()), daemon=True)
             thread.start()
         else:
             messagebox.showwarning("提示", "请先截取一张图片。")
             self.update_status("空闲。请先截图。")
 
-    def _process_image_thread(self, image_to_process, c1, c2, inv):
-        global linework_pil_image
-        processed_image = convert_to_linework(image_to_process, c1, c2, inv)
+    def _process_image_thread(self, image_to_process, c1, c2, key, plan_settings, generation, tiled=False):
+        global linework_edges
+        t0 = time.perf_counter()
+        source = self.get_linework_source(image_to_process, key[0])
+        processed_image = convert_to_linework(image_to_process, c1, c2, source[1] if source else None, tiled)
+        record_stage("linework", t0, time.perf_counter(), threshold1=c1, threshold2=c2, tiled=bool(tiled))
+        if generation != self._linework_generation:
+            return # 已经有更新的请求，丢弃本次结果
+        plan = None
+        if processed_image is not None:
+            # 生成线稿的同时编译笔画计划，按 F5 时即可直接开始绘制
+            try:
+                plan = get_stroke_plan(processed_image, key, plan_settings, source[1] if source else None)
+            except Exception as e:
+                print(f"编译笔画计划失败: {e}")
         
         # 确保在主线程中更新 GUI
-        self.root.after(0, self._update_gui_after_processing, processed_image)
-
-    def _update_gui_after_processing(self, processed_image):
-        global linework_pil_image
-        if processed_image:
-            linework_pil_image = processed_image
-            self.display_image(linework_pil_image, self.linework_image_label, "线稿")
-            self.update_status("线稿生成成功。将鼠标移至绘画区域，按F5开始绘画。")
+        self.root.after(0, self._update_gui_after_processing, processed_image, key, plan, generation)
+        if plan is not None and generation == self._linework_generation:
+            self._compile_trace_comparison(processed_image, key, plan_settings, plan)
+
+    def _update_gui_after_processing(self, processed_image, key=None, plan=None, generation=None):
+        global linework_edges, linework_key
+        if generation is not None and generation != self._linework_generation:
+            return
+        if processed_image is not None:
+            linework_edges = processed_image
+            linework_key = key
+            self.display_image(linework_edges, self.linework_image_label, "线稿", invert=self.invert_var.get())
+            if plan is not None:
+                self.show_plan_stats(plan)
+                self.update_status(f"线稿生成成功，{plan.describe()}。将鼠标移至绘画区域，按F5开始绘画。")
+                self.schedule_plan_compile() # 处理期间绘画参数可能已改变
+            else:
+                self.update_status("线稿生成成功。将鼠标移至绘画区域，按F5开始绘画。")
         else:
             self.update_status("线稿生成失败。请检查参数或图像。")
             self.display_image(None, self.linework_image_label, "线稿预览") # 清除预览
 
 
-    def on_invert_toggle(self):
-        # 当反转复选框状态改变时，如果已有截图，则重新处理线稿
-        if captured_pil_image:
+    def get_linework_source(self, image, image_hash):
+        # 每张截图只做一次灰度化和模糊，之后调整阈值时直接复用。
+        # 截图时已经转换好的灰度数组直接原地模糊，不再从 PIL 图像重新转换
+        with self._linework_source_lock:
+            if self._linework_source is None or self._linework_source[0] != image_hash:
+                gray = self._captured_gray[1] if self._captured_gray and self._captured_gray[0] == image_hash else None
+                try:
+                    blurred = prepare_linework_source(image, gray)
+                except Exception as e:
+                    print(f"图像预处理失败: {e}")
+                    return None
+                self._captured_gray = None # 已被原地模糊，不再是原始灰度
+                self._linework_source = (image_hash, blurred, make_preview_proxy(blurred))
+            return self._linework_source
+
+    def schedule_live_preview(self):
+        # 拖动阈值滑块时防抖：停顿 80ms 后才在缩小图上计算一次预览
+        if captured_pil_image is None:
+            return
+        self._cancel_live_preview()
+        self._live_preview_job = self.root.after(80, self._start_live_preview)
+
+    def _cancel_live_preview(self):
+        if self._live_preview_job is not None:
+            self.root.after_cancel(self._live_preview_job)
+            self._live_preview_job = None
+
+    def _start_live_preview(self):
+        self._live_preview_job = None
+        self._linework_generation += 1 # 使仍在计算中的旧预览失效
+        args = (captured_pil_image, captured_image_hash, self.canny_thresh1_scale.get(), self.canny_thresh2_scale.get(),
+                self._linework_generation)
+        threading.Thread(target=self._live_preview_thread, args=args, daemon=True).start()
+
+    def _live_preview_thread(self, image, image_hash, c1, c2, generation):
+        source = self.get_linework_source(image, image_hash)
+        if source is None or generation != self._linework_generation:
+            return
+        index = self._preview_buffer_index = self._preview_buffer_index ^ 1
+        buffer = self._preview_buffers[index]
+        if buffer is None or buffer.shape != source[2].shape:
+            buffer = self._preview_buffers[index] = np.empty_like(source[2])
+        # 每次包装成新的 PIL 图像（共享缓冲区内存），预览缓存据此识别内容已更新
+        preview = linework_to_pil(linework_from_blurred(source[2], c1, c2, out=buffer))
+        self.root.after(0, self._show_live_preview, preview, generation)
+
+    def _show_live_preview(self, preview, generation):
+        if generation != self._linework_generation:
+            return
+        self.display_image(preview, self.linework_image_label, "线稿", interactive=True, invert=self.invert_var.get())
+        self.update_status("实时预览（缩小图）。松开滑块后生成全分辨率线稿。")
+
+    def on_threshold_released(self, event=None):
+        # 松开滑块后生成全分辨率线稿（同时编译笔画计划）
+        if captured_pil_image is not None:
             self.process_image_button_action()
 
+    def on_backend_selected(self, event=None):
+        # 选择导出 SVG 时询问保存路径
+        if BACKEND_DISPLAY_NAMES.get(self.backend_var.get()) == "svg":
+            path = filedialog.asksaveasfilename(title="导出 SVG", defaultextension=".svg",
+                                                initialfile=os.path.basename(self.svg_output_path),
+                                                filetypes=[("SVG 文件", "*.svg")])
+            if path:
+                self.svg_output_path = path
+
+    def create_backend(self):
+        # 根据界面设置创建绘画输出后端
+        name = self.get_backend_name()
+        if name == "pyautogui":
+            return create_drawing_backend(name, pause=self.pyautogui_pause_scale.get())
+        if name == "xtest":
+            return create_drawing_backend(name, max_events_per_second=int(self.max_event_rate_scale.get()),
+                                          pause=self.pyautogui_pause_scale.get())
+        if name == "svg":
+            return create_drawing_backend(name, path=self.svg_output_path)
+        return create_drawing_backend(name)
+
+    def on_invert_toggle(self):
+        # 反转只影响线稿的显示，笔画计划不变：直接用当前线稿重绘预览，不重新处理
+        cache = self.get_preview_cache(self.linework_image_label)
+        if cache.source is not None:
+            self.display_image(cache.source, self.linework_image_label,
+                               getattr(self.linework_image_label, "image_type_str", "线稿"), invert=self.invert_var.get())
+
+
+    def get_preview_cache(self, label_widget):
+        cache = getattr(label_widget, "preview_cache", None)
+        if cache is None:
+            cache = label_widget.preview_cache = PreviewCache()
+            label_widget.bind("<Configure>", lambda e: self.on_preview_resize(label_widget))
+        return cache
 
-    def display_image(self, pil_image, label_widget, image_type_str):
-        if pil_image:
+    def on_preview_resize(self, label_widget):
+        # 只在标签尺寸变化时重绘当前图像（尺寸未变时 render 直接返回）
+        cache = self.get_preview_cache(label_widget)
+        if cache.resize_job is not None:
+            label_widget.after_cancel(cache.resize_job)
+        def rerender():
+            cache.resize_job = None
+            if cache.source is not None:
+                self.display_image(cache.source, label_widget, getattr(label_widget, "image_type_str", "图像"),
+                                   invert=getattr(label_widget, "preview_invert", False))
+        cache.resize_job = label_widget.after(PREVIEW_RESIZE_DELAY_MS, rerender)
+
+    def display_image(self, pil_image, label_widget, image_type_str, interactive=False, invert=False):
+        # interactive=True 用于拖动滑块时的快速预览，使用较快的插值；pil_image 也可以是线稿数组，
+        # invert=True 时反转显示（只作用于缩放后的预览图）
+        cache = self.get_preview_cache(label_widget)
+        label_widget.image_type_str = image_type_str
+        label_widget.preview_invert = invert
+        if pil_image is not None:
             # 调整图像大小以适应标签，同时保持纵横比
             label_width = label_widget.winfo_width()
             label_height = label_widget.winfo_height()
 
             if label_width < 2 or label_height < 2: # 标签可能尚未完全渲染
                 # 延迟一点再尝试，给标签时间来获取其尺寸
-                label_widget.after(50, lambda: self.display_image(pil_image, label_widget, image_type_str))
+                label_widget.after(50, lambda: self.display_image(pil_image, label_widget, image_type_str, interactive, invert))
                 return
 
-            img_copy = pil_image.copy()
-            img_copy.thumbnail((label_width - 10, label_height - 10), Image.Resampling.LANCZOS) # 减去一些填充
-            
             try:
-                photo = ImageTk.PhotoImage(image=img_copy)
-                label_widget.config(image=photo, text="") # 清除占位符文本
-                label_widget.image = photo # 保持对图像的引用，防止被垃圾回收
+                cache.set_source(pil_image)
+                photo = cache.render(label_width - 10, label_height - 10, interactive, invert) # 减去一些填充
+                if getattr(label_widget, "image", None) is not photo:
+                    label_widget.config(image=photo, text="") # 清除占位符文本
+                    label_widget.image = photo # 保持对图像的引用，防止被垃圾回收
             except Exception as e:
                 print(f"显示 {image_type_str} 时出错: {e}")
-                label_widget.config(text=f"{image_type_str} 显示错误")
+                cache.clear()
+                label_widget.config(image="", text=f"{image_type_str} 显示错误")
                 label_widget.image = None
         else:
-            label_widget.config(image=None, text=f"无{image_type_str}")
+            cache.clear()
+            label_widget.config(image="", text=f"无{image_type_str}")
             label_widget.image = None # 清除引用
 
     def show_help(self):
@@ -546,34 +4477,84 @@ class AutoDrawerApp:
            - 松开鼠标完成截图，或按 ESC 键取消。
         2. 调整 "线稿参数" (可选):
            - 阈值1 & 阈值2: 控制边缘检测的敏感度。较低的值会检测更多细节。
-           - 反转颜色: 如果原始图片是深色背景浅色线条，勾选此项。默认处理浅色背景深色线条。
+             拖动滑块时会在缩小图上实时预览，松开滑块后自动生成全分辨率线稿。
+           - 反转颜色: 以黑线白底显示线稿预览。只影响显示，切换时不会重新生成线稿或笔画计划。
+           - 大图分块并行处理: 截图很大时（如多显示器）分块多线程生成线稿，结果与整图处理一致。
+           - 提取方式: "轮廓" 沿每条细线的两侧边界各画一遍；"中心线" 先把线稿细化为单像素骨架，
+             每条线只画一次，通常能减少约一半的绘制时间。下方会并排显示两种方式的笔画数和点数。
+           - 排线层数/间距/角度: 层数大于 0 时，把截图的暗部按灰度分成几层，用平行直线（排线）填充，
+             越暗的地方叠加越多不同角度的排线。每条排线只有起点和终点，绘制很快；实时跟随模式不画排线。
+           - 去除杂点/连接断线: 去掉尺寸小于设定像素的噪点，并把端点相距不超过设定像素的断线连成一笔，
+             照片类截图的笔画数和抬笔次数会明显减少。设为 0 关闭。清理结果显示在点数统计下方。
         3. 点击 "2. 生成线稿" 按钮。
            - 程序会根据参数将截图转换为黑白线稿。
            - 线稿会显示在右侧的 "线稿预览" 区域。
+           - "保存笔画计划" 把当前线稿的笔画保存为 .adplan 文件；之后 "载入笔画计划" 再按 F5 即可
+             直接绘制该文件，无需重新截图和生成线稿。
         4. 调整 "绘画参数" (可选):
            - 绘制延迟: 每条轮廓绘制完成后的等待时间 (毫秒)。设为0以最快速度绘制。
            - 像素跳跃: 绘制时跳过的像素点数。值越大，绘制越快但越粗糙。
+           - 简化方式: "像素跳跃" 按固定间隔取点；"误差容限" 删除直线段上的冗余点并保留弯道，
+             简化后的线条与原始轮廓的偏差不超过 "最大偏差" 像素。开始绘画后会显示简化前后的点数。
+           - 输出方式: "鼠标模拟" 为真实绘画；"记录事件"、"导出 SVG" 和 "空输出" 不移动鼠标，
+             可用于测试速度或把笔画交给其他软件。
+           - 高速注入 (XTest): 仅 Linux (X11)，需要 python-xlib。整条笔画批量发送鼠标事件，
+             速度受 "事件/秒上限" 限制；不可用时自动回退到鼠标模拟。
+           - 优化笔画顺序: 从鼠标当前位置出发，按就近原则重新排列笔画（必要时反向绘制），
+             减少笔画之间的空走距离。
+           - 目标时长: 大于 0 时，程序根据耗时模型自动选择简化程度、丢弃最短的笔画并调整延迟，
+             使预计用时不超过该值。点击 "校准" 可在目标软件中实测本机速度，使预计更准确。
+           - 保存运行跟踪: 绘画结束后把各阶段耗时和每条笔画的时间写入 ~/.auto_drawer/traces，
+             可在 chrome://tracing 或 Perfetto 中打开分析。绘画时状态栏实时显示进度、点/秒和剩余时间。
         5. 准备绘画:
            - 将鼠标指针移动到您希望开始绘画的目标应用程序窗口的画布区域。
         6. 开始绘画:
            - 按下键盘上的 F5 键。
-           - 会有一个确认对话框，点击 "确定" 开始。
+           - 会有一个确认对话框，点击 "确定" 开始。设置了目标时长或使用彩色分层时，
+             程序先在后台准备笔画计划，准备好后才显示确认框；准备期间可按 ESC 取消。
+           - 如果笔画计划还没编译好，按下 F5 时就在后台开始规划，确认后立即绘制已排好的笔画，
+             其余笔画边规划边绘制（此时只做就近排序，不做耗时的整体顺序优化）。
         7. 停止绘画:
-           - 在绘画过程中，随时可以按下键盘上的 ESC 键来停止。
+           - 在绘画过程中，随时可以按下键盘上的 ESC 键来停止；当前拖动点画完后即抬笔。
+             完成或停止的提示中会显示首笔延迟（确认到第一笔落下）和停止延迟（按下 ESC 到鼠标停下）。
+           - 停止（或出错中断）后按 F6，可在原来的起点从中断的笔画和点继续画完，
+             不必从头重画。请不要移动目标窗口和画布；按 F5 则放弃进度重新开始。
+        8. 实时跟随模式 (可选):
+           - 截图后点击 "实时跟随模式"，在 3 秒内把鼠标移到画布起点。程序每隔约半秒重新截取同一区域，
+             只在画面有变化的小块内重新提取线稿，并只绘制尚未画过的新线条。按 ESC 停止。
+             画布不能与截图区域重叠；源区域中被擦掉的线条不会从画布上擦除。
+        9. 绘制后校验 (可选):
+           - 勾选 "绘制后校验并补画缺失笔画" 后，开始前会截取一次画布，画完后再截图比对，
+             找出因目标软件来不及处理而丢失的笔画并只补画这些部分（最多两轮）。
+             这样可以把 "PyAutoGUI 暂停" 设为 0 以最快速度绘制，只为少量丢失的部分付出代价。
+             仅对 "鼠标模拟" 和 "高速注入" 有效；校验期间请不要遮挡画布。
+        10. 彩色分层模式 (可选):
+           - 截图后勾选 "彩色分层模式"，程序把截图量化为 "颜色数" 种颜色，按从暗到亮分层，
+             每层画出色块的边界（勾选 "填充色块" 时再用排线填满），接近白色的层不画。
+             线稿预览区会按各层颜色显示将要绘制的内容。
+           - 点击 "调色板..." 为每种颜色填写换色时依次点击的屏幕坐标（如 "1200,80"，
+             多个位置用分号分隔），或点击 "拾取" 后 3 秒内把鼠标移到目标软件的颜色上。
+           - 绘制时每层开始前点击一次对应的颜色，整幅画只换色 "层数" 次。此模式下不做绘制后校验。
+        11. 绘制队列 (可选):
+           - 点击 "绘制队列..." 打开队列窗口。填写起点 X/Y（或点击 "拾取起点" 后 3 秒内把鼠标移到画布上）
+             和缩放比例，再点击 "加入当前计划" 或 "从文件添加..." 加入任务；选中任务可修改位置、调整顺序或移除。
+           - 窗口下方显示所有未完成任务的预计总用时。点击 "开始/继续队列" 并确认一次后，
+             程序依次绘制全部任务，中间不需要操作；每个任务的状态实时显示在列表中。
+           - 按 ESC 或 "暂停队列" 暂停，当前任务记下断点；再次点击 "开始/继续队列" 从断点继续并画完其余任务。
 
         提示:
         - 确保目标绘画程序窗口是激活的，并且有足够的空间进行绘画。
         - 绘画速度受 "绘制延迟" 和 "像素跳跃" 参数以及图像复杂度的影响。
         - 如果线稿效果不佳，尝试调整 "线稿参数" 并重新生成。
-        - "反转颜色" 对于处理扫描的白色纸张上的黑色笔迹非常有用。
+        - "反转颜色" 便于对照白纸上的黑色笔迹查看线稿，绘制的笔画与不反转时相同。
         """
         messagebox.showinfo("帮助/说明", help_text)
 
     def on_close(self):
         global drawing_active, app_running, keyboard_listener_thread
-        if drawing_active:
+        if drawing_busy():
             if messagebox.askyesno("退出", "绘画正在进行中，确定要退出吗？"):
-                drawing_active = False # 尝试停止绘画
+                stop_drawing("退出") # 尝试停止绘画
                 app_running = False # 设置标志以停止监听器
                 if drawing_thread and drawing_thread.is_alive():
                     drawing_thread.join(timeout=1) # 等待线程一小段时间
@@ -591,8 +4572,187 @@ class AutoDrawerApp:
         # 如果不是守护线程，并且 listener.join() 不起作用，可能需要更复杂的机制。
         # 对于此应用，daemon=True 应该足够了。
 
+# --- 命令行批处理 ---
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+
+def collect_input_files(paths, recursive=False):
+    # 展开文件和目录参数，按出现顺序去重
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            if recursive:
+                for dirpath, dirnames, filenames in os.walk(path):
+                    dirnames.sort()
+                    files.extend(os.path.join(dirpath, name) for name in sorted(filenames))
+            else:
+                files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)))
+        else:
+            files.append(path)
+    files = [f for f in files if f.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(f)]
+    return list(dict.fromkeys(files))
+
+def plan_image_file(path, output_dir, options):
+    # 单个文件：生成线稿 -> 编译笔画计划 -> 写出计划和预览图。在进程池中运行，只使用可序列化的参数
+    t0 = time.perf_counter()
+    result = {"file": path}
+    try:
+        base = os.path.splitext(os.path.basename(path))[0]
+        with Image.open(path) as image:
+            image.load()
+            source_hash = image_digest(image)
+            # 需要排线时线稿和排线共用同一张模糊灰度图；否则交给 convert_to_linework（分块时模糊也并行完成）
+            blurred = prepare_linework_source(image) if options["hatch_levels"] else None
+            linework = convert_to_linework(image, options["threshold1"], options["threshold2"],
+                                           blurred_image=blurred, tiled=options["tiled"])
+            color_source = image.convert("RGB") if options["colors"] else None
+        if linework is None:
+            raise ValueError("线稿生成失败")
+        t1 = time.perf_counter()
+        if color_source is not None:
+            color_settings = {"simplify_mode": options["simplify_mode"], "pixel_skip": options["pixel_skip"],
+                              "simplify_tolerance": options["tolerance"], "optimize_order": options["optimize_order"],
+                              "trace_mode": options["trace_mode"], "hatch_spacing": options["hatch_spacing"],
+                              "hatch_angle": options["hatch_angle"], "speck_size": options["speck_size"],
+                              "join_gap": options["join_gap"]}
+            plan = compile_color_plan(color_source, options["colors"], color_settings, options["color_fill"])
+        else:
+            plan = compile_stroke_plan(linework, False, options["simplify_mode"], options["pixel_skip"],
+                                       options["tolerance"], options["optimize_order"], options["trace_mode"],
+                                       options["hatch_levels"], options["hatch_spacing"], options["hatch_angle"], blurred,
+                                       options["speck_size"], options["join_gap"])
+        t2 = time.perf_counter()
+        plan_path = os.path.join(output_dir, base + PLAN_FILE_EXTENSION)
+        metadata = {"source": os.path.abspath(path), "source_hash": source_hash,
+                    "threshold1": options["threshold1"], "threshold2": options["threshold2"],
+                    "plan_settings": {k: options[k] for k in ("simplify_mode", "pixel_skip", "tolerance",
+                                                              "optimize_order", "trace_mode", "hatch_levels",
+                                                              "hatch_spacing", "hatch_angle", "speck_size",
+                                                              "join_gap", "colors", "color_fill")}}
+        save_stroke_plan(plan, plan_path, metadata)
+        if options["preview"]:
+            linework_to_pil(linework, options["invert"]).save(os.path.join(output_dir, base + "_linework.png"))
+            plan.render().save(os.path.join(output_dir, base + "_plan.png"))
+        result.update(plan=plan_path, strokes=plan.stroke_count, points=plan.point_count,
+                      cleanup=describe_cleanup(plan.stats), pen_up=round(plan.pen_up_distance(), 1),
+                      linework_seconds=round(t1 - t0, 3),
+                      plan_seconds=round(t2 - t1, 3), seconds=round(time.perf_counter() - t0, 3))
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+def _init_cli_worker():
+    # 每个进程各处理一个文件，OpenCV 内部不再开多线程，避免核心超额订阅
+    cv2.setNumThreads(1)
+
+def replay_plan_file(args):
+    # 命令行回放：载入（内存映射）计划，直接逐条交给后端
+    try:
+        start_x, start_y = (int(v) for v in args.at.split(","))
+    except ValueError:
+        print(f"无效的起点坐标: {args.at}", file=sys.stderr)
+        return 2
+    t0 = time.perf_counter()
+    plan = load_stroke_plan(args.replay)
+    print(f"载入 {args.replay}: {plan.describe()}，用时 {(time.perf_counter() - t0) * 1000:.1f}ms")
+    options = {"path": args.svg} if args.backend == "svg" else {}
+    backend = create_drawing_backend(args.backend, **options)
+    backend.begin()
+    try:
+        # 彩色分层计划按层设置颜色（svg 后端写入颜色），命令行回放不点击调色板
+        color_layers = plan.stats.get("color_layers")
+        color_switcher = ColorSwitcher(color_layers, pause=0) if color_layers else None
+        strokes_done, points_done = execute_strokes(plan, backend, start_x, start_y, args.delay,
+                                                    color_switcher=color_switcher)
+    finally:
+        backend.end()
+    print(f"已绘制 {strokes_done} 条笔画 / {points_done} 个点。{backend.summary()}")
+    return 0
+
+def cli_main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog="auto_drawer.py",
+                                     description="批量为图片生成线稿和笔画计划（不启动界面）。不带参数运行时启动图形界面。")
+    parser.add_argument("inputs", nargs="*", help="图片文件或目录")
+    parser.add_argument("-o", "--output", default="plans", help="输出目录 (默认: plans)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="递归处理子目录")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1, help="进程数 (默认: CPU 核数)")
+    parser.add_argument("--threshold1", type=float, default=50, help="Canny 阈值1 (默认: 50)")
+    parser.add_argument("--threshold2", type=float, default=150, help="Canny 阈值2 (默认: 150)")
+    parser.add_argument("--invert", action="store_true", help="预览线稿图使用黑线白底（不影响笔画计划）")
+    parser.add_argument("--tiled", action="store_true", help="大图分块并行处理")
+    parser.add_argument("--trace-mode", choices=sorted(set(TRACE_MODES.values())), default="contour")
+    parser.add_argument("--simplify-mode", choices=sorted(set(SIMPLIFY_MODES.values())), default="skip")
+    parser.add_argument("--pixel-skip", type=int, default=1)
+    parser.add_argument("--tolerance", type=float, default=1.0, help="误差容限 (像素)")
+    parser.add_argument("--no-optimize", action="store_true", help="不优化笔画顺序")
+    parser.add_argument("--hatch-levels", type=int, default=0, help="色调排线层数，0 表示不填充暗部 (默认: 0)")
+    parser.add_argument("--hatch-spacing", type=int, default=6, help="排线间距 (像素，默认: 6)")
+    parser.add_argument("--hatch-angle", type=float, default=45, help="排线基准角度 (度，默认: 45)")
+    parser.add_argument("--speck-size", type=int, default=4, help="去除小于该尺寸的杂点 (像素，0 表示不去除，默认: 4)")
+    parser.add_argument("--join-gap", type=int, default=2, help="连接端点相距不超过该距离的笔画 (像素，0 表示不连接，默认: 2)")
+    parser.add_argument("--colors", type=int, default=0, help="彩色分层的颜色数，0 表示只画线稿 (默认: 0)")
+    parser.add_argument("--color-fill", action="store_true", help="彩色分层时用排线填充色块")
+    parser.add_argument("--no-preview", action="store_true", help="不输出预览 PNG")
+    parser.add_argument("--timing", action="store_true", help="打印启动与各文件耗时")
+    replay = parser.add_argument_group("回放已保存的笔画计划")
+    replay.add_argument("--replay", metavar="PLAN", help=f"把 {PLAN_FILE_EXTENSION} 文件交给输出后端绘制，而不是处理图片")
+    replay.add_argument("--at", default="0,0", help="绘制起点屏幕坐标 X,Y (默认: 0,0)")
+    replay.add_argument("--backend", choices=sorted(DRAWING_BACKENDS), default="svg", help="输出后端 (默认: svg)")
+    replay.add_argument("--svg", default="replay.svg", help="svg 后端的输出文件")
+    replay.add_argument("--delay", type=float, default=0, help="笔画间延迟 (毫秒)")
+    args = parser.parse_args(argv)
+    if args.timing:
+        print(f"启动耗时: {(time.perf_counter() - _module_start) * 1000:.0f}ms (自模块加载起)")
+    if args.replay:
+        return replay_plan_file(args)
+    if not args.inputs:
+        parser.error("需要至少一个图片文件或目录")
+
+    files = collect_input_files(args.inputs, args.recursive)
+    if not files:
+        print("没有找到可处理的图片。", file=sys.stderr)
+        return 2
+    os.makedirs(args.output, exist_ok=True)
+    options = {
+        "threshold1": args.threshold1, "threshold2": args.threshold2, "invert": args.invert, "tiled": args.tiled,
+        "trace_mode": args.trace_mode, "simplify_mode": args.simplify_mode, "pixel_skip": args.pixel_skip,
+        "tolerance": args.tolerance, "optimize_order": not args.no_optimize, "preview": not args.no_preview,
+        "hatch_levels": max(0, args.hatch_levels), "hatch_spacing": max(1, args.hatch_spacing), "hatch_angle": args.hatch_angle,
+        "speck_size": max(0, args.speck_size), "join_gap": max(0, args.join_gap),
+        "colors": max(0, args.colors), "color_fill": args.color_fill,
+    }
+
+    t0 = time.perf_counter()
+    workers = max(1, min(args.workers, len(files)))
+    if workers == 1: # 单个文件时不启动进程池，省去创建进程的开销
+        results = (plan_image_file(f, args.output, options) for f in files)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_cli_worker)
+        results = pool.map(plan_image_file, files, [args.output] * len(files), [options] * len(files))
+    failures = 0
+    for result in results:
+        if "error" in result:
+            failures += 1
+            print(f"{result['file']}: 失败 - {result['error']}", file=sys.stderr)
+            continue
+        line = f"{result['file']}: {result['strokes']} 条笔画 / {result['points']} 个点 -> {result['plan']}"
+        if result["cleanup"]:
+            line += f" ({result['cleanup']})"
+        if args.timing:
+            line += f" (线稿 {result['linework_seconds']}s, 计划 {result['plan_seconds']}s)"
+        print(line)
+    if workers > 1:
+        pool.shutdown()
+    if args.timing:
+        print(f"共 {len(files)} 个文件，{workers} 个进程，用时 {time.perf_counter() - t0:.2f} 秒")
+    return 1 if failures else 0
+
 # --- 主程序入口 ---
 if __name__ == "__main__":
+    if len(sys.argv) > 1: # 带参数时作为命令行批处理运行，不加载界面
+        sys.exit(cli_main(sys.argv[1:]))
+    load_gui_modules()
+    load_input_modules()
     root = tk.Tk()
     app = AutoDrawerApp(root) # 将 app 实例赋给全局变量，以便其他函数访问
     
@@ -0,0 +1,80 @@
+# 屏幕截图吞吐量测试
+#
+# 对多个区域尺寸反复截图，比较各截图后端的每秒帧数。grab 测的是后端原始输出（BGRA 数组），
+# gray 额外包含转换为灰度（写入复用的数组）的开销，即校验/镜像模式实际使用的路径。
+# 用法:
+#   xvfb-run -s "-screen 0 1920x1080x24" python benchmarks/bench_capture.py
+#   python benchmarks/bench_capture.py --xvfb
+#   python benchmarks/bench_capture.py --backends xshm,imagegrab --sizes 256x256,1920x1080 --frames 200
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_injection import start_xvfb
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def measure_fps(func, frames):
+    func() # 预热：首次调用会分配缓冲区
+    t0 = time.perf_counter()
+    for _ in range(frames):
+        func()
+    elapsed = time.perf_counter() - t0
+    return frames / elapsed if elapsed > 0 else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="屏幕截图吞吐量测试")
+    parser.add_argument("--backends", default="xshm,mss,imagegrab", help="逗号分隔的截图后端名称")
+    parser.add_argument("--sizes", default="256x256,800x600,1920x1080", help="逗号分隔的区域尺寸 宽x高")
+    parser.add_argument("--frames", type=int, default=100, help="每项截图次数")
+    parser.add_argument("--xvfb", action="store_true", help="自动启动 Xvfb :99")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    xvfb = start_xvfb() if args.xvfb else None
+    try:
+        if not os.environ.get("DISPLAY"):
+            sys.exit("没有可用的 DISPLAY，请在 Xvfb 下运行或使用 --xvfb。")
+        import auto_drawer as ad
+
+        results = []
+        for name in [b.strip() for b in args.backends.split(",") if b.strip()]:
+            try:
+                capture = ad.create_capture_backend(name)
+            except Exception as e:
+                print(f"{name:>10}: 不可用 ({e})")
+                continue
+            try:
+                for size in args.sizes.split(","):
+                    width, height = parse_size(size)
+                    bbox = (0, 0, width, height)
+                    gray = np.empty((height, width), dtype=np.uint8)
+                    grab_fps = measure_fps(lambda: capture.grab(bbox), args.frames)
+                    gray_fps = measure_fps(lambda: capture.grab_gray(bbox, gray), args.frames)
+                    results.append({"backend": name, "width": width, "height": height,
+                                    "grab_fps": round(grab_fps, 1), "gray_fps": round(gray_fps, 1)})
+                    print(f"{name:>10} {width}x{height}: grab {grab_fps:8.1f} 帧/秒 "
+                          f"({1000 / grab_fps:.2f}ms), gray {gray_fps:8.1f} 帧/秒")
+            finally:
+                capture.close()
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# 鼠标事件注入吞吐量测试
+#
+# 在 Xvfb 虚拟显示上分别用 pyautogui 和 XTest 后端绘制同一组合成笔画，输出每秒事件数。
+# 用法:
+#   xvfb-run -s "-screen 0 1920x1080x24" python benchmarks/bench_injection.py
+#   python benchmarks/bench_injection.py --xvfb          # 自动启动 Xvfb :99
+#   python benchmarks/bench_injection.py --backends xtest --rate 0 --points 50000
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def start_xvfb(display=":99", screen="1920x1080x24"):
+    # 启动 Xvfb 并设置 DISPLAY，必须在导入 auto_drawer（pyautogui/pynput）之前调用
+    if shutil.which("Xvfb") is None:
+        sys.exit("未找到 Xvfb，请先安装 (例如 apt install xvfb)。")
+    proc = subprocess.Popen(["Xvfb", display, "-screen", "0", screen, "-nolisten", "tcp"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.environ["DISPLAY"] = display
+    time.sleep(1.0) # 等待 X 服务器就绪
+    return proc
+
+
+def make_strokes(stroke_count, points_per_stroke, size=800, seed=0):
+    # 生成随机游走笔画，模拟线稿中的轮廓
+    rng = np.random.default_rng(seed)
+    strokes = []
+    for _ in range(stroke_count):
+        start = rng.integers(50, size - 50, 2)
+        steps = rng.integers(-2, 3, (points_per_stroke, 2))
+        strokes.append(np.clip(start + np.cumsum(steps, axis=0), 0, size - 1).astype(np.int32))
+    return strokes
+
+
+def run_backend(ad, name, strokes, options):
+    backend = ad.create_drawing_backend(name, **options)
+    backend.begin()
+    t0 = time.perf_counter()
+    try:
+        strokes_done, points_done = ad.execute_strokes(strokes, backend, 100, 100)
+    finally:
+        elapsed = time.perf_counter() - t0
+        backend.end()
+    # 每条笔画额外有 移动 + 按下 + 抬起 三个事件
+    events = points_done + 2 * strokes_done
+    return {
+        "backend": name,
+        "actual_backend": backend.name,
+        "strokes": strokes_done,
+        "points": points_done,
+        "events": events,
+        "seconds": round(elapsed, 4),
+        "events_per_second": round(events / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="鼠标事件注入吞吐量测试")
+    parser.add_argument("--backends", default="pyautogui,xtest", help="逗号分隔的后端名称")
+    parser.add_argument("--strokes", type=int, default=50, help="笔画数")
+    parser.add_argument("--points", type=int, default=10000, help="总点数")
+    parser.add_argument("--rate", type=int, default=0, help="XTest 事件/秒上限，0 表示不限速")
+    parser.add_argument("--batch", type=int, default=64, help="XTest 每批事件数")
+    parser.add_argument("--xvfb", action="store_true", help="自动启动 Xvfb :99")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    xvfb = start_xvfb() if args.xvfb else None
+    try:
+        if not os.environ.get("DISPLAY"):
+            sys.exit("没有可用的 DISPLAY，请在 Xvfb 下运行或使用 --xvfb。")
+        import auto_drawer as ad
+
+        strokes = make_strokes(args.strokes, max(2, args.points // args.strokes))
+        results = []
+        for name in [b.strip() for b in args.backends.split(",") if b.strip()]:
+            options = {}
+            if name == "pyautogui":
+                options = {"pause": 0.0, "restore_mouse": False}
+            elif name == "xtest":
+                options = {"max_events_per_second": args.rate, "batch_size": args.batch, "restore_mouse": False}
+            result = run_backend(ad, name, strokes, options)
+            results.append(result)
+            print(f"{name:>10} ({result['actual_backend']}): {result['events']} 个事件, "
+                  f"{result['seconds']:.3f} 秒, {result['events_per_second']} 事件/秒")
+
+        by_name = {r["backend"]: r for r in results}
+        if "pyautogui" in by_name and "xtest" in by_name and by_name["pyautogui"]["events_per_second"]:
+            gain = by_name["xtest"]["events_per_second"] / by_name["pyautogui"]["events_per_second"]
+            print(f"XTest 相对 pyautogui 的吞吐量提升: {gain:.1f}x")
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# 首笔延迟与停止延迟测试
+#
+# 首笔延迟：分别测量“完整编译笔画计划后再画”和“边规划边绘制”从开始到第一条笔画落下的时间。
+# 停止延迟：用模拟每个鼠标事件耗时的后端绘制，在随机时刻取消，测量取消到注入循环真正返回的时间。
+# 不需要图形环境，合成输入与 bench_pipeline.py 相同。
+# 用法:
+#   python benchmarks/bench_latency.py
+#   python benchmarks/bench_latency.py --sizes 1024,4k --inputs noise --event-cost-us 500 --cancels 20
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_pipeline import INPUT_GENERATORS, parse_size
+
+
+def make_linework(ad, width, height, input_name, seed):
+    rng = np.random.default_rng(seed)
+    pil_image = Image.fromarray(INPUT_GENERATORS[input_name](width, height, rng))
+    return ad.convert_to_linework(pil_image, 50, 150)
+
+
+def first_stroke_full(ad, linework, settings):
+    # 原来的流程：整张图编译（含顺序优化）完成后才开始第一笔
+    t0 = time.perf_counter()
+    plan = ad.compile_stroke_plan(linework, **settings)
+    return time.perf_counter() - t0, plan.stroke_count
+
+
+def extraction_only(ad, linework, settings):
+    # 边规划边绘制在第一批之前仍要完整跑完提取、简化、连线和排线，这是它首笔延迟的下限
+    options = {k: v for k, v in settings.items() if k != "optimize_order"}
+    t0 = time.perf_counter()
+    ad.extract_plan_strokes(linework, **options)
+    return time.perf_counter() - t0
+
+
+def first_stroke_streamed(ad, linework, settings):
+    t0 = time.perf_counter()
+    stream = ad.StrokeStream.from_linework(linework, settings)
+    next(stream.iter_strokes(), None)
+    elapsed = time.perf_counter() - t0
+    stream.abandon()
+    return elapsed
+
+
+def make_simulated_backend(ad, event_cost):
+    # 每个鼠标事件占用固定时间（忙等），近似真实注入的开销
+    class SimulatedBackend(ad.DrawingBackend):
+        name = "simulated"
+
+        def _event(self):
+            deadline = time.perf_counter() + event_cost
+            while time.perf_counter() < deadline:
+                pass
+
+        def move_to(self, x, y):
+            self._event()
+
+        def mouse_down(self):
+            self._event()
+
+        def drag_to(self, x, y):
+            self._event()
+
+        def mouse_up(self):
+            self._event()
+
+    return SimulatedBackend()
+
+
+def stop_latencies(ad, plan, event_cost, cancels, rng):
+    latencies = []
+    backend = make_simulated_backend(ad, event_cost)
+    for _ in range(cancels):
+        token = ad.CancellationToken()
+        timer = threading.Timer(float(rng.uniform(0.05, 0.3)), token.cancel)
+        timer.start()
+        ad.execute_strokes(plan, backend, 0, 0, 0, token)
+        stopped = time.perf_counter()
+        timer.cancel()
+        if token.cancelled:
+            latencies.append(stopped - token.cancelled_at)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="首笔延迟与停止延迟测试")
+    parser.add_argument("--sizes", default="1024,2048,4k", help="逗号分隔的尺寸，如 1024,4k,8k")
+    parser.add_argument("--inputs", default="text,noise,hatching", help="逗号分隔的输入类型: " + ",".join(INPUT_GENERATORS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--event-cost-us", type=float, default=200, help="模拟每个鼠标事件的耗时（微秒）")
+    parser.add_argument("--cancels", type=int, default=10, help="每项测量停止延迟的次数")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    import auto_drawer as ad
+
+    settings = {"invert": False, "simplify_mode": "skip", "pixel_skip": 1, "simplify_tolerance": 1.0,
+                "optimize_order": True, "trace_mode": "contour"}
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for size_text in args.sizes.split(","):
+        width, height = parse_size(size_text)
+        for input_name in [name.strip() for name in args.inputs.split(",") if name.strip()]:
+            linework = make_linework(ad, width, height, input_name, args.seed)
+            full_seconds, stroke_count = first_stroke_full(ad, linework, settings)
+            extract_seconds = extraction_only(ad, linework, settings)
+            stream_seconds = first_stroke_streamed(ad, linework, settings)
+            plan = ad.compile_stroke_plan(linework, **settings)
+            latencies = stop_latencies(ad, plan, args.event_cost_us / 1e6, args.cancels, rng) if plan.stroke_count else []
+            result = {"input": input_name, "width": width, "height": height, "strokes": stroke_count,
+                      "first_stroke_full": round(full_seconds, 4), "first_stroke_streamed": round(stream_seconds, 4),
+                      "extraction": round(extract_seconds, 4),
+                      "stop_latency_median": round(statistics.median(latencies), 5) if latencies else None,
+                      "stop_latency_max": round(max(latencies), 5) if latencies else None}
+            results.append(result)
+            stop_text = (f"停止延迟 中位 {result['stop_latency_median'] * 1000:.2f}ms / 最大 {result['stop_latency_max'] * 1000:.2f}ms"
+                         if latencies else "停止延迟 -")
+            print(f"{input_name:>9} {width}x{height}: {stroke_count} 条笔画, 首笔延迟 完整编译 {full_seconds * 1000:.0f}ms"
+                  f" -> 边规划边绘制 {stream_seconds * 1000:.0f}ms (其中提取 {extract_seconds * 1000:.0f}ms), {stop_text}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
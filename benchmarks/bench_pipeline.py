@@ -0,0 +1,269 @@
+# 线稿与笔画计划流水线基准测试
+#
+# 生成合成输入（文字、类照片噪声、密集排线；256px 到 8K），不需要图形环境，逐阶段运行流水线，
+# 记录每个阶段的耗时、内存峰值，以及笔画数、点数和抬笔距离，写入 JSON 结果文件；
+# 指定基线文件时输出对比报告，发现退化时以非零状态退出，便于在发布前检查。
+# 用法:
+#   python benchmarks/bench_pipeline.py --json results.json
+#   python benchmarks/bench_pipeline.py --sizes 256,1024,4k,8k --inputs text,hatching
+#   python benchmarks/bench_pipeline.py --json new.json --baseline baseline.json
+#   python benchmarks/bench_pipeline.py --save-baseline baseline.json
+#
+# 内存峰值来自 tracemalloc，只统计 Python 与 numpy 的分配，OpenCV 内部分配不计入；
+# max_rss_mb 是进程常驻内存的历史最大值，可作为补充参考。
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SIZE_ALIASES = {"1k": 1024, "2k": 2048, "4k": 3840, "8k": 7680}
+STAGES = ["preprocess", "canny", "trace", "simplify", "order", "execute"]
+
+
+def parse_size(text):
+    # 边长；"4k"/"8k" 表示 16:9 的 UHD 尺寸，其余为正方形
+    text = text.strip().lower()
+    if text in SIZE_ALIASES:
+        width = SIZE_ALIASES[text]
+        return width, width * 9 // 16
+    side = int(text)
+    return side, side
+
+
+def make_text_image(width, height, rng):
+    # 白底黑字，字号与行距随图像尺寸缩放
+    image = np.full((height, width, 3), 255, np.uint8)
+    scale = max(0.4, width / 1600)
+    line_height = int(40 * scale) + 4
+    words = ["auto", "drawer", "linework", "canny", "stroke", "plan", "benchmark", "0123456789"]
+    for y in range(line_height, height, line_height):
+        x = int(rng.integers(0, 20))
+        while x < width:
+            word = words[int(rng.integers(len(words)))]
+            cv2.putText(image, word, (x, y), cv2.FONT_HERSHEY_SIMPLEX, scale, (0, 0, 0), max(1, int(2 * scale)))
+            x += int(len(word) * 22 * scale) + int(20 * scale)
+    return image
+
+
+def make_noise_image(width, height, rng):
+    # 多尺度平滑噪声叠加，边缘密度接近照片
+    image = np.zeros((height, width), np.float32)
+    for cell, weight in ((32, 1.0), (8, 0.6), (2, 0.4)):
+        small = rng.random((max(2, height // cell), max(2, width // cell))).astype(np.float32)
+        image += weight * cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    image = cv2.normalize(image, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+
+
+def make_hatching_image(width, height, rng):
+    # 多组不同角度的平行细线，模拟密集排线
+    image = np.full((height, width, 3), 255, np.uint8)
+    spacing = 6
+    diagonal = width + height
+    for angle in rng.uniform(0, np.pi, 3):
+        dx, dy = np.cos(angle), np.sin(angle)
+        for offset in range(-diagonal, diagonal, spacing):
+            cx, cy = width / 2 - dy * offset, height / 2 + dx * offset
+            p1 = (int(cx - dx * diagonal), int(cy - dy * diagonal))
+            p2 = (int(cx + dx * diagonal), int(cy + dy * diagonal))
+            cv2.line(image, p1, p2, (0, 0, 0), 1)
+    return image
+
+
+INPUT_GENERATORS = {
+    "text": make_text_image,
+    "noise": make_noise_image,
+    "hatching": make_hatching_image,
+}
+
+
+def measure(func, *args, **kwargs):
+    # 返回 (结果, 秒数, tracemalloc 峰值 MB)
+    tracemalloc.reset_peak()
+    t0 = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    return result, elapsed, peak / (1024 * 1024)
+
+
+def max_rss_mb():
+    try:
+        import resource
+    except ImportError: # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_case(ad, pil_image, args):
+    # 逐阶段运行一次流水线，返回 {阶段: (秒数, 峰值MB)} 和计数
+    stages = {}
+    blurred, t, m = measure(ad.prepare_linework_source, pil_image)
+    stages["preprocess"] = (t, m)
+    linework, t, m = measure(ad.convert_to_linework, pil_image, args.threshold1, args.threshold2,
+                             blurred_image=blurred, tiled=args.tiled)
+    stages["canny"] = (t, m)
+    if args.trace_mode == "centerline":
+        polylines, t, m = measure(ad.extract_centerline_polylines, linework, False)
+    else:
+        polylines, t, m = measure(ad.extract_contour_polylines, linework, False)
+    stages["trace"] = (t, m)
+    (strokes, points_before, points_after), t, m = measure(ad.simplify_strokes, polylines, args.simplify_mode,
+                                                           args.pixel_skip, args.tolerance)
+    stages["simplify"] = (t, m)
+    pen_up_before = ad.pen_up_distance(strokes)
+    if len(strokes) > 1:
+        (strokes, order_stats), t, m = measure(ad.optimize_stroke_order, strokes, time_limit=args.order_time_limit)
+        pen_up_after = order_stats["after"]
+    else:
+        t, m, pen_up_after = 0.0, 0.0, pen_up_before
+    stages["order"] = (t, m)
+    # 基类后端不输出任何事件，只测量 execute_strokes 的逐点循环本身
+    _, t, m = measure(ad.execute_strokes, strokes, ad.DrawingBackend(), 0, 0)
+    stages["execute"] = (t, m)
+    counts = {
+        "polylines": len(polylines),
+        "strokes": len(strokes),
+        "points_before": int(points_before),
+        "points": int(points_after),
+        "edge_pixels": int(np.count_nonzero(np.asarray(linework))),
+        "pen_up_before": round(float(pen_up_before), 1),
+        "pen_up": round(float(pen_up_after), 1),
+    }
+    return stages, counts
+
+
+def run_benchmarks(ad, args):
+    results = []
+    for size_text in args.sizes.split(","):
+        width, height = parse_size(size_text)
+        for input_name in args.inputs.split(","):
+            input_name = input_name.strip()
+            rng = np.random.default_rng(args.seed)
+            pil_image = Image.fromarray(INPUT_GENERATORS[input_name](width, height, rng))
+            runs = [run_case(ad, pil_image, args) for _ in range(args.repeat)]
+            counts = runs[-1][1]
+            stages = {}
+            for stage in STAGES:
+                times = [r[0][stage][0] for r in runs]
+                peaks = [r[0][stage][1] for r in runs]
+                stages[stage] = {"seconds": round(statistics.median(times), 4),
+                                 "peak_mb": round(max(peaks), 2)}
+            total = sum(s["seconds"] for s in stages.values())
+            result = {"input": input_name, "width": width, "height": height,
+                      "stages": stages, "total_seconds": round(total, 4), **counts}
+            results.append(result)
+            print(f"{input_name:>9} {width}x{height}: 共 {total:.3f} 秒, {counts['strokes']} 条笔画, "
+                  f"{counts['points']} 个点, 抬笔 {counts['pen_up']:.0f}px  "
+                  + " ".join(f"{stage}={stages[stage]['seconds']:.3f}s" for stage in STAGES))
+    return results
+
+
+def case_key(result):
+    return f"{result['input']}@{result['width']}x{result['height']}"
+
+
+def compare_with_baseline(results, baseline, threshold):
+    # 打印对比报告，返回退化项列表。耗时很短的阶段（< 5ms）波动大，不判定退化
+    base_by_key = {case_key(r): r for r in baseline["results"]}
+    regressions = []
+    print(f"\n与基线对比 (基线时间: {baseline.get('meta', {}).get('timestamp', '?')}, 退化阈值 {threshold:.2f}x):")
+    for result in results:
+        key = case_key(result)
+        base = base_by_key.get(key)
+        if base is None:
+            print(f"  {key}: 基线中没有该项")
+            continue
+        parts = []
+        for stage in STAGES:
+            new_t = result["stages"][stage]["seconds"]
+            old_t = base["stages"].get(stage, {}).get("seconds")
+            if not old_t:
+                continue
+            ratio = new_t / old_t
+            mark = ""
+            if ratio > threshold and new_t - old_t > 0.005:
+                mark = " !"
+                regressions.append(f"{key} {stage}: {old_t:.3f}s -> {new_t:.3f}s ({ratio:.2f}x)")
+            parts.append(f"{stage} {ratio:.2f}x{mark}")
+        for count in ("strokes", "points", "pen_up"):
+            old_c, new_c = base.get(count), result.get(count)
+            if old_c and new_c is not None and new_c > old_c * threshold:
+                regressions.append(f"{key} {count}: {old_c} -> {new_c}")
+                parts.append(f"{count} {old_c}->{new_c} !")
+        print(f"  {key}: " + ", ".join(parts))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="线稿与笔画计划流水线基准测试")
+    parser.add_argument("--sizes", default="256,1024,2048,4k", help="逗号分隔的尺寸，如 256,1024,4k,8k")
+    parser.add_argument("--inputs", default="text,noise,hatching", help="逗号分隔的输入类型: " + ",".join(INPUT_GENERATORS))
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，耗时取中位数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threshold1", type=float, default=50)
+    parser.add_argument("--threshold2", type=float, default=150)
+    parser.add_argument("--tiled", action="store_true", help="线稿阶段使用分块并行处理")
+    parser.add_argument("--trace-mode", choices=["contour", "centerline"], default="contour")
+    parser.add_argument("--simplify-mode", choices=["skip", "tolerance"], default="skip")
+    parser.add_argument("--pixel-skip", type=int, default=1)
+    parser.add_argument("--tolerance", type=float, default=1.0)
+    parser.add_argument("--order-time-limit", type=float, default=2.0, help="顺序优化的局部搜索时间上限 (秒)")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    parser.add_argument("--baseline", help="与该 JSON 基线对比")
+    parser.add_argument("--save-baseline", help="将本次结果另存为基线")
+    parser.add_argument("--threshold", type=float, default=1.25, help="判定退化的比例")
+    args = parser.parse_args()
+    unknown = [name for name in args.inputs.split(",") if name.strip() not in INPUT_GENERATORS]
+    if unknown:
+        parser.error(f"未知的输入类型: {','.join(unknown)}")
+
+    import auto_drawer as ad # 只加载处理流水线，不需要图形环境
+
+    tracemalloc.start()
+    results = run_benchmarks(ad, args)
+    tracemalloc.stop()
+    output = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "host": platform.node(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "cpu_count": os.cpu_count(),
+            "max_rss_mb": max_rss_mb(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(output, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.threshold)
+        if regressions:
+            print("\n发现退化:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\n没有发现退化。")
+
+
+if __name__ == "__main__":
+    main()
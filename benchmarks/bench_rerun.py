@@ -0,0 +1,122 @@
+# 截图预处理与重复生成线稿的耗时/内存测试
+#
+# 比较旧的预处理链（截图帧 -> PIL -> RGB 数组 -> BGR -> 灰度 -> 模糊，线稿反转后转回 PIL，
+# 规划时再转换为二值数组）和现在的路径（截图帧直接转灰度并原地模糊，线稿保持白线黑底数组，
+# 反转只用于显示）。rerun 是调整阈值或切换反转后重新生成线稿并交给笔画提取的部分。
+# 不需要图形环境，截图帧用合成的 BGRA 数组代替。
+# 用法:
+#   python benchmarks/bench_rerun.py
+#   python benchmarks/bench_rerun.py --sizes 4k,8k --inputs noise --repeat 10 --invert
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_pipeline import INPUT_GENERATORS, parse_size
+
+
+def make_frame(input_name, width, height, seed):
+    # 截图后端输出的 BGRA 帧
+    rgb = INPUT_GENERATORS[input_name](width, height, np.random.default_rng(seed))
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGRA)
+
+
+def legacy_capture(frame):
+    height, width = frame.shape[:2]
+    pil_image = Image.frombuffer("RGB", (width, height), frame, "raw", "BGRX", 0, 1).copy()
+    open_cv_image = cv2.cvtColor(np.array(pil_image.convert("RGB")), cv2.COLOR_RGB2BGR)
+    gray_image = cv2.cvtColor(open_cv_image, cv2.COLOR_BGR2GRAY)
+    return pil_image, cv2.GaussianBlur(gray_image, (5, 5), 0)
+
+
+def legacy_rerun(blurred, threshold1, threshold2, invert):
+    edges = cv2.Canny(blurred, threshold1, threshold2)
+    if invert:
+        edges = cv2.bitwise_not(edges)
+    linework = Image.fromarray(edges)
+    cv_image = np.array(linework.convert("L"))
+    if invert:
+        cv_image = cv2.bitwise_not(cv_image)
+    _, binary = cv2.threshold(cv_image, 127, 255, cv2.THRESH_BINARY)
+    return binary
+
+
+def current_capture(ad, frame):
+    height, width = frame.shape[:2]
+    pil_image = Image.frombuffer("RGB", (width, height), frame, "raw", "BGRX", 0, 1).copy()
+    gray = ad.to_gray_array(frame)
+    return pil_image, ad.prepare_linework_source(pil_image, gray)
+
+
+def current_rerun(ad, blurred, threshold1, threshold2, invert):
+    # invert 只影响显示，线稿和交给笔画提取的二值数组都不变
+    linework = ad.linework_from_blurred(blurred, threshold1, threshold2)
+    return ad.linework_to_binary(linework, False)
+
+
+def measure(func, repeat):
+    # 返回 (结果, 中位秒数, tracemalloc 峰值 MB)
+    times, peak = [], 0
+    for _ in range(repeat):
+        result = None
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        t0 = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t0)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    return result, statistics.median(times), peak / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="截图预处理与重复生成线稿的耗时/内存测试")
+    parser.add_argument("--sizes", default="1024,4k,8k", help="逗号分隔的尺寸，如 1024,4k,8k")
+    parser.add_argument("--inputs", default="noise", help="逗号分隔的输入类型: " + ",".join(INPUT_GENERATORS))
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复次数，耗时取中位数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--invert", action="store_true", help="以反转颜色（黑线白底）的设置生成线稿")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    import auto_drawer as ad
+
+    tracemalloc.start()
+    results = []
+    for size_text in args.sizes.split(","):
+        width, height = parse_size(size_text)
+        for input_name in [name.strip() for name in args.inputs.split(",") if name.strip()]:
+            frame = make_frame(input_name, width, height, args.seed)
+            (_, old_blurred), old_capture_t, old_capture_m = measure(lambda: legacy_capture(frame), args.repeat)
+            (_, new_blurred), new_capture_t, new_capture_m = measure(lambda: current_capture(ad, frame), args.repeat)
+            old_binary, old_rerun_t, old_rerun_m = measure(
+                lambda: legacy_rerun(old_blurred, 50, 150, args.invert), args.repeat)
+            new_binary, new_rerun_t, new_rerun_m = measure(
+                lambda: current_rerun(ad, new_blurred, 50, 150, args.invert), args.repeat)
+            if not np.array_equal(old_binary, new_binary):
+                print(f"警告: {input_name} {width}x{height} 新旧路径的线稿不一致")
+            result = {"input": input_name, "width": width, "height": height, "invert": args.invert,
+                      "capture_seconds": [round(old_capture_t, 4), round(new_capture_t, 4)],
+                      "capture_peak_mb": [round(old_capture_m, 1), round(new_capture_m, 1)],
+                      "rerun_seconds": [round(old_rerun_t, 4), round(new_rerun_t, 4)],
+                      "rerun_peak_mb": [round(old_rerun_m, 1), round(new_rerun_m, 1)]}
+            results.append(result)
+            print(f"{input_name:>9} {width}x{height}: 截图预处理 {old_capture_t * 1000:.0f}ms/{old_capture_m:.0f}MB"
+                  f" -> {new_capture_t * 1000:.0f}ms/{new_capture_m:.0f}MB, 每次重新生成 "
+                  f"{old_rerun_t * 1000:.1f}ms/{old_rerun_m:.0f}MB -> {new_rerun_t * 1000:.1f}ms/{new_rerun_m:.0f}MB")
+    tracemalloc.stop()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# 命令行模式启动耗时测试
+#
+# 多次启动新的 Python 进程，测量导入 auto_drawer 和运行命令行 --help 的耗时（中位数），
+# 列出最慢的导入模块，并检查命令行路径没有加载 tkinter / pyautogui / pynput。
+# 用法:
+#   python benchmarks/bench_startup.py
+#   python benchmarks/bench_startup.py --runs 20 --json startup.json
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GUI_MODULES = ("tkinter", "pyautogui", "pynput", "PIL.ImageTk")
+
+
+def time_command(cmd, runs):
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run(cmd, cwd=ROOT, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def slowest_imports(count):
+    # 解析 -X importtime 的输出：import time: self [us] | cumulative | imported package
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import auto_drawer"], cwd=ROOT,
+                          check=True, capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def loaded_gui_modules():
+    code = ("import sys, auto_drawer; "
+            f"print(','.join(m for m in {GUI_MODULES!r} if m in sys.modules))")
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True, capture_output=True, text=True)
+    return [m for m in proc.stdout.strip().split(",") if m]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="命令行模式启动耗时测试")
+    parser.add_argument("--runs", type=int, default=10, help="每项启动次数")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    results = {
+        "python_baseline": time_command([sys.executable, "-c", "pass"], args.runs),
+        "import_auto_drawer": time_command([sys.executable, "-c", "import auto_drawer"], args.runs),
+        "cli_help": time_command([sys.executable, "auto_drawer.py", "--help"], args.runs),
+    }
+    for name, seconds in results.items():
+        print(f"{name:>20}: {seconds * 1000:.0f}ms")
+    print("最慢的导入 (含子模块累计):")
+    for us, name in slowest_imports(8):
+        print(f"  {us / 1000:8.1f}ms  {name}")
+    gui = loaded_gui_modules()
+    if gui:
+        print(f"警告: 导入 auto_drawer 时加载了界面相关模块: {', '.join(gui)}")
+    else:
+        print("导入 auto_drawer 没有加载 tkinter / pyautogui / pynput。")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"seconds": results, "gui_modules_loaded": gui}, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if gui else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# XTest 后端的速率上限测试
+#
+# 在独立的 Xvfb 虚拟显示上用 XTestBackend 画一条笔画，检查空闲之后“事件/秒上限”仍然有效
+# （最多只积攒一批事件的额度），以及抬笔后指针停在最后一个笔画点。
+# 缺少 Xvfb 或 python-xlib 时跳过。
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("Xlib")
+if shutil.which("Xvfb") is None:
+    pytest.skip("未找到 Xvfb", allow_module_level=True)
+
+from Xlib import display as xdisplay
+
+import auto_drawer as ad
+
+
+@pytest.fixture
+def xvfb_display():
+    # 用 -displayfd 让 Xvfb 自己选空闲的显示号，读到显示号时服务器已就绪
+    read_fd, write_fd = os.pipe()
+    proc = subprocess.Popen(["Xvfb", "-displayfd", str(write_fd), "-screen", "0", "800x600x24", "-nolisten", "tcp"],
+                            pass_fds=(write_fd,), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.close(write_fd)
+    try:
+        with os.fdopen(read_fd) as f:
+            number = f.readline().strip()
+        if not number:
+            pytest.skip("Xvfb 启动失败")
+        yield f":{number}"
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def test_rate_ceiling_holds_after_idle(xvfb_display):
+    rate, batch_size = 2000, 64
+    rng = np.random.default_rng(0)
+    points = np.clip(300 + np.cumsum(rng.integers(-2, 3, (1000, 2)), axis=0), 0, 599).astype(np.int32)
+
+    backend = ad.XTestBackend(max_events_per_second=rate, batch_size=batch_size,
+                              display_name=xvfb_display, restore_mouse=False)
+    backend.begin()
+    try:
+        time.sleep(0.5) # 空闲时间不能换成一长串全速事件
+        events_before = backend.events_sent
+        t0 = time.perf_counter()
+        drawn = backend.draw_stroke(points, 0, 0, lambda: True)
+        elapsed = time.perf_counter() - t0
+        events = backend.events_sent - events_before
+    finally:
+        backend.end()
+
+    assert drawn == len(points)
+    assert events == len(points) + 2 # 起点移动 + 按下 + 拖动 + 抬起
+    assert elapsed >= (events - batch_size) / rate
+
+    d = xdisplay.Display(xvfb_display)
+    try:
+        pointer = d.screen().root.query_pointer()
+    finally:
+        d.close()
+    assert (pointer.root_x, pointer.root_y) == tuple(points[-1].tolist())